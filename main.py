@@ -3,6 +3,7 @@ from tkinter import ttk, messagebox, filedialog
 import sqlite3
 import os
 from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
 import webbrowser
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -11,743 +12,3421 @@ from reportlab.lib.colors import black, blue, HexColor
 import subprocess
 import sys
 import json
+import logging
+from logging.handlers import RotatingFileHandler
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from tkcalendar import Calendar, DateEntry
+from collections import OrderedDict, namedtuple
+import threading
+import queue
+import time
+from array import array
+import re
+from difflib import SequenceMatcher
+from xml.sax.saxutils import escape
+from string import Template
+import textwrap
 
-class FeeReceiptApp:
-    CLASS_OPTIONS = ["MINI KG", "JR KG", "SR KG"]
-    TOTAL_FEE = 19000
-    
-    def __init__(self, root):
-        self.root = root
-        self.root.title("Fee Receipt Generator - Offline")
-        self.root.geometry("1000x700")
-        self.root.configure(bg='#f0f0f0')
-        
-        # Initialize database
-        self.init_database()
-        
-        # Create main interface
-        self.create_widgets()
-        
-        # Register a font that supports the rupee symbol
-        try:
-            pdfmetrics.registerFont(TTFont('Arial', 'Arial.ttf'))
-            self.rupee_font = 'Arial'
-        except Exception:
-            # Fallback to default font if Arial is not found
-            self.rupee_font = 'Helvetica'
-            messagebox.showwarning("Font Warning", "Arial.ttf not found. Rupee symbol may not display correctly. Install 'Arial' font or place 'Arial.ttf' in the 'templates' folder.")
-    
-    def init_database(self):
-        """Initialize SQLite database and create tables if they don't exist"""
-        # Create directories
-        os.makedirs("db", exist_ok=True)
-        os.makedirs("receipts", exist_ok=True)
-        os.makedirs("templates", exist_ok=True)
-        
-        self.conn = sqlite3.connect("db/students.db")
-        self.cursor = self.conn.cursor()
-        
-        # Create students table (add parent_name, parent_number, parent_email if not exist)
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS students (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                class TEXT NOT NULL,
-                contact TEXT,
-                mother_name TEXT,
-                father_name TEXT,
-                parent_number TEXT,
-                parent_email TEXT,
-                created_date DATE DEFAULT CURRENT_DATE
-            )
-        ''')
-        # Try to add columns if they don't exist (for upgrades)
-        try:
-            self.cursor.execute('ALTER TABLE students ADD COLUMN mother_name TEXT')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE students ADD COLUMN father_name TEXT')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE students ADD COLUMN parent_number TEXT')
-        except sqlite3.OperationalError:
-            pass
+
+# Both counters may open the same database file; wait this long for the other's write lock
+BUSY_TIMEOUT_MS = 5000
+# Journal mode set on open. None keeps the file's own mode (a rollback journal by default);
+# 'wal' lets readers run alongside a writer but every copy must run on the same computer.
+JOURNAL_MODE = None
+
+
+def connect_database(path, busy_timeout_ms=BUSY_TIMEOUT_MS, journal_mode=JOURNAL_MODE, tracer=None):
+    """Open a connection that waits for locks held by other copies instead of failing at once"""
+    conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, factory=TracingConnection)
+    conn.tracer = tracer
+    if journal_mode:
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    return conn
+
+
+class QueryTracer:
+    """Collects per-statement timings and logs slow statements with their query plan.
+
+    Every statement run through a TracingCursor is counted in stats (keyed by its
+    SQL with whitespace collapsed). Statements slower than threshold_ms are written
+    as JSON lines to a rotating log, together with EXPLAIN QUERY PLAN and the method
+    that ran them.
+    """
+
+    PLANNED = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+    def __init__(self, log_path, threshold_ms=100, max_bytes=1_000_000, backup_count=3):
+        self.log_path = log_path
+        self.threshold = threshold_ms / 1000
+        self.lock = threading.Lock()
+        # sql -> [count, total seconds, max seconds, rows, caller]
+        self.stats = {}
+        self.logger = logging.getLogger(f"{__name__}.slow_queries.{id(self)}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count,
+                                      encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.addHandler(handler)
+
+    def log_files(self):
+        """The current log followed by its rotated backups, newest first"""
+        handler = self.logger.handlers[0]
+        paths = [self.log_path] + [f"{self.log_path}.{n}" for n in range(1, handler.backupCount + 1)]
+        return [path for path in paths if os.path.exists(path)]
+
+    def record(self, conn, sql, params, seconds, rows, caller, many):
+        key = " ".join(sql.split())
+        with self.lock:
+            entry = self.stats.get(key)
+            if entry is None:
+                self.stats[key] = [1, seconds, seconds, rows, caller]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+                entry[3] += rows
+        if seconds < self.threshold:
+            return
+        plan = []
+        if not many and key.split(' ', 1)[0].upper() in self.PLANNED:
+            try:
+                # A plain cursor, so explaining is not traced itself
+                rows_ = sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                depth = {0: -1}
+                for node, parent, _, detail in rows_:
+                    depth[node] = depth.get(parent, -1) + 1
+                    plan.append("  " * depth[node] + detail)
+            except sqlite3.Error as e:
+                plan.append(f"(no plan: {e})")
+        self.logger.info(json.dumps({'at': datetime.now().isoformat(timespec='seconds'), 'ms': round(seconds * 1000, 1),
+                                     'rows': rows, 'caller': caller, 'sql': key, 'plan': plan}))
+
+
+def calling_method():
+    """Name of the first method outside the tracing classes on the current stack"""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code in TRACING_CODE:
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    return getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's time and row count to its connection's tracer.
+
+    A query's time includes fetching its rows, so a statement is only reported once
+    it is finished: its rows are exhausted, the cursor runs the next statement, or
+    the cursor is closed.
+    """
+
+    current = None
+
+    def finish(self):
+        current, self.current = self.current, None
+        if current is not None:
+            sql, params, seconds, rows, caller, many = current
+            if many or self.description is None:
+                rows = max(self.rowcount, 0)
+            self.connection.tracer.record(self.connection, sql, params, seconds, rows, caller, many)
+
+    def trace(self, run, sql, params, many):
+        tracer = self.connection.tracer
+        if tracer is None:
+            return run(sql, params)
+        self.finish()
+        caller = calling_method()
+        started = time.perf_counter()
+        run(sql, params)
+        self.current = [sql, params, time.perf_counter() - started, 0, caller, many]
+        if many or self.description is None:
+            self.finish()
+        return self
+
+    def execute(self, sql, parameters=()):
+        return self.trace(super().execute, sql, parameters, False)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.trace(super().executemany, sql, seq_of_parameters, True)
+
+    def fetched(self, started, rows, done):
+        if self.current is not None:
+            self.current[2] += time.perf_counter() - started
+            self.current[3] += rows
+            if done:
+                self.finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self.fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self.fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
         try:
-            self.cursor.execute('ALTER TABLE students ADD COLUMN parent_email TEXT')
-        except sqlite3.OperationalError:
-            pass
-        # Remove the old parent_name column if it exists (optional, but good for cleanup)
-        # Note: SQLite doesn't directly support dropping columns easily. A common workaround is
-        # to create a new table, copy data, drop the old table, and rename the new one.
-        # For simplicity here, we'll just add the new columns and ignore the old one in code.
-        # If a clean migration is needed, more complex SQL would be required.
-        # Keeping the old column won't break the app but is less clean.
-        # Let's check if parent_name exists and, if so, create a new table structure without it
-        self.cursor.execute("PRAGMA table_info(students)")
-        columns = [info[1] for info in self.cursor.fetchall()]
-        if 'parent_name' in columns:
-            self.cursor.execute('''
-                CREATE TABLE students_new (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    class TEXT NOT NULL,
-                    contact TEXT,
-                    mother_name TEXT,
-                    father_name TEXT,
-                    parent_number TEXT,
-                    parent_email TEXT,
-                    created_date DATE DEFAULT CURRENT_DATE
-                )
-            ''')
-            self.cursor.execute('''
-                INSERT INTO students_new (id, name, class, contact, parent_number, parent_email, created_date)
-                SELECT id, name, class, contact, parent_number, parent_email, created_date FROM students
-            ''')
-            self.cursor.execute('DROP TABLE students')
-            self.cursor.execute('ALTER TABLE students_new RENAME TO students')
-        
-        # Create payments table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id INTEGER,
-                due_date DATE,
-                paid_date DATE,
-                amount REAL NOT NULL,
-                status TEXT DEFAULT 'Pending',
-                receipt_path TEXT,
-                created_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (student_id) REFERENCES students (id)
-            )
-        ''')
-        
-        # Try to add payment_mode column if it doesn't exist
+            row = super().__next__()
+        except StopIteration:
+            self.fetched(started, 0, True)
+            raise
+        self.fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def __del__(self):
+        # Statements read with a single fetchone() are reported when the cursor goes away
         try:
-            self.cursor.execute('ALTER TABLE payments ADD COLUMN payment_mode TEXT')
-        except sqlite3.OperationalError:
+            self.finish()
+        except Exception:
             pass
-        
-        self.conn.commit()
-    
-    def create_widgets(self):
-        """Create the main GUI interface"""
-        # Create notebook for tabs
-        notebook = ttk.Notebook(self.root)
-        notebook.pack(fill='both', expand=True, padx=10, pady=10)
-        
-        # Tab 1: Student Management
-        student_frame = ttk.Frame(notebook)
-        notebook.add(student_frame, text="Student Management")
-        self.create_student_tab(student_frame)
-        
-        # Tab 2: Fee Payment
-        payment_frame = ttk.Frame(notebook)
-        notebook.add(payment_frame, text="Fee Payment")
-        self.create_payment_tab(payment_frame)
-        
-        # Tab 3: Payment History
-        history_frame = ttk.Frame(notebook)
-        notebook.add(history_frame, text="Payment History")
-        self.create_history_tab(history_frame)
-        
-        # Tab 4: Settings
-        settings_frame = ttk.Frame(notebook)
-        notebook.add(settings_frame, text="Settings")
-        self.create_settings_tab(settings_frame)
-    
-    def create_student_tab(self, parent):
-        """Create student management interface"""
-        # Create two main frames: one for the form, one for the list
-        main_frame = ttk.Frame(parent, padding="10")
-        main_frame.pack(fill='both', expand=True)
 
-        # Form Frame (left side)
-        form_frame = ttk.LabelFrame(main_frame, text="Student Details", padding="10")
-        form_frame.pack(side='left', fill='y', padx=5, pady=5)
 
-        # List Frame (right side)
-        list_frame = ttk.LabelFrame(main_frame, text="All Students", padding="10")
-        list_frame.pack(side='right', fill='both', expand=True, padx=5, pady=5)
+class TracingConnection(sqlite3.Connection):
+    """Connection whose cursors, including those of execute(), are TracingCursors"""
 
-        # --- Search Frame ---
-        search_frame = ttk.Frame(list_frame, padding="5")
-        search_frame.pack(fill='x')
+    tracer = None
 
-        ttk.Label(search_frame, text="Search:").pack(side='left', padx=5)
-        self.student_search_entry = ttk.Entry(search_frame, width=40)
-        self.student_search_entry.pack(side='left', padx=5, fill='x', expand=True)
-        ttk.Button(search_frame, text="Search", command=self.search_students).pack(side='left', padx=5)
-        ttk.Button(search_frame, text="Clear Search", command=self.clear_student_search).pack(side='left', padx=5)
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
 
-        # --- Form Widgets ---
-        row_counter = 0
-        ttk.Label(form_frame, text="Student Name:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
-        self.student_name = ttk.Entry(form_frame, width=30)
-        self.student_name.grid(row=row_counter, column=1, padx=5, pady=5)
-        row_counter += 1
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
 
-        ttk.Label(form_frame, text="Class:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
-        self.student_class = ttk.Combobox(form_frame, width=27, state='readonly', values=self.CLASS_OPTIONS)
-        self.student_class.grid(row=row_counter, column=1, padx=5, pady=5)
-        row_counter += 1
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
 
-        ttk.Label(form_frame, text="Contact Number:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
-        self.student_contact = ttk.Entry(form_frame, width=30)
-        self.student_contact.grid(row=row_counter, column=1, padx=5, pady=5)
-        row_counter += 1
 
-        ttk.Label(form_frame, text="Mother Name:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
-        self.mother_name = ttk.Entry(form_frame, width=30)
-        self.mother_name.grid(row=row_counter, column=1, padx=5, pady=5)
-        row_counter += 1
+TRACING_CODE = {member.__code__ for cls in (TracingCursor, TracingConnection)
+                for member in vars(cls).values() if hasattr(member, '__code__')}
 
-        ttk.Label(form_frame, text="Father Name:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
-        self.father_name = ttk.Entry(form_frame, width=30)
-        self.father_name.grid(row=row_counter, column=1, padx=5, pady=5)
-        row_counter += 1
 
-        ttk.Label(form_frame, text="Parent Number:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
-        self.parent_number = ttk.Entry(form_frame, width=30)
-        self.parent_number.grid(row=row_counter, column=1, padx=5, pady=5)
-        row_counter += 1
+class QueryCache:
+    """Small LRU cache of query results tagged with the database data version.
 
-        ttk.Label(form_frame, text="Parent Email:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
-        self.parent_email = ttk.Entry(form_frame, width=30)
-        self.parent_email.grid(row=row_counter, column=1, padx=5, pady=5)
-        row_counter += 1
+    Entries are only valid for the data version they were read at; as soon as the
+    version moves on (any write to payments or students) the whole cache is dropped.
+    Results read at an older version (e.g. by a background worker that raced a write)
+    are not cached and never move the version back.
+    """
 
-        # --- Form Buttons ---
-        button_frame = ttk.Frame(form_frame)
-        button_frame.grid(row=row_counter, column=0, columnspan=2, pady=10)
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.version = None
+        self.entries = OrderedDict()
 
-        self.add_update_button = ttk.Button(button_frame, text="Add Student", command=self.save_student_changes)
-        self.add_update_button.pack(side='left', padx=5)
+    def is_stale(self, version):
+        return self.version is not None and version < self.version
 
-        self.clear_button = ttk.Button(button_frame, text="Clear Form", command=self.clear_student_form)
-        self.clear_button.pack(side='left', padx=5)
-        
-        # Import CSV Button (moved to form section)
-        ttk.Button(button_frame, text="Import from CSV", command=self.import_students_csv).pack(side='left', padx=5)
-        
-        self.selected_student_id = None # To keep track of student being edited
+    def get(self, key, version):
+        if self.is_stale(version):
+            return None
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+            return None
+        rows = self.entries.get(key)
+        if rows is not None:
+            self.entries.move_to_end(key)
+        return rows
 
-        # --- List Widgets ---
-        columns = ('ID', 'Name', 'Class', 'Contact', 'Mother Name', 'Father Name', 'Parent Number', 'Parent Email', 'Created Date')
-        self.student_tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=15)
+    def put(self, key, version, rows):
+        if self.is_stale(version):
+            return
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+        self.entries[key] = rows
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
 
-        for col in columns:
-            self.student_tree.heading(col, text=col)
-            self.student_tree.column(col, width=100)
+    def clear(self):
+        self.entries.clear()
+        self.version = None
 
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.student_tree.yview)
-        self.student_tree.configure(yscrollcommand=scrollbar.set)
 
-        self.student_tree.pack(side='top', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
-        
-        # Configure tags for alternating row colors
-        self.student_tree.tag_configure('evenrow', background='lightblue') # Light blue
-        self.student_tree.tag_configure('oddrow', background='white')  # White
-        
-        # --- List Buttons ---
-        list_button_frame = ttk.Frame(list_frame)
-        list_button_frame.pack(side='bottom', fill='x', pady=5)
+StudentRecord = namedtuple('StudentRecord', 'id name class_name contact mother_name father_name '
+                                            'parent_number parent_email paid balance')
 
-        # Edit Button
-        ttk.Button(list_button_frame, text="Edit Selected Student", command=self.select_student_for_edit).pack(side='left', padx=5)
-        
-        # Delete Button
-        ttk.Button(list_button_frame, text="Delete Selected Student", command=self.delete_selected_student).pack(side='left', padx=5)
 
-        # Bind treeview selection to load student data
-        self.student_tree.bind('<<TreeviewSelect>>', self.select_student_for_edit)
+class StudentCache:
+    """LRU cache of student records (id -> StudentRecord, including what was paid this year and the balance).
 
-        # Load students initially
-        self.load_students()
-    
-    def create_payment_tab(self, parent):
-        """Create payment processing interface"""
-        # Payment Form
-        form_frame = ttk.LabelFrame(parent, text="Record Fee Payment", padding="10")
-        form_frame.pack(fill='x', padx=10, pady=5)
-        
-        # Class filter for students
-        filter_frame = ttk.Frame(parent)
-        filter_frame.pack(fill='x', padx=10, pady=2)
-        ttk.Label(filter_frame, text="Filter by Class:").pack(side='left', padx=5)
-        self.payment_class_filter = ttk.Combobox(filter_frame, width=15, state='readonly', values=['All'] + self.CLASS_OPTIONS)
-        self.payment_class_filter.set('All')
-        self.payment_class_filter.pack(side='left', padx=5)
-        self.payment_class_filter.bind('<<ComboboxSelected>>', self.update_payment_student_list)
-        # Search box with auto-complete
-        ttk.Label(filter_frame, text="Search Student:").pack(side='left', padx=5)
-        self.student_search_var = tk.StringVar()
-        self.student_search = ttk.Entry(filter_frame, textvariable=self.student_search_var, width=25)
-        self.student_search.pack(side='left', padx=5)
-        self.student_search.bind('<KeyRelease>', self.autocomplete_student_search)
-        self.student_search.bind('<Return>', self.select_autocomplete_student)
-        self.student_search_suggestions = tk.Listbox(filter_frame, width=25, height=3)
-        self.student_search_suggestions.pack_forget()
-        self.student_search_suggestions.bind('<<ListboxSelect>>', self.select_autocomplete_student)
-        
-        # Student Selection
-        ttk.Label(form_frame, text="Select Student:").grid(row=0, column=0, sticky='w', padx=5, pady=5)
-        self.student_combo = ttk.Combobox(form_frame, width=30, state='readonly')
-        self.student_combo.grid(row=0, column=1, padx=5, pady=5)
-        self.student_combo.bind("<<ComboboxSelected>>", self.update_fee_info)
-        # Class (read-only)
-        ttk.Label(form_frame, text="Class:").grid(row=0, column=2, sticky='w', padx=5, pady=5)
-        self.selected_class = ttk.Entry(form_frame, width=15, state='readonly')
-        self.selected_class.grid(row=0, column=3, padx=5, pady=5)
-        # Contact (read-only)
-        ttk.Label(form_frame, text="Contact:").grid(row=1, column=0, sticky='w', padx=5, pady=5)
-        self.selected_contact = ttk.Entry(form_frame, width=20, state='readonly')
-        self.selected_contact.grid(row=1, column=1, padx=5, pady=5)
-        # Paid Date
-        ttk.Label(form_frame, text="Paid Date:").grid(row=1, column=2, sticky='w', padx=5, pady=5)
-        
-        self.paid_date_entry = DateEntry(form_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
-        self.paid_date_entry.grid(row=1, column=3, padx=5, pady=5, sticky='we')
-        
-        # Due Date
-        ttk.Label(form_frame, text="Due Date:").grid(row=4, column=0, sticky='w', padx=5, pady=5)
-        
-        self.due_date_entry = DateEntry(form_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
-        self.due_date_entry.grid(row=4, column=1, padx=5, pady=5, sticky='we')
-        
-        # Mini-summary
-        self.fee_summary_var = tk.StringVar(value="")
-        ttk.Label(form_frame, textvariable=self.fee_summary_var, font=("Helvetica", 10, "bold")).grid(row=2, column=0, columnspan=4, sticky='w', padx=5, pady=5)
-        # Amount Paid
-        ttk.Label(form_frame, text="Amount Paid (₹):").grid(row=3, column=0, sticky='w', padx=5, pady=5)
-        self.amount = ttk.Entry(form_frame, width=15)
-        self.amount.grid(row=3, column=1, padx=5, pady=5)
-        # Pay Full Due button
-        ttk.Button(form_frame, text="Pay Full Due", command=self.pay_full_due).grid(row=3, column=2, padx=5, pady=5)
-        # Show All Dues button
-        ttk.Button(form_frame, text="Show All Pending", command=self.show_all_pending).grid(row=3, column=3, padx=5, pady=5)
-        
-        # Total Fee (read-only, always 18000)
-        ttk.Label(form_frame, text="Total Fee (₹):").grid(row=4, column=0, sticky='w', padx=5, pady=5)
-        self.total_fee = ttk.Entry(form_frame, width=15, state='readonly')
-        self.total_fee.grid(row=4, column=1, padx=5, pady=5)
-        self.total_fee.config(state='normal'); self.total_fee.delete(0, tk.END); self.total_fee.insert(0, str(self.TOTAL_FEE)); self.total_fee.config(state='readonly')
-        
-        # Fee Info Labels
-        self.fee_paid_so_far_var = tk.StringVar(value="Fee Paid So Far: ₹0.00")
-        self.fee_remaining_var = tk.StringVar(value="Fee Remaining: ₹0.00")
-        ttk.Label(form_frame, textvariable=self.fee_paid_so_far_var).grid(row=4, column=2, padx=5, pady=5, sticky='w')
-        ttk.Label(form_frame, textvariable=self.fee_remaining_var).grid(row=4, column=3, padx=5, pady=5, sticky='w')
-        
-        # Payment Mode
-        ttk.Label(form_frame, text="Payment Mode:").grid(row=5, column=0, sticky='w', padx=5, pady=5)
-        self.payment_mode = ttk.Combobox(form_frame, width=27, state='readonly', values=["Cash", "Online", "Cheque", "Other"])
-        self.payment_mode.grid(row=5, column=1, padx=5, pady=5)
-        self.payment_mode.set("Cash") # Default value
-        
-        # Buttons
-        button_frame = ttk.Frame(form_frame)
-        button_frame.grid(row=6, column=0, columnspan=4, pady=10)
-        
-        ttk.Button(button_frame, text="Record Payment", command=self.record_payment).pack(side='left', padx=5)
-        ttk.Button(button_frame, text="Generate Receipt", command=self.generate_receipt).pack(side='left', padx=5)
-        ttk.Button(button_frame, text="Refresh Students", command=self.load_student_combo).pack(side='left', padx=5)
-        
-        # Recent Payments
-        recent_frame = ttk.LabelFrame(parent, text="Recent Payments", padding="10")
-        recent_frame.pack(fill='both', expand=True, padx=10, pady=5)
-        
-        # Treeview for recent payments
-        payment_columns = ('ID', 'Student', 'Class', 'Due Date', 'Paid Date', 'Amount', 'Status', 'Payment Mode')
-        self.payment_tree = ttk.Treeview(recent_frame, columns=payment_columns, show='headings', height=12)
-        
-        for col in payment_columns:
-            self.payment_tree.heading(col, text=col)
-            self.payment_tree.column(col, width=100)
-        
-        # Scrollbar for payments
-        payment_scrollbar = ttk.Scrollbar(recent_frame, orient='vertical', command=self.payment_tree.yview)
-        self.payment_tree.configure(yscrollcommand=payment_scrollbar.set)
-        
-        self.payment_tree.pack(side='left', fill='both', expand=True)
-        payment_scrollbar.pack(side='right', fill='y')
-        
-        # Configure tags for alternating row colors
-        self.payment_tree.tag_configure('evenrow', background='lightblue') # Light blue
-        self.payment_tree.tag_configure('oddrow', background='white')  # White
-        
-        # Delete Payment Button
-        delete_btn = ttk.Button(recent_frame, text="Delete Payment", command=self.delete_selected_payment)
-        delete_btn.pack(side='bottom', pady=5, anchor='e')
-        
-        # Filter buttons for status
-        filter_frame2 = ttk.Frame(parent)
-        filter_frame2.pack(fill='x', padx=10, pady=2)
-        ttk.Button(filter_frame2, text='All', command=lambda: self.filter_payments_tree('All')).pack(side='left', padx=2)
-        ttk.Button(filter_frame2, text='Cleared', command=lambda: self.filter_payments_tree('Cleared')).pack(side='left', padx=2)
-        ttk.Button(filter_frame2, text='Pending', command=lambda: self.filter_payments_tree('Pending')).pack(side='left', padx=2)
-        
-        # Load data
-        self.load_student_combo()
-        self.load_recent_payments()
-    
-    def create_history_tab(self, parent):
-        """Create payment history interface"""
-        # Filter Frame
-        filter_frame = ttk.LabelFrame(parent, text="Filter Options", padding="10")
-        filter_frame.pack(fill='x', padx=10, pady=5)
-        
-        # Class Filter (Row 0)
-        ttk.Label(filter_frame, text="Filter by Class:").grid(row=0, column=0, padx=5, pady=5, sticky='w')
-        self.filter_class = ttk.Combobox(filter_frame, width=15, values=['All'] + self.CLASS_OPTIONS, state='readonly')
-        self.filter_class.grid(row=0, column=1, padx=5, pady=5, sticky='we')
-        self.filter_class.set('All')
-        
-        # Status Filter (Row 0)
-        ttk.Label(filter_frame, text="Filter by Status:").grid(row=0, column=2, padx=5, pady=5, sticky='w')
-        self.filter_status = ttk.Combobox(filter_frame, values=['All', 'Pending', 'Cleared'], width=15)
-        self.filter_status.grid(row=0, column=3, padx=5, pady=5, sticky='we')
-        self.filter_status.set('All')
+    Unlike QueryCache this is not tied to the data version: the methods that write students
+    or payments invalidate exactly the students they touched, so reading a cached student
+    costs no database round trip at all.
+    """
 
-        # Date Range Filter (Row 1)
-        row_counter = 1
-        ttk.Label(filter_frame, text="From Paid Date:").grid(row=row_counter, column=0, padx=5, pady=5, sticky='w')
-        
-        self.filter_start_date_entry = DateEntry(filter_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
-        self.filter_start_date_entry.grid(row=row_counter, column=1, padx=5, pady=5, sticky='we')
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.records = OrderedDict()
 
-        ttk.Label(filter_frame, text="To Paid Date:").grid(row=row_counter, column=2, padx=5, pady=5, sticky='w')
+    def get(self, student_id):
+        record = self.records.get(student_id)
+        if record is not None:
+            self.records.move_to_end(student_id)
+        return record
 
-        self.filter_end_date_entry = DateEntry(filter_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
-        self.filter_end_date_entry.grid(row=row_counter, column=3, padx=5, pady=5, sticky='we')
+    def put(self, record):
+        self.records[record.id] = record
+        self.records.move_to_end(record.id)
+        while len(self.records) > self.capacity:
+            self.records.popitem(last=False)
 
-        # Buttons (Row 0 and Row 1)
-        button_frame = ttk.Frame(filter_frame)
-        button_frame.grid(row=0, column=4, rowspan=2, padx=5, pady=5, sticky='ns')
+    def invalidate(self, *student_ids):
+        for student_id in student_ids:
+            self.records.pop(student_id, None)
 
-        ttk.Button(button_frame, text="Apply Filter", command=self.apply_filter).pack(pady=2)
-        ttk.Button(button_frame, text="Export to CSV", command=self.export_to_csv).pack(pady=2)
-        
-        # --- Search Frame (Row 2) ---
-        row_counter += 1
-        search_frame = ttk.Frame(filter_frame)
-        search_frame.grid(row=row_counter, column=0, columnspan=4, padx=5, pady=5, sticky='we')
-        
-        ttk.Label(search_frame, text="Search Student:").pack(side='left', padx=5)
-        self.history_search_entry = ttk.Entry(search_frame, width=40)
-        self.history_search_entry.pack(side='left', padx=5, fill='x', expand=True)
-        ttk.Button(search_frame, text="Search", command=self.apply_filter).pack(side='left', padx=5)
-        ttk.Button(search_frame, text="Clear Search", command=self.clear_history_search).pack(side='left', padx=5)
+    def clear(self):
+        self.records.clear()
 
-        # Summary bar
-        self.summary_var = tk.StringVar(value='')
-        summary_label = ttk.Label(parent, textvariable=self.summary_var, font=('Helvetica', 12, 'bold'))
-        summary_label.pack(fill='x', padx=10, pady=2)
-        
-        # Collection in Range Summary
-        self.range_collection_var = tk.StringVar(value='')
-        range_collection_label = ttk.Label(parent, textvariable=self.range_collection_var, font=('Helvetica', 10, 'italic'))
-        range_collection_label.pack(fill='x', padx=10, pady=1)
 
-        # Filter buttons for status
-        filter_frame2 = ttk.Frame(parent)
-        filter_frame2.pack(fill='x', padx=10, pady=2)
-        ttk.Button(filter_frame2, text='All', command=lambda: self.filter_history_tree('All')).pack(side='left', padx=2)
-        ttk.Button(filter_frame2, text='Cleared', command=lambda: self.filter_history_tree('Cleared')).pack(side='left', padx=2)
-        ttk.Button(filter_frame2, text='Pending', command=lambda: self.filter_history_tree('Pending')).pack(side='left', padx=2)
-        
-        # History Tree
-        history_frame = ttk.LabelFrame(parent, text="Payment History", padding="10")
-        history_frame.pack(fill='both', expand=True, padx=10, pady=5)
-        
-        history_columns = ('ID', 'Student', 'Class', 'Contact', 'Due Date', 'Paid Date', 'Amount', 'Status', 'Receipt', 'Payment Mode')
-        self.history_tree = ttk.Treeview(history_frame, columns=history_columns, show='headings', height=15)
-        
-        for col in history_columns:
-            self.history_tree.heading(col, text=col)
-            self.history_tree.column(col, width=100)
-        
-        # Scrollbar for history
-        history_scrollbar = ttk.Scrollbar(history_frame, orient='vertical', command=self.history_tree.yview)
-        self.history_tree.configure(yscrollcommand=history_scrollbar.set)
-        
-        self.history_tree.pack(side='left', fill='both', expand=True)
-        history_scrollbar.pack(side='right', fill='y')
-        
-        # Context menu for history
-        self.history_tree.bind("<Double-1>", self.open_receipt)
-        
-        # Generate Receipt Button
-        gen_receipt_btn = ttk.Button(history_frame, text="Generate Receipt", command=self.generate_receipt_from_history)
-        gen_receipt_btn.pack(side='bottom', pady=5, anchor='e')
-        
-        self.load_payment_history()
-        self.load_class_filter()
-    
-    def create_settings_tab(self, parent):
-        """Create settings interface"""
-        settings_frame = ttk.LabelFrame(parent, text="Application Settings", padding="20")
-        settings_frame.pack(fill='x', padx=10, pady=5)
-        # School Info (fixed, not editable)
-        ttk.Label(settings_frame, text="School Name:").grid(row=0, column=0, sticky='w', padx=5, pady=5)
-        self.school_name = ttk.Entry(settings_frame, width=40, state='readonly')
-        self.school_name.grid(row=0, column=1, padx=5, pady=5)
-        self.school_name.config(state='normal'); self.school_name.delete(0, tk.END); self.school_name.insert(0, "Little Angels Pre-School"); self.school_name.config(state='readonly')
-        ttk.Label(settings_frame, text="School Address:").grid(row=1, column=0, sticky='w', padx=5, pady=5)
-        self.school_address = ttk.Entry(settings_frame, width=40, state='readonly')
-        self.school_address.grid(row=1, column=1, padx=5, pady=5)
-        self.school_address.config(state='normal'); self.school_address.delete(0, tk.END); self.school_address.insert(0, "Shivane, Pune-23"); self.school_address.config(state='readonly')
-        ttk.Label(settings_frame, text="Contact Number:").grid(row=2, column=0, sticky='w', padx=5, pady=5)
-        self.school_contact = ttk.Entry(settings_frame, width=40, state='readonly')
-        self.school_contact.grid(row=2, column=1, padx=5, pady=5)
-        self.school_contact.config(state='normal'); self.school_contact.delete(0, tk.END); self.school_contact.insert(0, "8657633646 & 9765848509"); self.school_contact.config(state='readonly')
-        # Buttons
-        button_frame = ttk.Frame(settings_frame)
-        button_frame.grid(row=3, column=0, columnspan=2, pady=20)
-        ttk.Button(button_frame, text="Open Receipts Folder", command=self.open_receipts_folder).pack(side='left', padx=5)
-        ttk.Button(button_frame, text="Backup Database", command=self.backup_database).pack(side='left', padx=5)
-        ttk.Button(button_frame, text="WhatsApp Web", command=self.open_whatsapp_web).pack(side='left', padx=5)
-    
-    def add_student(self):
-        """Add a new student to the database"""
-        name = self.student_name.get().strip()
-        class_name = self.student_class.get().strip()
-        contact = self.student_contact.get().strip()
-        mother_name = self.mother_name.get().strip()
-        father_name = self.father_name.get().strip()
-        parent_number = self.parent_number.get().strip()
-        parent_email = self.parent_email.get().strip()
-        
-        if not name or not class_name:
-            messagebox.showerror("Error", "Name and Class are required fields!")
-            return
-        
-        try:
-            self.cursor.execute(
-                "INSERT INTO students (name, class, contact, mother_name, father_name, parent_number, parent_email) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (name, class_name, contact, mother_name, father_name, parent_number, parent_email)
-            )
-            self.conn.commit()
-            
-            # Clear form
-            self.student_name.delete(0, tk.END)
-            self.student_class.delete(0, tk.END)
-            self.student_contact.delete(0, tk.END)
-            self.mother_name.delete(0, tk.END)
-            self.father_name.delete(0, tk.END)
-            self.parent_number.delete(0, tk.END)
-            self.parent_email.delete(0, tk.END)
-            
-            # Refresh displays
-            self.load_students()
-            self.load_student_combo()
-            
-            messagebox.showinfo("Success", f"Student '{name}' added successfully!")
-            
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", f"Error adding student: {e}")
-    
-    def load_students(self, query=""):
-        """Load all students into the treeview, optionally filtered by a query"""
-        # Clear existing items
-        for item in self.student_tree.get_children():
-            self.student_tree.delete(item)
-        # Fetch and display students, sorted by class then name
-        sql_query = "SELECT id, name, class, contact, mother_name, father_name, parent_number, parent_email, created_date FROM students"
-        params = []
+class ChangeBus:
+    """Carries data changes from writers to the views that show them, one refresh per view per idle tick.
 
-        if query:
-            sql_query += " WHERE name LIKE ? OR class LIKE ? OR contact LIKE ? OR mother_name LIKE ? OR father_name LIKE ? OR parent_number LIKE ? OR parent_email LIKE ?"
-            search_term = f"%{query}%"
-            params = [search_term] * 7 # Apply search term to all searchable columns
+    Writers publish the table and row ids they changed once their transaction is committed.
+    Changes are gathered until Tk is idle and then handed to each subscribed view as a single
+    {table: ids} mapping, where ids is None when any row may have changed. A view that is not
+    on screen keeps its changes until flush runs while it is visible.
+    """
 
-        sql_query += " ORDER BY class, name"
+    def __init__(self, call_when_idle):
+        self.call_when_idle = call_when_idle
+        self.views = []
+        self.scheduled = False
 
-        self.cursor.execute(sql_query, params)
-        students = self.cursor.fetchall()
-        for i, student in enumerate(students):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            self.student_tree.insert('', 'end', values=student, tags=(tag,))
+    def subscribe(self, tables, refresh, visible=lambda: True):
+        self.views.append({'tables': set(tables), 'refresh': refresh, 'visible': visible, 'changes': {}})
 
-    def search_students(self):
-        """Perform search based on the text in the search entry"""
-        query = self.student_search_entry.get()
-        self.load_students(query)
+    def publish(self, table, ids=None):
+        """Record a change to some rows of table (None: any row) and schedule delivery"""
+        for view in self.views:
+            if table not in view['tables']:
+                continue
+            changes = view['changes']
+            if ids is None or (table in changes and changes[table] is None):
+                changes[table] = None
+            else:
+                changes.setdefault(table, set()).update(ids)
+        if not self.scheduled:
+            self.scheduled = True
+            self.call_when_idle(self.flush)
 
-    def clear_student_search(self):
-        """Clear the search entry and reload all students"""
-        self.student_search_entry.delete(0, tk.END)
-        self.load_students()
-    
-    def load_student_combo(self):
-        # Load students into the combobox for payment form, respecting class filter
-        selected_class = getattr(self, 'payment_class_filter', None)
-        if selected_class and selected_class.get() != 'All':
-            self.cursor.execute("SELECT id, name, class FROM students WHERE class = ? ORDER BY name", (selected_class.get(),))
+    def flush(self):
+        """Refresh each visible view that has changes waiting"""
+        self.scheduled = False
+        for view in self.views:
+            if view['changes'] and view['visible']():
+                changes, view['changes'] = view['changes'], {}
+                view['refresh'](changes)
+
+
+# Integer twins of payments.amount and paid_date, generated by SQLite from the stored values:
+# whole paise, and the day number of date.toordinal(). Totals and date ranges are computed on
+# these, so they are exact and can be answered from compact integer indexes.
+PAYMENT_INTEGER_COLUMNS = {
+    'amount_paise': "CAST(round(amount * 100) AS INTEGER)",
+    'paid_day': "CAST(julianday(paid_date) - 1721424.5 AS INTEGER)",
+}
+
+
+def to_paise(value):
+    """Convert a rupee amount (number or text) to whole paise, raising ValueError past two decimals"""
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"'{value}' is not an amount") from None
+    if not amount.is_finite() or amount != amount.quantize(Decimal("0.01")):
+        raise ValueError(f"'{value}' is not an amount in rupees and paise")
+    return int(amount * 100)
+
+
+def parse_iso_date(text):
+    """Return text as a zero-padded YYYY-MM-DD date, raising ValueError if it is not a date"""
+    return datetime.strptime(str(text).strip(), "%Y-%m-%d").date().isoformat()
+
+
+def validate_payment(amount, paid_date, due_date=None):
+    """Check a payment's fields before it is written; return (amount, paid date, due date) normalised.
+
+    The amount must be positive and in whole paise, and dates are stored as YYYY-MM-DD so
+    that the generated day numbers (and any string comparison) order them correctly.
+    """
+    paise = to_paise(amount)
+    if paise <= 0:
+        raise ValueError("Amount must be a positive number")
+    return paise / 100, parse_iso_date(paid_date), parse_iso_date(due_date) if due_date else due_date
+
+
+def normalise_payments(cursor):
+    """Round payment amounts to whole paise and rewrite dates as YYYY-MM-DD; return the number of rows fixed"""
+    cursor.execute("""
+        SELECT id, amount, paid_date, due_date FROM payments
+        WHERE abs(amount * 100 - round(amount * 100)) > 1e-6
+           OR date(paid_date) IS NOT paid_date OR date(due_date) IS NOT due_date
+    """)
+    # Dates that can't be read in any known format are left for the user to correct
+    fixes = [(round(amount, 2), parse_statement_date(paid_date) or paid_date,
+              parse_statement_date(due_date) or due_date, payment_id)
+             for payment_id, amount, paid_date, due_date in cursor.fetchall()]
+    cursor.executemany("UPDATE payments SET amount = ?, paid_date = ?, due_date = ? WHERE id = ?", fixes)
+    return len(fixes)
+
+
+def attach_archives(conn, archives):
+    """Attach archive databases ({alias: path}) to conn and rebuild the temp all_payments view.
+
+    The view is a UNION ALL of main.payments and each attached archive's payments table,
+    using main's column list (columns an older archive lacks read as NULL, and integer
+    columns it lacks are computed from its amount and paid date).
+    """
+    if conn.in_transaction:
+        conn.commit()
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    for alias, path in archives.items():
+        if alias not in attached:
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+    columns = [row[1] for row in conn.execute("PRAGMA main.table_info(payments)")]
+    selects = [f"SELECT {', '.join(columns + list(PAYMENT_INTEGER_COLUMNS))} FROM main.payments"]
+    for alias in sorted(archives):
+        archive_columns = {row[1] for row in conn.execute(f"PRAGMA {alias}.table_xinfo(payments)")}
+        select_list = [c if c in archive_columns else f"NULL AS {c}" for c in columns]
+        select_list += [c if c in archive_columns else f"{expression} AS {c}"
+                        for c, expression in PAYMENT_INTEGER_COLUMNS.items()]
+        selects.append(f"SELECT {', '.join(select_list)} FROM {alias}.payments")
+    conn.execute("DROP VIEW IF EXISTS temp.all_payments")
+    conn.execute("CREATE TEMP VIEW all_payments AS " + " UNION ALL ".join(selects))
+
+
+class BackgroundQuery:
+    """Runs read queries on a private connection in a worker thread.
+
+    Only the most recent request matters: submitting a new one aborts the query in
+    flight (via Connection.interrupt() and a progress handler) and older pending
+    requests are skipped. Results are collected with results() from the UI thread.
+    """
+
+    def __init__(self, db_path, tracer=None):
+        self.db_path = db_path
+        self.tracer = tracer
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = None
+        self.running = None
+        self.conn = None
+        self.archives = {}
+        self.finished = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, token, query, params=(), archives=None):
+        with self.lock:
+            self.pending = (token, query, params, archives or {})
+            if self.running is not None and self.conn is not None:
+                self.conn.interrupt()
+        self.wakeup.set()
+
+    def idle(self):
+        with self.lock:
+            return self.pending is None and self.running is None and self.finished.empty()
+
+    def results(self):
+        while True:
+            try:
+                yield self.finished.get_nowait()
+            except queue.Empty:
+                return
+
+    def is_stale(self):
+        # Progress handler: a non-zero return aborts the running statement
+        return self.pending is not None
+
+    def run(self):
+        self.conn = connect_database(self.db_path, tracer=self.tracer)
+        self.conn.set_progress_handler(self.is_stale, 1000)
+        cursor = self.conn.cursor()
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                self.wakeup.clear()
+                request, self.pending = self.pending, None
+                self.running = request
+            if request is None:
+                continue
+            token, query, params, archives = request
+            try:
+                if archives.keys() - self.archives.keys():
+                    self.archives.update(archives)
+                    attach_archives(self.conn, self.archives)
+                # Read the data version and the rows from one consistent snapshot
+                cursor.execute("BEGIN")
+                cursor.execute("SELECT value FROM app_meta WHERE key = 'data_version'")
+                version = cursor.fetchone()[0]
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                cursor.execute("COMMIT")
+                self.finished.put((token, version, rows, None))
+            except sqlite3.OperationalError as e:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                if "interrupt" not in str(e):
+                    self.finished.put((token, None, None, e))
+            finally:
+                with self.lock:
+                    self.running = None
+
+
+class RowStore:
+    """Column-oriented snapshot of the rows shown in a Treeview.
+
+    Each column is held in one sequence (typed arrays for numeric columns), so a
+    snapshot costs a fixed few bytes per cell instead of a tuple per row. The row
+    order for a column is computed the first time it is sorted on and kept as an
+    index array, so re-sorting and quick filtering never go back to the database.
+    """
+
+    __slots__ = ('columns', 'data', 'count', 'orders')
+
+    def __init__(self, columns, rows, numeric=None):
+        # numeric maps column name to an array typecode, e.g. {'ID': 'q', 'Amount': 'd'}
+        numeric = numeric or {}
+        self.columns = {name: i for i, name in enumerate(columns)}
+        self.data = [array(numeric[name]) if name in numeric else [] for name in columns]
+        self.count = 0
+        self.orders = {}
+        appenders = [column.append for column in self.data]
+        for row in rows:
+            for append, value in zip(appenders, row):
+                append(value)
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def row(self, i):
+        return tuple(column[i] for column in self.data)
+
+    def value(self, column, i):
+        return self.data[self.columns[column]][i]
+
+    def order(self, column):
+        """Row indices in ascending order of column (None and blanks last)"""
+        order = self.orders.get(column)
+        if order is None:
+            values = self.data[self.columns[column]]
+            if isinstance(values, array):
+                sort_keys = values
+            else:
+                # Case-insensitive text order; the highest code point sorts blanks last
+                sort_keys = [str(value).casefold() if value is not None and value != '' else '\U0010ffff'
+                             for value in values]
+            order = array('l', sorted(range(self.count), key=sort_keys.__getitem__))
+            self.orders[column] = order
+        return order
+
+    def select(self, sort=None, reverse=False, filters=None):
+        """Return row indices sorted on the given column and matching every {column: value} filter"""
+        indices = self.order(sort) if sort else range(self.count)
+        if reverse:
+            indices = reversed(indices)
+        for column, wanted in (filters or {}).items():
+            values = self.data[self.columns[column]]
+            indices = [i for i in indices if values[i] == wanted]
+        return indices
+
+
+def soundex(word):
+    """Return the Soundex code of a word, so spellings like 'Riya' and 'Reeya' compare equal"""
+    word = "".join(c for c in word.lower() if c.isalpha())
+    if not word:
+        return ""
+    codes = {c: digit for digit, letters in (("1", "bfpv"), ("2", "cgjkqsxz"), ("3", "dt"),
+                                             ("4", "l"), ("5", "mn"), ("6", "r")) for c in letters}
+    result, last = word[0].upper(), codes.get(word[0], "")
+    for c in word[1:]:
+        code = codes.get(c, "")
+        if code and code != last:
+            result += code
+        if c not in "hw":
+            last = code
+    return (result + "000")[:4]
+
+
+def phone_digits(number):
+    """Return the last 10 digits of a phone number, ignoring spaces, dashes and country codes"""
+    return re.sub(r"\D", "", number or "")[-10:]
+
+
+def name_tokens(name):
+    """Return the lower-cased words of a name, in sorted order"""
+    return sorted(re.findall(r"[^\W_]+", (name or "").casefold()))
+
+
+def student_blocking_keys(student):
+    """Return the blocking keys of a student row (id, name, class, contact, mother, father, parent_number).
+
+    Two students are only ever compared if they share a key: the same name words in
+    any order, the same Soundex codes of those words, or the same phone number.
+    """
+    tokens = name_tokens(student[1])
+    keys = set()
+    if tokens:
+        keys.add(("name", " ".join(tokens)))
+        keys.add(("sound", " ".join(sorted(soundex(token) or token for token in tokens))))
+    for number in (student[6], student[3]):
+        digits = phone_digits(number)
+        if len(digits) >= 7:
+            keys.add(("phone", digits))
+    return keys
+
+
+def duplicate_score(a, b):
+    """Score how likely two student rows are the same child; DuplicateIndex.THRESHOLD or more is flagged"""
+    tokens_a, tokens_b = name_tokens(a[1]), name_tokens(b[1])
+    if not tokens_a or not tokens_b:
+        return 0.0
+    # Each word is matched with its closest counterpart, so a shared surname alone
+    # (siblings) does not make two names look alike
+    def closeness(words, others):
+        return sum(max(SequenceMatcher(None, word, other).ratio() for other in others) for word in words) / len(words)
+    score = min(closeness(tokens_a, tokens_b), closeness(tokens_b, tokens_a))
+    keys_a, keys_b = student_blocking_keys(a), student_blocking_keys(b)
+    if any(key[0] == "sound" for key in keys_a & keys_b):
+        score += 0.1
+    if any(key[0] == "phone" for key in keys_a & keys_b):
+        score += 0.1
+    parents_a = {(a[4] or "").strip().casefold(), (a[5] or "").strip().casefold()} - {""}
+    parents_b = {(b[4] or "").strip().casefold(), (b[5] or "").strip().casefold()} - {""}
+    if parents_a & parents_b:
+        score += 0.1
+    if a[2] == b[2]:
+        score += 0.05
+    return score
+
+
+class DuplicateIndex:
+    """Index of students by blocking key for finding likely duplicates in near-linear time.
+
+    Rows are (id, name, class, contact, mother_name, father_name, parent_number). Only
+    students sharing a blocking key are scored against each other; oversized blocks
+    (e.g. a placeholder phone number used for many students) are ignored.
+    """
+
+    THRESHOLD = 0.9
+    MAX_BLOCK = 50
+
+    def __init__(self, students=()):
+        self.blocks = {}
+        for student in students:
+            self.add(student)
+
+    def add(self, student):
+        for key in student_blocking_keys(student):
+            self.blocks.setdefault(key, []).append(student)
+
+    def matches(self, student):
+        """Return [(score, other)] for indexed students that look like student, best first"""
+        candidates = {}
+        for key in student_blocking_keys(student):
+            members = self.blocks.get(key, ())
+            if len(members) <= self.MAX_BLOCK:
+                for other in members:
+                    if other[0] is None or other[0] != student[0]:
+                        candidates[id(other)] = other
+        scored = [(duplicate_score(student, other), other) for other in candidates.values()]
+        return sorted((match for match in scored if match[0] >= self.THRESHOLD), key=lambda match: -match[0])
+
+    def pairs(self):
+        """Return [(score, a, b)] for every likely duplicate pair in the index, best first"""
+        seen = set()
+        pairs = []
+        for members in self.blocks.values():
+            if len(members) < 2 or len(members) > self.MAX_BLOCK:
+                continue
+            for i, a in enumerate(members):
+                for b in members[i + 1:]:
+                    first, second = (a, b) if a[0] < b[0] else (b, a)
+                    if (first[0], second[0]) in seen:
+                        continue
+                    seen.add((first[0], second[0]))
+                    score = duplicate_score(first, second)
+                    if score >= self.THRESHOLD:
+                        pairs.append((score, first, second))
+        pairs.sort(key=lambda pair: -pair[0])
+        return pairs
+
+
+class EmailSender:
+    """Sends the e-mails queued in the email_outbox table from background threads.
+
+    Each worker claims a batch of due messages, sends them over a single SMTP session
+    and records the outcome of every message. Temporary failures are retried with
+    exponential backoff; permanent ones (or too many attempts) are marked 'failed'.
+    Workers use their own connections, so the UI thread is never blocked.
+    """
+
+    BATCH_SIZE = 50
+    MAX_ATTEMPTS = 5
+    BACKOFF_SECONDS = 60
+    LINGER_SECONDS = 2
+
+    def __init__(self, db_path, settings, workers=2, poll_seconds=30):
+        self.db_path = db_path
+        self.settings = settings
+        self.poll_seconds = poll_seconds
+        self.wakeup = threading.Event()
+        self.stopping = False
+        for _ in range(workers):
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+    def connect(self):
+        """Open an authenticated SMTP session from the settings"""
+        import smtplib
+        settings = self.settings
+        port = int(settings.get('smtp_port') or 25)
+        if settings.get('smtp_security') == 'ssl':
+            smtp = smtplib.SMTP_SSL(settings['smtp_host'], port, timeout=30)
         else:
-            self.cursor.execute("SELECT id, name, class FROM students ORDER BY class, name")
-        students = self.cursor.fetchall()
-        student_list = [f"{s[1]} ({s[2]}) - ID:{s[0]}" for s in students]
-        self.student_combo['values'] = student_list
-        self.autocomplete_student_names = [s[1] for s in students]
-    
-    def record_payment(self):
-        """Record a new payment"""
-        if not self.student_combo.get():
-            messagebox.showerror("Error", "Please select a student!")
-            return
+            smtp = smtplib.SMTP(settings['smtp_host'], port, timeout=30)
+            if settings.get('smtp_security') == 'starttls':
+                smtp.starttls()
+        if settings.get('smtp_user'):
+            smtp.login(settings['smtp_user'], settings.get('smtp_password') or '')
+        return smtp
+
+    def build_message(self, recipient, subject, body, attachment_path):
+        from email.message import EmailMessage
+        message = EmailMessage()
+        message['From'] = self.settings.get('smtp_from') or self.settings.get('smtp_user')
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        if attachment_path:
+            with open(attachment_path, 'rb') as f:
+                message.add_attachment(f.read(), maintype='application', subtype='pdf',
+                                       filename=os.path.basename(attachment_path))
+        return message
+
+    def claim(self, conn):
+        """Mark a batch of due messages as 'sending' and return them"""
+        now = datetime.now().isoformat(timespec='seconds')
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            # Extract student ID from combo selection
-            student_info = self.student_combo.get()
-            student_id = int(student_info.split("ID:")[1])
-            due_date = self.due_date_entry.get()
-            paid_date = self.paid_date_entry.get()
-            amount = float(self.amount.get())  # Fee Paid Currently
-            payment_mode = self.payment_mode.get() # Get payment mode
-            # Validate dates
-            datetime.strptime(due_date, "%Y-%m-%d")
-            datetime.strptime(paid_date, "%Y-%m-%d")
-            # Insert payment as 'Pending' by default
-            status = "Pending"
-            self.cursor.execute(
-                """INSERT INTO payments (student_id, due_date, paid_date, amount, status, payment_mode) 
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (student_id, due_date, paid_date, amount, status, payment_mode)
-            )
-            self.conn.commit()
-            # After insert, update all this student's payments to 'Cleared' if total paid >= 18000, else 'Pending'
-            self.cursor.execute("SELECT SUM(amount) FROM payments WHERE student_id = ?", (student_id,))
-            total_paid = self.cursor.fetchone()[0] or 0.0
-            new_status = "Cleared" if total_paid >= self.TOTAL_FEE else "Pending"
-            self.cursor.execute("UPDATE payments SET status = ? WHERE student_id = ?", (new_status, student_id))
-            self.conn.commit()
-            # Clear form
-            self.amount.delete(0, tk.END)
-            # Refresh displays
-            self.load_recent_payments()
-            self.load_payment_history()
-            self.update_fee_info()  # Update fee info after payment
-            messagebox.showinfo("Success", "Payment recorded successfully!")
-        except ValueError as e:
-            messagebox.showerror("Error", f"Invalid input: {e}")
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", f"Error recording payment: {e}")
-    
-    def generate_receipt(self):
-        """Generate PDF receipt for the last payment"""
-        if not self.student_combo.get():
-            messagebox.showerror("Error", "Please select a student first!")
-            return
-        
+            rows = conn.execute("""
+                SELECT id, recipient, subject, body, attachment_path, attempts FROM email_outbox
+                WHERE status = 'queued' AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+            """, (now, self.BATCH_SIZE)).fetchall()
+            conn.executemany("UPDATE email_outbox SET status = 'sending' WHERE id = ?", [(row[0],) for row in rows])
+            conn.commit()
+        except sqlite3.Error:
+            # Leave no transaction open, or the next claim's BEGIN would fail for good
+            conn.rollback()
+            raise
+        return rows
+
+    def send_batch(self, batch):
+        """Send a batch over one SMTP session; return [(row, error, retry)] per attempted message"""
+        import smtplib
+        results = []
         try:
-            # Get the last payment for this student
-            student_info = self.student_combo.get()
-            student_id = int(student_info.split("ID:")[1])
-            
-            self.cursor.execute("""
-                SELECT p.*, s.name, s.class, s.contact, s.mother_name, s.father_name, s.parent_number, s.parent_email
-                FROM payments p 
-                JOIN students s ON p.student_id = s.id 
-                WHERE p.student_id = ? 
-                ORDER BY p.created_date DESC 
-                LIMIT 1
-            """, (student_id,))
-            
-            payment_data = self.cursor.fetchone()
-            if not payment_data:
-                messagebox.showerror("Error", "No payment found for this student!")
-                return
-            
-            # Generate receipt
-            receipt_path = self.create_pdf_receipt(payment_data)
-            
-            # Update database with receipt path
-            self.cursor.execute(
-                "UPDATE payments SET receipt_path = ? WHERE id = ?",
-                (receipt_path, payment_data[0])
-            )
-            self.conn.commit()
-            
-            # Ask if user wants to open the receipt
-            if messagebox.askyesno("Receipt Generated", 
-                                 f"Receipt saved as:\n{receipt_path}\n\nWould you like to open the Receipts folder to send it via WhatsApp?"): # Modified message
-                self.open_receipts_folder() # Open folder instead of file directly
-                # Add prompt to open WhatsApp Web
-                if messagebox.askyesno("Send via WhatsApp", "Would you like to open WhatsApp Web now to send the receipt?"):
-                    self.open_whatsapp_web()
-            
-            # Refresh displays
-            self.load_recent_payments()
-            self.load_payment_history()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error generating receipt: {e}")
-    
-    def create_pdf_receipt(self, payment_data):
-        """Create a PDF receipt matching the provided template, now with parent info"""
-        # Unpack payment data
-        # payment_id, student_id, due_date, paid_date, amount, status, receipt_path, created_date, payment_mode, name, class_name, contact, mother_name, father_name, parent_number, parent_email
-        payment_id, student_id, due_date, paid_date, amount, status, receipt_path, created_date, payment_mode, name, class_name, contact, mother_name, father_name, parent_number, parent_email = payment_data
-        # Try to get total fee and paid so far for this student
+            smtp = self.connect()
+        except (OSError, smtplib.SMTPException) as e:
+            return [(row, e, True) for row in batch]
         try:
-            self.cursor.execute("SELECT SUM(amount) FROM payments WHERE student_id = ?", (student_id,))
-            paid_so_far = self.cursor.fetchone()[0] or 0.0
-            total_fee = float(self.total_fee.get()) if hasattr(self, 'total_fee') and self.total_fee.get() else paid_so_far
-            remaining = max(total_fee - paid_so_far, 0.0)
-        except Exception:
-            total_fee = paid_so_far = amount
-            remaining = 0.0
-        # Create filename
-        safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip()
-        base_filename = f"{safe_name}_{class_name}_{paid_date}"
-        filename = f"{base_filename}.pdf"
-        receipt_path = os.path.join("receipts", filename)
+            for row in batch:
+                _, recipient, subject, body, attachment_path, _ = row
+                try:
+                    message = self.build_message(recipient, subject, body, attachment_path)
+                except OSError as e:
+                    results.append((row, e, False))  # Receipt file missing or unreadable
+                    continue
+                # SMTP errors subclass OSError, so they are handled before connection errors
+                try:
+                    smtp.send_message(message)
+                    results.append((row, None, False))
+                except smtplib.SMTPRecipientsRefused as e:
+                    results.append((row, e, False))
+                except smtplib.SMTPResponseException as e:
+                    results.append((row, e, e.smtp_code < 500))
+                except (smtplib.SMTPException, OSError) as e:
+                    # Connection lost: this message is retried, the rest are released untouched
+                    results.append((row, e, True))
+                    break
+        finally:
+            try:
+                smtp.quit()
+            except (OSError, smtplib.SMTPException):
+                smtp.close()
+        return results
 
-        # Check if file exists and generate a unique name if necessary
-        counter = 1
-        while os.path.exists(receipt_path):
-            filename = f"{base_filename}_{counter}.pdf"
-            receipt_path = os.path.join("receipts", filename)
-            counter += 1
+    def record(self, conn, batch, results):
+        """Store the outcome of each message and release any the session did not reach"""
+        now = datetime.now()
+        done = set()
+        with conn:
+            for row, error, retry in results:
+                message_id, attempts = row[0], row[5] + 1
+                done.add(message_id)
+                if error is None:
+                    conn.execute("""UPDATE email_outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL
+                                    WHERE id = ?""", (attempts, now.isoformat(timespec='seconds'), message_id))
+                    continue
+                status = 'queued' if retry and attempts < self.MAX_ATTEMPTS else 'failed'
+                next_attempt = now.timestamp() + self.BACKOFF_SECONDS * 2 ** (attempts - 1)
+                conn.execute("""UPDATE email_outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?
+                                WHERE id = ?""",
+                             (status, attempts, str(error)[:500],
+                              datetime.fromtimestamp(next_attempt).isoformat(timespec='seconds'), message_id))
+            conn.executemany("UPDATE email_outbox SET status = 'queued' WHERE id = ? AND status = 'sending'",
+                             [(row[0],) for row in batch if row[0] not in done])
 
-        # Create PDF
-        full_width, full_height = A4
-        half_a4_height = full_height / 2
-        c = canvas.Canvas(receipt_path, pagesize=(full_width, half_a4_height))
-        width, height = full_width, half_a4_height # Use the new, smaller height for calculations
-        # Colors and fonts
-        blue = HexColor('#1a355e')
-        light_blue = HexColor('#5fa8d3')
-        # Logo
+    def run(self):
+        conn = connect_database(self.db_path, busy_timeout_ms=30000)
+        while not self.stopping:
+            try:
+                batch = self.claim(conn)
+            except sqlite3.OperationalError:
+                batch = []
+            if not batch:
+                if self.wakeup.wait(self.poll_seconds):
+                    # Messages tend to arrive in a stream (e.g. as receipts are generated);
+                    # wait a moment so they go out together over one session
+                    time.sleep(self.LINGER_SECONDS)
+                self.wakeup.clear()
+                continue
+            self.record(conn, batch, self.send_batch(batch))
+        conn.close()
+
+
+class StorageMaintenance:
+    """One maintenance run over the database on a private connection in a background thread.
+
+    Steps: move orphaned payments (whose student was deleted) to orphaned_payments, refresh
+    the planner statistics, give free pages back to the file system with an incremental
+    vacuum and run an integrity quick-check. A step that fails, e.g. because another copy
+    holds a lock for too long, is reported and the run moves on. The report is stored in
+    maintenance_runs.
+
+    Switching a database to auto_vacuum=INCREMENTAL takes a full VACUUM, which locks out
+    every writer until it ends, so it is only done when convert is set (an explicit request
+    from the maintenance window); until then the vacuum step is skipped.
+    """
+
+    INCREMENTAL = 2  # PRAGMA auto_vacuum value
+
+    def __init__(self, db_path, convert=False):
+        self.db_path = db_path
+        self.convert = convert
+        self.finished = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            conn = connect_database(self.db_path, busy_timeout_ms=30000)
+            try:
+                report = self.maintain(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            report = {'error': str(e)}
+        self.finished.put(report)
+
+    def file_size(self, conn):
+        return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+    def maintain(self, conn):
+        started_at = datetime.now().isoformat(timespec='seconds')
+        started = time.perf_counter()
+        size_before = self.file_size(conn)
+        steps = []
+        for name, step in (("Orphaned payments", self.archive_orphans), ("Statistics", self.refresh_statistics),
+                           ("Vacuum", self.vacuum), ("Integrity", self.quick_check)):
+            step_started = time.perf_counter()
+            try:
+                detail = step(conn)
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                detail = f"failed: {e}"
+            steps.append({'step': name, 'ms': round((time.perf_counter() - step_started) * 1000, 1), 'detail': detail})
+        report = {'started_at': started_at, 'seconds': round(time.perf_counter() - started, 2),
+                  'size_before': size_before, 'size_after': self.file_size(conn),
+                  'integrity': steps[-1]['detail'], 'steps': steps}
+        with conn:
+            conn.execute("""INSERT INTO maintenance_runs (started_at, seconds, size_before, size_after, integrity, steps)
+                            VALUES (?, ?, ?, ?, ?, ?)""",
+                         (started_at, report['seconds'], size_before, report['size_after'], report['integrity'],
+                          json.dumps(steps)))
+            conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('maintenance_last_run', ?)", (started_at,))
+        return report
+
+    def archive_orphans(self, conn):
+        """Move payments whose student no longer exists to orphaned_payments, where they can be reattached"""
+        columns = ", ".join(row[1] for row in conn.execute("PRAGMA main.table_info(payments)"))
+        orphaned = "NOT EXISTS (SELECT 1 FROM students s WHERE s.id = payments.student_id)"
+        with conn:
+            # Still collected money: the flag stops the triggers reversing it in the ledger and rollups
+            conn.execute("UPDATE app_meta SET value = 1 WHERE key = 'archiving'")
+            conn.execute(f"""
+                INSERT OR IGNORE INTO orphaned_payments ({columns}, orphaned_at)
+                SELECT {columns}, ? FROM payments WHERE {orphaned}
+            """, (datetime.now().isoformat(timespec='seconds'),))
+            moved = conn.execute(f"""
+                DELETE FROM payments WHERE {orphaned} AND id IN (SELECT id FROM orphaned_payments)
+            """).rowcount
+            conn.execute("UPDATE app_meta SET value = 0 WHERE key = 'archiving'")
+        return f"{moved} moved to orphaned payments"
+
+    def refresh_statistics(self, conn):
+        # PRAGMA optimize only re-analyzes tables that need it, which assumes they were analyzed once
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+            conn.execute("ANALYZE")
+            conn.commit()
+            return "ANALYZE (first run)"
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+        return "PRAGMA optimize"
+
+    def vacuum(self, conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != self.INCREMENTAL:
+            if not self.convert:
+                return "skipped: space reclaiming is not enabled (see Database Maintenance)"
+            # The auto_vacuum mode of an existing database only changes with a full VACUUM
+            conn.execute(f"PRAGMA auto_vacuum = {self.INCREMENTAL}")
+            conn.execute("VACUUM")
+            return "switched to incremental auto_vacuum (full VACUUM)"
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+        return f"{free_pages} free pages released"
+
+    def quick_check(self, conn):
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check(20)")]
+        return "ok" if problems == ["ok"] else "; ".join(problems)
+
+
+# Reminder wording, parsed once and filled in for every student
+REMINDER_TEMPLATE = Template(
+    "Dear Parent,\n\n"
+    "This is a gentle reminder that ₹$balance of the annual fee of ₹$total_fee for $name ($class_name) "
+    "is still outstanding.$last_payment\n\n"
+    "Please pay at the school office at your earliest convenience. Ignore this message if you have paid already.\n\n"
+    "Thank you,\n$school"
+)
+
+
+def reminder_message(fields):
+    """Render the reminder text for one student's fields (see ReminderJob.fields)"""
+    last_payment = (f" We last received ₹{fields['last_amount']:.2f} on {fields['last_paid_date']}."
+                    if fields['last_paid_date'] else "")
+    return REMINDER_TEMPLATE.substitute(fields, balance=f"{fields['balance']:.2f}",
+                                        total_fee=f"{fields['total_fee']:.2f}", last_payment=last_payment)
+
+
+def register_reminder_font(font):
+    # Runs once in each worker process, which starts without the app's registered fonts
+    if font != 'Helvetica':
+        pdfmetrics.registerFont(TTFont(font, f'{font}.ttf'))
+
+
+def write_reminder_pdf(job):
+    """Draw one half-A4 reminder; job is (reminder id, path, fields, message, font). Returns (id, error)"""
+    reminder_id, path, fields, message, font = job
+    try:
+        width, height = A4[0], A4[1] / 2
+        c = canvas.Canvas(path, pagesize=(width, height))
+        navy = HexColor('#1a355e')
         logo_path = os.path.join("templates", "logo.png")
         if os.path.exists(logo_path):
-            # Adjust logo vertical position
-            c.drawImage(logo_path, 40, height - 80, width=80, height=80, mask='auto') # Adjusted from height - 110
-        # School name and slogan
+            c.drawImage(logo_path, 40, height - 80, width=80, height=80, mask='auto')
         c.setFont("Helvetica-Bold", 18)
-        c.setFillColor(blue)
-        # Adjust school name vertical position
-        c.drawString(140, height - 30, self.school_name.get()) # Adjusted from height - 60
-        c.setFont("Helvetica", 12)
-        c.setFillColor(light_blue)
-        # Adjust slogan vertical position
-        c.drawString(140, height - 50, "CHOOSE SMART, BE SMART") # Adjusted from height - 80
-
-        # Add School Address and Contact
+        c.setFillColor(navy)
+        c.drawString(140, height - 30, fields['school'])
+        c.drawRightString(width - 40, height - 30, "FEE REMINDER")
         c.setFont("Helvetica", 10)
         c.setFillColor(black)
-        # Adjust address and contact vertical positions
-        c.drawString(140, height - 70, f"Address: {self.school_address.get()}") # Adjusted from height - 100
-        c.drawString(140, height - 85, f"Contact: {self.school_contact.get()}") # Adjusted from height - 115
+        c.drawString(140, height - 70, f"Address: {fields['school_address']}")
+        c.drawString(140, height - 85, f"Contact: {fields['school_contact']}")
+        c.drawRightString(width - 40, height - 50, f"Date: {fields['date']}")
+        c.setStrokeColor(navy)
+        c.setLineWidth(2)
+        c.line(40, height - 100, width - 40, height - 100)
 
-        # Fee Receipt title
-        c.setFont("Helvetica-Bold", 18)
+        y = height - 120
+        for label, value in (("Student Name:", fields['name']), ("Class:", fields['class_name']),
+                             ("Balance Due:", f"₹{fields['balance']:.2f}")):
+            c.setFont("Helvetica-Bold", 12)
+            c.setFillColor(navy)
+            c.drawString(50, y, label)
+            c.setFont(font, 12)
+            c.setFillColor(black)
+            c.drawString(170, y, value)
+            y -= 20
+
+        text = c.beginText(50, y - 10)
+        text.setFont(font, 10)
+        for paragraph in message.split("\n"):
+            for line in textwrap.wrap(paragraph, 95) or [""]:
+                text.textLine(line)
+        c.drawText(text)
+        c.save()
+        return reminder_id, None
+    except Exception as e:
+        return reminder_id, str(e)
+
+
+class DatabaseBackup:
+    """Copies the database to a file with SQLite's online backup, on a private connection in a background thread.
+
+    Connection.backup() only returns once the copy is complete, so it cannot be spread over
+    job steps on the UI thread. Here it copies PAGES pages at a time, pausing between them so
+    other connections can write, and keeps (pages copied, total) in progress for the job to
+    show. The copy is written next to the target and renamed over it once complete; the
+    result (None, or the error) is put on finished.
+    """
+
+    PAGES = 256
+    PAUSE_SECONDS = 0.005
+
+    def __init__(self, db_path, path):
+        self.db_path = db_path
+        self.path = path
+        self.progress = (0, 0)
+        self.cancelled = False
+        self.finished = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def copied(self, status, remaining, total):
+        if self.cancelled:
+            raise sqlite3.OperationalError("backup cancelled")
+        self.progress = (total - remaining, total)
+
+    def run(self):
+        partial_path = self.path + ".partial"
+        try:
+            source = connect_database(self.db_path, busy_timeout_ms=30000)
+            try:
+                target = sqlite3.connect(partial_path)
+                try:
+                    source.backup(target, pages=self.PAGES, progress=self.copied, sleep=self.PAUSE_SECONDS)
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            os.replace(partial_path, self.path)
+            error = None
+        except (sqlite3.Error, OSError) as e:
+            error = str(e)
+        self.finished.put(error)
+
+
+class ReminderJob:
+    """Writes the reminders of one reminder run from a worker thread.
+
+    The run's students are copied into the reminders table when the run is created, so the
+    job only streams the reminders still 'pending' in id order, a chunk at a time: each
+    chunk's messages are rendered from REMINDER_TEMPLATE, its PDFs are drawn in parallel
+    worker processes and the chunk is marked written in one transaction. An interrupted or
+    cancelled run therefore resumes where it stopped. When every reminder is done, the
+    messages are written to messages.csv in the run's folder for sending by SMS or WhatsApp.
+    Progress is reported on the progress queue as (done, total), then ('finished', report).
+    """
+
+    CHUNK_SIZE = 64
+
+    def __init__(self, db_path, run_id, school, font='Helvetica', workers=None):
+        self.db_path = db_path
+        self.run_id = run_id
+        self.school = school
+        self.font = font
+        self.workers = workers or os.cpu_count() or 1
+        self.cancelled = False
+        self.progress = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def pending_chunks(self, conn):
+        """Yield the run's pending reminders in chunks of CHUNK_SIZE rows, seeking on id"""
+        last_id = 0
+        while True:
+            rows = conn.execute("""
+                SELECT id, student_id, name, class, parent_number, parent_email, balance, last_paid_date, last_amount
+                FROM reminders WHERE run_id = ? AND status = 'pending' AND id > ?
+                ORDER BY id LIMIT ?
+            """, (self.run_id, last_id, self.CHUNK_SIZE)).fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+
+    def fields(self, row, today, total_fee):
+        _, _, name, class_name, parent_number, parent_email, balance, last_paid_date, last_amount = row
+        return dict(self.school, name=name, class_name=class_name, balance=balance, total_fee=total_fee,
+                    last_paid_date=last_paid_date, last_amount=last_amount or 0.0, date=today)
+
+    def jobs(self, rows, folder, today, total_fee):
+        for row in rows:
+            fields = self.fields(row, today, total_fee)
+            safe_name = "".join(ch for ch in row[2] if ch.isalnum() or ch in (' ', '-', '_')).strip()
+            path = os.path.join(folder, f"{safe_name}_{row[3]}_{row[1]}.pdf")
+            yield row[0], path, fields, reminder_message(fields), self.font
+
+    def run(self):
+        report = {'run_id': self.run_id}
+        try:
+            conn = connect_database(self.db_path, busy_timeout_ms=30000)
+            try:
+                report.update(self.write_all(conn))
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError) as e:
+            report['error'] = str(e)
+        self.progress.put(('finished', report))
+
+    def write_all(self, conn):
+        from concurrent.futures import ProcessPoolExecutor
+        folder, total_fee = conn.execute("SELECT folder, total_fee FROM reminder_runs WHERE id = ?",
+                                         (self.run_id,)).fetchone()
+        os.makedirs(folder, exist_ok=True)
+        total, done = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(status != 'pending'), 0) FROM reminders WHERE run_id = ?
+        """, (self.run_id,)).fetchone()
+        self.progress.put((done, total))
+        today = date.today().isoformat()
+        started = time.perf_counter()
+        pool = None
+        if self.workers > 1:
+            pool = ProcessPoolExecutor(self.workers, initializer=register_reminder_font, initargs=(self.font,))
+        try:
+            for rows in self.pending_chunks(conn):
+                if self.cancelled:
+                    break
+                jobs = list(self.jobs(rows, folder, today, total_fee))
+                results = dict(pool.map(write_reminder_pdf, jobs) if pool else map(write_reminder_pdf, jobs))
+                with conn:
+                    conn.executemany("""
+                        UPDATE reminders SET message = ?, pdf_path = ?, status = ?, error = ? WHERE id = ?
+                    """, [(message, path, 'failed' if results[reminder_id] else 'written', results[reminder_id], reminder_id)
+                          for reminder_id, path, _, message, _ in jobs])
+                done += len(jobs)
+                self.progress.put((done, total))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        written, failed = conn.execute("""
+            SELECT COALESCE(SUM(status = 'written'), 0), COALESCE(SUM(status = 'failed'), 0)
+            FROM reminders WHERE run_id = ?
+        """, (self.run_id,)).fetchone()
+        finished = done == total and not self.cancelled
+        if finished:
+            self.write_messages(conn, folder)
+        with conn:
+            conn.execute("UPDATE reminder_runs SET status = ?, written = ?, failed = ?, finished_at = ? WHERE id = ?",
+                         ('done' if finished else 'open', written, failed,
+                          datetime.now().isoformat(timespec='seconds') if finished else None, self.run_id))
+        return {'folder': folder, 'total': total, 'written': written, 'failed': failed, 'finished': finished,
+                'seconds': round(time.perf_counter() - started, 1)}
+
+    def write_messages(self, conn, folder):
+        """Stream the run's messages into messages.csv, one row per written reminder"""
+        import csv
+        with open(os.path.join(folder, "messages.csv"), 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Student Name', 'Class', 'Parent Number', 'Parent E-mail', 'Balance', 'Message', 'PDF'])
+            writer.writerows(conn.execute("""
+                SELECT name, class, parent_number, parent_email, balance, message, pdf_path
+                FROM reminders WHERE run_id = ? AND status = 'written' ORDER BY class, name
+            """, (self.run_id,)))
+
+
+class JobQueue:
+    """Persistent queue of long-running jobs kept in the jobs table.
+
+    A job is worked through in chunks. Whoever runs a chunk writes its results and then
+    calls checkpoint() before committing, so the chunk and the record of it land in the
+    same transaction and a restart continues after the last committed chunk. At most one
+    queued or running job may hold a resource (a partial unique index enforces this
+    across every copy of the app sharing the database). A running job belongs to the copy
+    that claimed it; another copy only takes it over once its heartbeat is STALE_SECONDS
+    old, i.e. its owner has crashed. The queue never commits itself.
+    """
+
+    STALE_SECONDS = 60
+
+    def __init__(self, conn, owner):
+        self.conn = conn
+        self.owner = owner
+
+    def enqueue(self, kind, resource, params, total=None):
+        """Add a job and return its id; raises ValueError if the resource is already taken"""
+        try:
+            cursor = self.conn.execute("""
+                INSERT INTO jobs (kind, resource, params, total, created_at) VALUES (?, ?, ?, ?, ?)
+            """, (kind, resource, json.dumps(params), total, datetime.now().isoformat(timespec='seconds')))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Another job is already working on {resource}.") from None
+        return cursor.lastrowid
+
+    def active(self, resource):
+        """Return (id, params) of the queued or running job holding a resource, or None"""
+        row = self.conn.execute("SELECT id, params FROM jobs WHERE resource = ? AND status IN ('queued', 'running')",
+                                (resource,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def update_params(self, job_id, params, total=None):
+        self.conn.execute("UPDATE jobs SET params = ?, total = COALESCE(?, total) WHERE id = ?",
+                          (json.dumps(params), total, job_id))
+
+    def next_job(self):
+        """Claim the oldest job this copy may run and return (id, kind, params, checkpoint), or None"""
+        now = datetime.now()
+        stale = datetime.fromtimestamp(now.timestamp() - self.STALE_SECONDS).isoformat(timespec='seconds')
+        claimable = "status = 'queued' OR status = 'running' AND (owner = ? OR heartbeat_at < ?)"
+        row = self.conn.execute(f"""
+            SELECT id, kind, params, checkpoint FROM jobs WHERE {claimable} ORDER BY id LIMIT 1
+        """, (self.owner, stale)).fetchone()
+        if row is None:
+            return None
+        # Re-checked under the write lock, in case another copy claimed it meanwhile
+        now = now.isoformat(timespec='seconds')
+        claimed = self.conn.execute(f"""
+            UPDATE jobs SET status = 'running', owner = ?, heartbeat_at = ?, started_at = COALESCE(started_at, ?)
+            WHERE id = ? AND ({claimable})
+        """, (self.owner, now, now, row[0], self.owner, stale)).rowcount
+        if not claimed:
+            return None
+        return row[0], row[1], json.loads(row[2]), json.loads(row[3]) if row[3] else None
+
+    def checkpoint(self, job_id, checkpoint, done, total, finished=False):
+        """Save a step's progress; a dict checkpoint with 'failed' items has their count shown as the job's error"""
+        now = datetime.now().isoformat(timespec='seconds')
+        error = None
+        if isinstance(checkpoint, dict) and checkpoint.get('failed'):
+            error = f"{checkpoint['failed']} failed; last: {checkpoint.get('last_error')}"[:500]
+        self.conn.execute("""
+            UPDATE jobs SET checkpoint = ?, done = ?, total = COALESCE(?, total), status = ?, heartbeat_at = ?,
+                            finished_at = ?, error = COALESCE(?, error)
+            WHERE id = ? AND status = 'running'
+        """, (json.dumps(checkpoint), done, total, 'done' if finished else 'running', now,
+              now if finished else None, error, job_id))
+
+    def fail(self, job_id, error):
+        self.conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                          (str(error)[:500], datetime.now().isoformat(timespec='seconds'), job_id))
+
+    def cancel(self, job_id):
+        self.conn.execute("""
+            UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('queued', 'running')
+        """, (datetime.now().isoformat(timespec='seconds'), job_id))
+
+    def retry(self, job_id):
+        """Queue a failed or cancelled job again; it carries on from its last checkpoint"""
+        try:
+            self.conn.execute("""
+                UPDATE jobs SET status = 'queued', error = NULL, finished_at = NULL
+                WHERE id = ? AND status IN ('failed', 'cancelled')
+            """, (job_id,))
+        except sqlite3.IntegrityError:
+            raise ValueError("Another job is already working on the same thing.") from None
+
+
+STATEMENT_STYLE = """
+body { font-family: Helvetica, Arial, sans-serif; margin: 2em auto; max-width: 44em; color: #222; }
+h1 { font-size: 1.4em; margin-bottom: 0; } h2 { font-size: 1.1em; font-weight: normal; color: #555; }
+table { border-collapse: collapse; width: 100%; margin: 1em 0; }
+th, td { border-bottom: 1px solid #ccc; padding: 0.4em; text-align: left; }
+td.amount, th.amount { text-align: right; }
+.balance { font-size: 1.2em; font-weight: bold; }
+.muted { color: #777; font-size: 0.9em; }
+"""
+
+
+def statement_html(title, heading, body, updated):
+    return (f"<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n"
+            f"<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">\n"
+            f"<title>{escape(title)}</title>\n<style>{STATEMENT_STYLE}</style>\n</head>\n<body>\n"
+            f"{heading}\n{body}\n<p class=\"muted\">Updated {escape(updated)}</p>\n</body>\n</html>\n")
+
+
+def student_statement_page(fields, payments):
+    """Render one student's fee statement.
+
+    fields holds school, name, class_name, total_fee, paid and balance; payments are
+    (paid_date, amount, payment_mode, receipt file name or None), oldest first.
+    """
+    from urllib.parse import quote
+    rows = ""
+    for paid_date, amount, mode, receipt in payments:
+        link = f"<a href=\"../receipts/{quote(receipt)}\">Receipt</a>" if receipt else ""
+        rows += (f"<tr><td>{escape(paid_date or '')}</td><td class=\"amount\">₹{amount:,.2f}</td>"
+                 f"<td>{escape(mode or '')}</td><td>{link}</td></tr>\n")
+    body = (f"<p>Annual fee: ₹{fields['total_fee']:,.2f}<br>Paid: ₹{fields['paid']:,.2f}</p>\n"
+            f"<p class=\"balance\">Balance due: ₹{fields['balance']:,.2f}</p>\n"
+            "<table>\n<tr><th>Paid On</th><th class=\"amount\">Amount</th><th>Mode</th><th></th></tr>\n"
+            + (rows or "<tr><td colspan=\"4\">No payments yet.</td></tr>\n") + "</table>")
+    heading = (f"<h1>{escape(fields['name'])} ({escape(fields['class_name'] or '')})</h1>\n"
+               f"<h2>{escape(fields['school'])} &ndash; fee statement</h2>")
+    return statement_html(f"{fields['name']} - Fee Statement", heading, body, fields['updated'])
+
+
+def statement_index_page(school, students, updated):
+    """Render the index of statements; students are (name, class, balance, file name) by class and name"""
+    rows = "".join(
+        f"<tr><td><a href=\"students/{escape(file_name)}\">{escape(name)}</a></td><td>{escape(class_name or '')}</td>"
+        f"<td class=\"amount\">₹{balance:,.2f}</td></tr>\n"
+        for name, class_name, balance, file_name in students)
+    body = ("<table>\n<tr><th>Student</th><th>Class</th><th class=\"amount\">Balance Due</th></tr>\n"
+            + rows + "</table>")
+    return statement_html(f"{school} - Fee Statements", f"<h1>{escape(school)}</h1>\n<h2>Fee statements</h2>",
+                          body, updated)
+
+
+def normalize_reference(text):
+    """Upper-case a payment reference (UTR, cheque number) and drop spaces and punctuation"""
+    return re.sub(r"[^0-9A-Z]", "", (text or "").upper())
+
+
+def parse_statement_date(text):
+    """Parse the date formats banks commonly export; return an ISO date string or None"""
+    text = (text or "").strip()
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%d-%m-%y", "%d-%b-%Y", "%d %b %Y", "%d-%b-%y", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def read_bank_statement(path):
+    """Yield the credit lines of a bank or UPI statement CSV, one dict per line.
+
+    The header row is found by its column names (banks put account details above it);
+    debit lines are skipped. Each line has line_no, date, amount, reference,
+    description, the payment mode suggested by the narration and any reference-like
+    tokens found in it.
+    """
+    import csv
+    aliases = {
+        'date': ("date", "txn date", "transaction date", "value date", "tran date"),
+        'credit': ("credit", "deposit", "deposits", "credit amount", "cr amount", "credit (inr)"),
+        'amount': ("amount", "transaction amount", "amount (inr)"),
+        'type': ("cr/dr", "dr/cr", "type", "transaction type"),
+        'reference': ("reference", "ref no", "ref no.", "reference no", "reference no.", "utr", "utr no",
+                      "cheque no", "cheque no.", "chq no", "chq/ref no", "chq./ref.no."),
+        'description': ("description", "narration", "particulars", "remarks", "details"),
+    }
+    with open(path, newline='', encoding='utf-8-sig') as statement:
+        columns = None
+        for line_no, cells in enumerate(csv.reader(statement), 1):
+            names = [cell.strip().lower() for cell in cells]
+            if columns is None:
+                found = {key: names.index(alias) for key, options in aliases.items()
+                         for alias in options if alias in names}
+                if 'date' in found and ('credit' in found or 'amount' in found):
+                    columns = found
+                continue
+
+            def cell(key):
+                index = columns.get(key)
+                return cells[index].strip() if index is not None and index < len(cells) else ""
+
+            day = parse_statement_date(cell('date'))
+            amount_text = (cell('credit') or ('' if 'credit' in columns else cell('amount'))).replace(",", "")
+            if not day or not amount_text or cell('type').upper().startswith("D"):
+                continue
+            try:
+                amount = float(amount_text)
+            except ValueError:
+                continue
+            if amount <= 0:
+                continue
+            description = cell('description')
+            narration = description.upper()
+            if "UPI" in narration or "NEFT" in narration or "IMPS" in narration or "RTGS" in narration:
+                mode = "Online"
+            elif "CHQ" in narration or "CHEQUE" in narration or "CLG" in narration:
+                mode = "Cheque"
+            elif "CASH" in narration:
+                mode = "Cash"
+            else:
+                mode = None
+            references = {normalize_reference(cell('reference'))} - {""}
+            references.update(token for token in re.findall(r"[0-9A-Z]{6,}", narration) if any(c.isdigit() for c in token))
+            yield {'line_no': line_no, 'date': day, 'amount': amount, 'reference': cell('reference'),
+                   'description': description, 'mode': mode, 'references': references}
+
+
+def reconcile_statement(lines, payments, window_days=3):
+    """Match statement credit lines to payments without comparing every line with every payment.
+
+    payments are (id, paid_date, amount, payment_mode, reference, student name). They are
+    indexed by reference and by amount (in paise), each amount bucket sorted by paid date,
+    so a line only looks at payments with its reference, or with its amount inside the
+    date window. Returns (matched, ambiguous, unmatched): matched holds
+    (line, payment, how), ambiguous holds (line, candidate payments).
+    """
+    from bisect import bisect_left, bisect_right
+    by_reference = {}
+    by_amount = {}
+    for payment in payments:
+        reference = normalize_reference(payment[4])
+        if reference:
+            by_reference.setdefault(reference, []).append(payment)
+        day = date.fromisoformat(payment[1]).toordinal() if payment[1] else 0
+        by_amount.setdefault(round(payment[2] * 100), []).append((day, payment))
+    for bucket in by_amount:
+        by_amount[bucket].sort(key=lambda entry: entry[0])
+        by_amount[bucket] = ([day for day, _ in by_amount[bucket]], [payment for _, payment in by_amount[bucket]])
+
+    taken = set()
+    matched, ambiguous, unmatched = [], [], []
+    # Pass 1: a reference plus the same amount is a certain match
+    remaining = []
+    for line in lines:
+        paise = round(line['amount'] * 100)
+        hit = next((payment for reference in line['references'] for payment in by_reference.get(reference, ())
+                    if payment[0] not in taken and round(payment[2] * 100) == paise), None)
+        if hit:
+            taken.add(hit[0])
+            matched.append((line, hit, "Reference"))
+        else:
+            remaining.append(line)
+
+    # Pass 2: same amount within the date window, with a compatible payment mode
+    for line in remaining:
+        days, bucket = by_amount.get(round(line['amount'] * 100), ((), ()))
+        day = date.fromisoformat(line['date']).toordinal()
+        candidates = [payment for payment in bucket[bisect_left(days, day - window_days):bisect_right(days, day + window_days)]
+                      if payment[0] not in taken
+                      and (line['mode'] is None or payment[3] in (None, 'Other', line['mode']))]
+        if not candidates:
+            unmatched.append(line)
+            continue
+        if len(candidates) > 1:
+            # Several candidates: accept one only if it is strictly closest in date
+            distance = {payment[0]: abs(date.fromisoformat(payment[1]).toordinal() - day) for payment in candidates}
+            candidates.sort(key=lambda payment: distance[payment[0]])
+            if distance[candidates[0][0]] == distance[candidates[1][0]]:
+                ambiguous.append((line, candidates))
+                continue
+        taken.add(candidates[0][0])
+        matched.append((line, candidates[0], "Amount and date" if len(candidates) == 1 else "Closest date"))
+    return matched, ambiguous, unmatched
+
+
+# Spreadsheet serial day numbers count from 1899-12-30
+XLSX_EPOCH = date(1899, 12, 30).toordinal()
+XLSX_MAX_ROWS = 1048576
+# Cell style indexes in XLSX_STYLES: header, date, date and time, amount
+XLSX_STYLE = {'header': 1, 'date': 2, 'datetime': 3, 'amount': 4}
+XLSX_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="2"><numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd"/><numFmt numFmtId="165" formatCode="yyyy\\-mm\\-dd\\ hh:mm"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/></font></fonts>
+<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill><fill><patternFill patternType="solid"><fgColor rgb="FF2C3E50"/><bgColor indexed="64"/></patternFill></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1"/><xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/><xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/><xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+# Characters XML 1.0 does not allow, even escaped
+XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def xlsx_column_name(index):
+    """Spreadsheet column letters for a 0-based column index (0 -> A, 26 -> AA)"""
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+
+def xlsx_cell(ref, value, kind):
+    """XML for one cell; numbers, amounts and ISO dates become typed cells, anything else text"""
+    if value is None or value == '':
+        return ''
+    if kind in ('number', 'amount') and isinstance(value, (int, float)):
+        style = f' s="{XLSX_STYLE["amount"]}"' if kind == 'amount' else ''
+        return f'<c r="{ref}"{style}><v>{value!r}</v></c>'
+    if kind in ('date', 'datetime') and isinstance(value, str):
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        else:
+            serial = moment.toordinal() - XLSX_EPOCH
+            if kind == 'datetime':
+                serial += (moment.hour * 3600 + moment.minute * 60 + moment.second) / 86400
+            return f'<c r="{ref}" s="{XLSX_STYLE[kind]}"><v>{serial!r}</v></c>'
+    text = XML_ILLEGAL.sub('', escape(str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(path, sheet_name, columns, rows):
+    """Stream rows into a single-sheet .xlsx file using only the standard library.
+
+    columns is a list of (header, kind, width) with kind one of 'text', 'number',
+    'amount', 'date' or 'datetime'. Rows are written to the zip as they are read
+    (strings inline, no shared string table), so memory use does not grow with the
+    row count. Returns the number of rows written; rows past the spreadsheet limit
+    of 1,048,576 lines are left out.
+    """
+    import io
+    import zipfile
+    refs = [xlsx_column_name(i) for i in range(len(columns))]
+    last_ref = refs[-1]
+    sheet_name = escape(sheet_name[:31])
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as book:
+        book.writestr('[Content_Types].xml', """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>""")
+        book.writestr('_rels/.rels', """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>""")
+        book.writestr('xl/workbook.xml', f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>""")
+        book.writestr('xl/_rels/workbook.xml.rels', """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>""")
+        book.writestr('xl/styles.xml', XLSX_STYLES)
+        with book.open('xl/worksheets/sheet1.xml', 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8') as sheet:
+            sheet.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                        '</sheetView></sheetViews><cols>')
+            sheet.write(''.join(f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+                                for i, (_, _, width) in enumerate(columns, 1)))
+            sheet.write('</cols><sheetData><row r="1">')
+            sheet.write(''.join(f'<c r="{ref}1" s="{XLSX_STYLE["header"]}" t="inlineStr"><is><t>{escape(header)}</t></is></c>'
+                                for ref, (header, _, _) in zip(refs, columns)))
+            sheet.write('</row>')
+            kinds = [kind for _, kind, _ in columns]
+            line = 1
+            for row in rows:
+                if line == XLSX_MAX_ROWS:
+                    break
+                line += 1
+                sheet.write(f'<row r="{line}">' + ''.join(xlsx_cell(f'{ref}{line}', value, kind)
+                                                          for ref, value, kind in zip(refs, row, kinds)) + '</row>')
+            sheet.write(f'</sheetData><autoFilter ref="A1:{last_ref}{line}"/></worksheet>')
+    return line - 1
+
+
+class FeeReceiptApp:
+    CLASS_OPTIONS = ["MINI KG", "JR KG", "SR KG"]
+    TOTAL_FEE = 19000
+    # Aging buckets as (label, upper bound in days outstanding); None means open-ended
+    AGING_BUCKETS = [("0-30", 30), ("31-60", 60), ("61-90", 90), ("90+", None)]
+    AGING_PAGE_SIZE = 200
+    RECENT_PAGE_SIZE = 20
+    HISTORY_PAGE_SIZE = 200
+    DB_PATH = "db/students.db"
+    # Columns carried in branch sync changesets (payments also carry their student's global id)
+    STUDENT_SYNC_COLUMNS = ('global_id', 'name', 'class', 'contact', 'mother_name', 'father_name',
+                            'parent_number', 'parent_email', 'created_date', 'left_date', 'updated_at')
+    PAYMENT_SYNC_COLUMNS = ('global_id', 'due_date', 'paid_date', 'amount', 'status', 'payment_mode',
+                            'reference', 'created_date', 'updated_at')
+    # Closed academic years are moved to one archive database per year
+    ARCHIVE_DIR = os.path.join("db", "archive")
+    ACADEMIC_YEAR_START_MONTH = 6
+    # Live history filtering: wait this long after the last edit, then poll the worker
+    LIVE_FILTER_DELAY_MS = 300
+    LIVE_FILTER_POLL_MS = 30
+    PAYMENT_MODES = ["Cash", "Online", "Cheque", "Other"]
+    # Background jobs run one chunk per tick, each stopping after about JOB_STEP_MS so the window keeps
+    # redrawing; jobs whose work runs in a thread of their own are polled every JOB_POLL_MS. While idle
+    # the queue is checked for jobs left by a crashed copy
+    JOB_TICK_MS = 10
+    JOB_STEP_MS = 50
+    JOB_POLL_MS = 1000
+    JOB_IDLE_MS = 15000
+    THREADED_JOB_KINDS = ('backup',)
+    JOB_KINDS = {'receipts': "Generate receipts", 'import_students': "Import students",
+                 'export_csv': "Export payments to CSV", 'backup': "Backup database",
+                 'statements': "Export parent statements"}
+    RECEIPT_JOB_CHUNK = 5
+    IMPORT_JOB_CHUNK = 500
+    EXPORT_JOB_CHUNK = 500
+    STATEMENT_JOB_CHUNK = 50
+    # Parent statements are re-exported to the last chosen folder once they are this old; checked hourly
+    STATEMENT_INTERVAL_HOURS = 24
+    STATEMENT_CHECK_MS = 3600000
+    # Days either side of a statement date to look for the matching payment
+    RECONCILE_WINDOW_DAYS = 3
+    EMAIL_WORKERS = 2
+    EMAIL_OUTBOX_REFRESH_MS = 2000
+    # The SMTP password is kept out of the database (and so out of its backups and archives),
+    # in a file in the user's home folder that only they can read
+    SMTP_PASSWORD_FILE = os.path.join(os.path.expanduser("~"), ".fee_receipt_smtp_password")
+    # Statements slower than this are logged with their query plan
+    SLOW_QUERY_MS = 100
+    SLOW_QUERY_LOG = os.path.join("db", "slow_queries.log")
+    # Storage maintenance runs this long after start-up when the last run is older than the interval
+    MAINTENANCE_INTERVAL_DAYS = 7
+    MAINTENANCE_DELAY_MS = 60000
+    MAINTENANCE_POLL_MS = 500
+    # Fee reminders are written to one folder per run; None uses one worker process per CPU
+    REMINDER_DIR = "reminders"
+    REMINDER_WORKERS = None
+    REMINDER_POLL_MS = 200
+    # Payment history rows; created_date comes last so pages can seek on (created_date, id)
+    HISTORY_SELECT_SQL = """
+        SELECT p.id, s.name, s.class, s.contact, p.due_date, p.paid_date,
+               p.amount, p.status, p.receipt_path, p.payment_mode, p.created_date
+        FROM {payments} p
+        JOIN students s ON p.student_id = s.id
+    """
+    # Payment and student fields in the order create_pdf_receipt unpacks them
+    RECEIPT_SELECT_SQL = """
+        SELECT p.id, p.student_id, p.due_date, p.paid_date, p.amount, p.status, p.receipt_path, p.created_date,
+               p.payment_mode, s.name, s.class, s.contact, s.mother_name, s.father_name, s.parent_number, s.parent_email
+        FROM payments p
+        JOIN students s ON p.student_id = s.id
+    """
+    # What a student owes: every fee and adjustment charged less every payment, from the ledger.
+    # Archiving payments leaves the ledger alone, so balances carry across years.
+    STUDENT_BALANCE_SQL = "(SELECT COALESCE(SUM(l.amount_paise), 0) FROM ledger l WHERE l.student_id = s.id)"
+    # Student fields, amount paid since the given paid_day and the balance, as cached in StudentRecord
+    STUDENT_RECORD_SQL = f"""
+        SELECT s.id, s.name, s.class, s.contact, s.mother_name, s.father_name, s.parent_number, s.parent_email,
+               COALESCE((SELECT SUM(p.amount_paise) FROM payments p WHERE p.student_id = s.id AND p.paid_day >= ?), 0) / 100.0,
+               {STUDENT_BALANCE_SQL} / 100.0
+        FROM students s
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Fee Receipt Generator - Offline")
+        self.root.geometry("1000x700")
+        self.root.configure(bg='#f0f0f0')
+        
+        # Initialize database
+        self.init_database()
+        # Warm the student cache so switching between students needs no queries
+        self.load_student_records()
+
+        # Row snapshots, sort order and quick filters of the sortable Treeviews
+        self.tree_views = {}
+
+        # Keyset pagination state for the recent payments and history views
+        self.page_state = {}
+        self.page_controls = {}
+
+        # Archive databases currently attached to the main connection
+        self.attached_archives = {}
+
+        # Live history filtering state
+        self.live_filter_job = None
+        self.live_filter_polling = False
+        self.history_generation = 0
+        self.history_worker = None
+
+        # Pending tick of the background job runner
+        self.job_tick = None
+
+        # Background sender for queued receipt e-mails
+        self.email_sender = None
+
+        # Data changes published by writers, delivered to the views once per idle tick
+        self.changes = ChangeBus(self.root.after_idle)
+
+        # Create main interface
+        self.create_widgets()
+        self.start_email_sender()
+
+        # Storage maintenance, run in the background once it is due
+        self.maintenance = None
+        # Database copy made by the running backup job
+        self.backup = None
+        self.reminder_job = None
+
+        # Carry on with jobs left unfinished when the app last closed
+        self.schedule_jobs()
+        self.root.after(self.MAINTENANCE_DELAY_MS, self.run_maintenance_if_due)
+        self.root.after(self.MAINTENANCE_DELAY_MS, self.run_statements_if_due)
+        
+        # Register a font that supports the rupee symbol
+        try:
+            pdfmetrics.registerFont(TTFont('Arial', 'Arial.ttf'))
+            self.rupee_font = 'Arial'
+        except Exception:
+            # Fallback to default font if Arial is not found
+            self.rupee_font = 'Helvetica'
+            messagebox.showwarning("Font Warning", "Arial.ttf not found. Rupee symbol may not display correctly. Install 'Arial' font or place 'Arial.ttf' in the 'templates' folder.")
+    
+    def init_database(self):
+        """Initialize SQLite database and create tables if they don't exist"""
+        # Create directories
+        os.makedirs("db", exist_ok=True)
+        os.makedirs("receipts", exist_ok=True)
+        os.makedirs("templates", exist_ok=True)
+        
+        # Time every statement; slow ones go to the slow-query log with their plan
+        self.query_tracer = QueryTracer(self.SLOW_QUERY_LOG, self.SLOW_QUERY_MS)
+        self.conn = connect_database(self.DB_PATH, tracer=self.query_tracer)
+        self.cursor = self.conn.cursor()
+        
+        # Create students table (add parent_name, parent_number, parent_email if not exist)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS students (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                class TEXT NOT NULL,
+                contact TEXT,
+                mother_name TEXT,
+                father_name TEXT,
+                parent_number TEXT,
+                parent_email TEXT,
+                created_date DATE DEFAULT CURRENT_DATE
+            )
+        ''')
+        # Try to add columns if they don't exist (for upgrades)
+        try:
+            self.cursor.execute('ALTER TABLE students ADD COLUMN mother_name TEXT')
+        except sqlite3.OperationalError:
+            pass
+        try:
+            self.cursor.execute('ALTER TABLE students ADD COLUMN father_name TEXT')
+        except sqlite3.OperationalError:
+            pass
+        try:
+            self.cursor.execute('ALTER TABLE students ADD COLUMN parent_number TEXT')
+        except sqlite3.OperationalError:
+            pass
+        try:
+            self.cursor.execute('ALTER TABLE students ADD COLUMN parent_email TEXT')
+        except sqlite3.OperationalError:
+            pass
+        # Set when a student leaves at a year rollover; leavers drop out of the payment lists and reports
+        try:
+            self.cursor.execute('ALTER TABLE students ADD COLUMN left_date DATE')
+        except sqlite3.OperationalError:
+            pass
+        # Remove the old parent_name column if it exists (optional, but good for cleanup)
+        # Note: SQLite doesn't directly support dropping columns easily. A common workaround is
+        # to create a new table, copy data, drop the old table, and rename the new one.
+        # For simplicity here, we'll just add the new columns and ignore the old one in code.
+        # If a clean migration is needed, more complex SQL would be required.
+        # Keeping the old column won't break the app but is less clean.
+        # Let's check if parent_name exists and, if so, create a new table structure without it
+        self.cursor.execute("PRAGMA table_info(students)")
+        columns = [info[1] for info in self.cursor.fetchall()]
+        if 'parent_name' in columns:
+            self.cursor.execute('''
+                CREATE TABLE students_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    contact TEXT,
+                    mother_name TEXT,
+                    father_name TEXT,
+                    parent_number TEXT,
+                    parent_email TEXT,
+                    created_date DATE DEFAULT CURRENT_DATE
+                )
+            ''')
+            self.cursor.execute('''
+                INSERT INTO students_new (id, name, class, contact, parent_number, parent_email, created_date)
+                SELECT id, name, class, contact, parent_number, parent_email, created_date FROM students
+            ''')
+            self.cursor.execute('DROP TABLE students')
+            self.cursor.execute('ALTER TABLE students_new RENAME TO students')
+        
+        # Create payments table
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS payments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id INTEGER,
+                due_date DATE,
+                paid_date DATE,
+                amount REAL NOT NULL,
+                status TEXT DEFAULT 'Pending',
+                receipt_path TEXT,
+                created_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (student_id) REFERENCES students (id)
+            )
+        ''')
+        
+        # Try to add payment_mode column if it doesn't exist
+        try:
+            self.cursor.execute('ALTER TABLE payments ADD COLUMN payment_mode TEXT')
+        except sqlite3.OperationalError:
+            pass
+        # Bank / UPI / cheque reference of the payment, used for statement reconciliation
+        try:
+            self.cursor.execute('ALTER TABLE payments ADD COLUMN reference TEXT')
+        except sqlite3.OperationalError:
+            pass
+        # Payments confirmed against a bank statement line
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bank_reconciliation (
+                payment_id INTEGER PRIMARY KEY,
+                statement_date DATE NOT NULL,
+                amount REAL NOT NULL,
+                reference TEXT,
+                description TEXT,
+                confirmed_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Integer paise and day-number columns generated from amount and paid_date
+        for column, expression in PAYMENT_INTEGER_COLUMNS.items():
+            try:
+                self.cursor.execute(f'ALTER TABLE payments ADD COLUMN {column} INTEGER GENERATED ALWAYS AS ({expression}) VIRTUAL')
+            except sqlite3.OperationalError:
+                pass
+        # Index payments by student, with the amount, so per-student totals are read from the index alone
+        self.cursor.execute('DROP INDEX IF EXISTS idx_payments_student')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_student_paise ON payments (student_id, amount_paise)')
+        # Backs paid-date range filters
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_paid_day ON payments (paid_day)')
+        # Backs the newest-first keyset pagination of recent payments and history
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_created ON payments (created_date, id)')
+
+        # Application metadata: data version counter and flags read by triggers
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS app_meta (
+                key TEXT PRIMARY KEY,
+                value
+            )
+        ''')
+        self.cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('data_version', 0)")
+        # Set to 1 while payments are being moved to an archive, so triggers don't treat them as deletions
+        self.cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('archiving', 0)")
+
+        # Whole-paise amounts and YYYY-MM-DD dates, enforced on every write to payments
+        self.init_payment_checks()
+
+        # Collection rollups kept up to date by triggers
+        self.init_rollups()
+
+        # Append-only balance ledger with periodic snapshots
+        self.init_ledger()
+
+        # Global ids, change timestamps and tombstones for branch sync
+        self.init_sync()
+
+        # Outbound queue for e-mailing receipts
+        self.init_email()
+
+        # Orphaned payments and the log of storage maintenance runs
+        self.init_maintenance()
+
+        # Batch fee reminder runs for students with a balance
+        self.init_reminders()
+
+        # Durable queue of long-running jobs
+        self.init_jobs()
+
+        # Year-end class promotions and the snapshots that undo them
+        self.init_rollover()
+
+        # Content hashes of the exported parent statement pages
+        self.init_statements()
+
+        # Data version counter, bumped by triggers on every write to payments or students
+        for table in ("payments", "students"):
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                self.cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS data_version_{table}_{event.lower()} AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE app_meta SET value = value + 1 WHERE key = 'data_version';
+                    END
+                ''')
+        self.query_cache = QueryCache()
+        self.student_cache = StudentCache()
+
+        self.conn.commit()
+
+    def init_payment_checks(self):
+        """Normalise existing payments once, then reject writes with part-paise amounts or malformed dates.
+
+        Rows moved in or out while the 'archiving' flag is set are existing payments and are
+        not checked again.
+        """
+        self.cursor.execute("SELECT value FROM app_meta WHERE key = 'payments_normalised'")
+        if self.cursor.fetchone() is None:
+            normalise_payments(self.cursor)
+            for label in self.list_archived_years():
+                archive = sqlite3.connect(self.archive_path(label))
+                try:
+                    with archive:
+                        normalise_payments(archive.cursor())
+                finally:
+                    archive.close()
+            self.cursor.execute("INSERT INTO app_meta (key, value) VALUES ('payments_normalised', 1)")
+
+        bad_payment = """
+            (SELECT value FROM app_meta WHERE key = 'archiving') IS NOT 1
+            AND (abs(NEW.amount * 100 - round(NEW.amount * 100)) > 1e-6
+                 OR date(NEW.paid_date) IS NOT NEW.paid_date
+                 OR date(NEW.due_date) IS NOT NEW.due_date)
+        """
+        raise_error = "SELECT RAISE(ABORT, 'payment amounts must be whole paise and dates YYYY-MM-DD');"
+        self.cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS payments_check_insert BEFORE INSERT ON payments
+            WHEN {bad_payment}
+            BEGIN {raise_error} END
+        ''')
+        self.cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS payments_check_update BEFORE UPDATE OF amount, paid_date, due_date ON payments
+            WHEN {bad_payment}
+            BEGIN {raise_error} END
+        ''')
+
+    def init_rollups(self):
+        """Create the per-day and per-month collection rollup tables and the triggers that maintain them.
+
+        Rollups are keyed by (period, class, payment_mode), where class is the class the
+        student was in when the payment was recorded, kept on the payment as student_class.
+        Later class changes and rollovers therefore leave past collections where they were.
+        Every payment insert, delete or update adjusts only the affected rollup rows, so the
+        dashboard never has to scan the payments table.
+        """
+        rollups = [("collection_daily", "day", "{day}"), ("collection_monthly", "month", "substr({day}, 1, 7)")]
+        for table, period, _ in rollups:
+            # Rollups from before integer paise held REAL rupees; they are derived, so rebuild them
+            self.cursor.execute(f"PRAGMA table_info({table})")
+            if 'amount' in {row[1] for row in self.cursor.fetchall()}:
+                self.cursor.execute(f"DROP TABLE {table}")
+            self.cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {period} TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    payment_mode TEXT NOT NULL,
+                    amount_paise INTEGER NOT NULL DEFAULT 0,
+                    payments INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY ({period}, class, payment_mode)
+                ) WITHOUT ROWID
+            ''')
+
+        # Class of the student when the payment was recorded; payments that predate the column
+        # take the student's current class, which is what their rollup rows were keyed by
+        try:
+            self.cursor.execute('ALTER TABLE payments ADD COLUMN student_class TEXT')
+            # A one-off fill, not an edit: keep it out of the sync change timestamps (init_sync
+            # recreates the trigger)
+            self.cursor.execute("DROP TRIGGER IF EXISTS sync_payments_update")
+            self.cursor.execute("""
+                UPDATE payments SET student_class = (SELECT class FROM students WHERE id = payments.student_id)
+            """)
+        except sqlite3.OperationalError:
+            pass
+
+        def apply(row, class_expr, sign):
+            # Statements adding (sign=+1) or removing (sign=-1) one payment row from both rollups
+            day = f"COALESCE({row}.paid_date, date({row}.created_date))"
+            mode = f"COALESCE({row}.payment_mode, 'Other')"
+            statements = []
+            for table, period, period_expr in rollups:
+                key = period_expr.format(day=day)
+                statements.append(f'''
+                    INSERT INTO {table} ({period}, class, payment_mode, amount_paise, payments)
+                    VALUES ({key}, {class_expr}, {mode}, {sign} * {row}.amount_paise, {sign})
+                    ON CONFLICT ({period}, class, payment_mode) DO UPDATE
+                    SET amount_paise = amount_paise + excluded.amount_paise, payments = payments + excluded.payments;
+                ''')
+                if sign < 0:
+                    statements.append(f'''
+                        DELETE FROM {table}
+                        WHERE {period} = {key} AND class = {class_expr} AND payment_mode = {mode} AND payments <= 0;
+                    ''')
+            return "".join(statements)
+
+        def student_class(row):
+            # NEW.student_class is still unset while the insert triggers run
+            return f"COALESCE({row}.student_class, (SELECT class FROM students WHERE id = {row}.student_id), 'Unknown')"
+
+        # Triggers are recreated on every start so changes to their definitions reach existing databases
+        for trigger in ("rollup_payment_insert", "rollup_payment_delete", "rollup_payment_update",
+                        "rollup_student_class", "rollup_student_delete", "payments_stamp_class"):
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+        self.cursor.execute('''
+            CREATE TRIGGER payments_stamp_class AFTER INSERT ON payments
+            WHEN NEW.student_class IS NULL
+            BEGIN
+                UPDATE payments SET student_class = (SELECT class FROM students WHERE id = NEW.student_id)
+                WHERE id = NEW.id;
+            END
+        ''')
+
+        # Payments restored from orphaned_payments (while 'archiving' is set) were never taken out
+        self.cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS rollup_payment_insert AFTER INSERT ON payments
+            WHEN (SELECT value FROM app_meta WHERE key = 'archiving') IS NOT 1
+            BEGIN {apply("NEW", student_class("NEW"), 1)} END
+        ''')
+        self.cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS rollup_payment_delete AFTER DELETE ON payments
+            WHEN (SELECT value FROM app_meta WHERE key = 'archiving') IS NOT 1
+            BEGIN {apply("OLD", student_class("OLD"), -1)} END
+        ''')
+        self.cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS rollup_payment_update
+            AFTER UPDATE OF student_id, amount, paid_date, payment_mode ON payments
+            BEGIN {apply("OLD", student_class("OLD"), -1)} {apply("NEW", student_class("NEW"), 1)} END
+        ''')
+
+        # Backfill once for databases that already have payments
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM collection_daily), EXISTS (SELECT 1 FROM payments)")
+        has_rollups, has_payments = self.cursor.fetchone()
+        if has_payments and not has_rollups:
+            self.rebuild_rollups()
+
+    def init_ledger(self):
+        """Create the append-only ledger, its balance snapshots and the triggers that feed it.
+
+        Every entry is signed by its effect on what the student owes: the annual fee is
+        posted as a positive adjustment on admission, payments are negative, and deleting
+        or changing a payment appends a reversal dated on the original paid date. Ledger
+        rows are never updated or deleted. Amounts and balances are whole paise.
+        """
+        for trigger in ("ledger_no_update", "ledger_no_delete", "ledger_student_insert",
+                        "ledger_payment_insert", "ledger_payment_delete", "ledger_payment_update"):
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+        # A ledger from before integer paise held REAL rupees: move it aside, copy it back converted
+        # below (its triggers are dropped above, so the rename doesn't rewrite them) and rebuild the
+        # snapshots, which are derived from it
+        self.cursor.execute("PRAGMA table_info(ledger)")
+        convert = 'amount' in {row[1] for row in self.cursor.fetchall()}
+        if convert:
+            self.cursor.execute("DROP INDEX IF EXISTS idx_ledger_date")
+            self.cursor.execute("DROP INDEX IF EXISTS idx_ledger_student")
+            self.cursor.execute("ALTER TABLE ledger RENAME TO ledger_rupees")
+            self.cursor.execute("DROP TABLE IF EXISTS balance_snapshots")
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id INTEGER NOT NULL,
+                entry_type TEXT NOT NULL CHECK (entry_type IN ('payment', 'reversal', 'adjustment')),
+                payment_id INTEGER,
+                amount_paise INTEGER NOT NULL,
+                entry_date DATE NOT NULL,
+                note TEXT,
+                created_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        if convert:
+            self.cursor.execute(f'''
+                INSERT INTO ledger (id, student_id, entry_type, payment_id, amount_paise, entry_date, note, created_date)
+                SELECT id, student_id, entry_type, payment_id, {PAYMENT_INTEGER_COLUMNS['amount_paise']},
+                       entry_date, note, created_date
+                FROM ledger_rupees
+            ''')
+            self.cursor.execute("DROP TABLE ledger_rupees")
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_date ON ledger (entry_date)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_student ON ledger (student_id, entry_date)')
+        # Checkpoint of each student's balance as of a month end, covering ledger rows up to ledger_id
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS balance_snapshots (
+                as_of DATE NOT NULL,
+                student_id INTEGER NOT NULL,
+                ledger_id INTEGER NOT NULL,
+                balance_paise INTEGER NOT NULL,
+                PRIMARY KEY (as_of, student_id)
+            )
+        ''')
+
+        self.cursor.execute('''
+            CREATE TRIGGER ledger_no_update BEFORE UPDATE ON ledger
+            BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER ledger_no_delete BEFORE DELETE ON ledger
+            BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END
+        ''')
+        self.cursor.execute(f'''
+            CREATE TRIGGER ledger_student_insert AFTER INSERT ON students
+            BEGIN
+                INSERT INTO ledger (student_id, entry_type, amount_paise, entry_date, note)
+                VALUES (NEW.id, 'adjustment', {self.TOTAL_FEE * 100}, COALESCE(NEW.created_date, date('now')), 'Annual fee');
+            END
+        ''')
+        payment_entry = '''
+            INSERT INTO ledger (student_id, entry_type, payment_id, amount_paise, entry_date)
+            VALUES (NEW.student_id, 'payment', NEW.id, -NEW.amount_paise, COALESCE(NEW.paid_date, date(NEW.created_date)));
+        '''
+        reversal_entry = '''
+            INSERT INTO ledger (student_id, entry_type, payment_id, amount_paise, entry_date)
+            VALUES (OLD.student_id, 'reversal', OLD.id, OLD.amount_paise, COALESCE(OLD.paid_date, date(OLD.created_date)));
+        '''
+        # Payments moved to an archive are still paid, so they are not reversed (nor posted again on restore)
+        self.cursor.execute(f'''
+            CREATE TRIGGER ledger_payment_insert AFTER INSERT ON payments
+            WHEN (SELECT value FROM app_meta WHERE key = 'archiving') IS NOT 1
+            BEGIN {payment_entry} END
+        ''')
+        self.cursor.execute(f'''
+            CREATE TRIGGER ledger_payment_delete AFTER DELETE ON payments
+            WHEN (SELECT value FROM app_meta WHERE key = 'archiving') IS NOT 1
+            BEGIN {reversal_entry} END
+        ''')
+        self.cursor.execute(f'''
+            CREATE TRIGGER ledger_payment_update AFTER UPDATE OF student_id, amount, paid_date ON payments
+            BEGIN {reversal_entry} {payment_entry} END
+        ''')
+
+        # Seed the ledger once from existing students and payments
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM ledger), EXISTS (SELECT 1 FROM students)")
+        has_ledger, has_students = self.cursor.fetchone()
+        if has_students and not has_ledger:
+            self.cursor.execute('''
+                INSERT INTO ledger (student_id, entry_type, payment_id, amount_paise, entry_date, note)
+                SELECT student_id, entry_type, payment_id, amount_paise, entry_date, note FROM (
+                    SELECT id AS student_id, 'adjustment' AS entry_type, NULL AS payment_id, ? AS amount_paise,
+                           COALESCE(created_date, date('now')) AS entry_date, 'Annual fee' AS note
+                    FROM students
+                    UNION ALL
+                    SELECT student_id, 'payment', id, -amount_paise, COALESCE(paid_date, date(created_date)), NULL
+                    FROM payments
+                )
+                ORDER BY entry_date
+            ''', (self.TOTAL_FEE * 100,))
+        self.checkpoint_balances()
+
+    def init_sync(self):
+        """Prepare students and payments for offline branch sync.
+
+        Each row gets a stable random global_id (local ids differ between branches) and an
+        updated_at timestamp maintained by triggers; deletions leave a tombstone. Changesets
+        carry everything changed since the last export's high-water mark.
+        """
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_tombstones (
+                global_id TEXT PRIMARY KEY,
+                table_name TEXT NOT NULL,
+                deleted_at TEXT NOT NULL
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted ON sync_tombstones (deleted_at)')
+        for table in ("students", "payments"):
+            for column in ("global_id", "updated_at"):
+                try:
+                    self.cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+                except sqlite3.OperationalError:
+                    pass
+            self.cursor.execute(f"""
+                UPDATE {table}
+                SET global_id = COALESCE(global_id, lower(hex(randomblob(16)))),
+                    updated_at = COALESCE(updated_at, strftime('%Y-%m-%dT%H:%M:%f', created_date), strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+                WHERE global_id IS NULL OR updated_at IS NULL
+            """)
+            self.cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_global_id ON {table} (global_id)')
+            self.cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)')
+
+            for trigger in (f"sync_{table}_insert", f"sync_{table}_update", f"sync_{table}_delete"):
+                self.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            self.cursor.execute(f"""
+                CREATE TRIGGER sync_{table}_insert AFTER INSERT ON {table}
+                WHEN NEW.global_id IS NULL OR NEW.updated_at IS NULL
+                BEGIN
+                    UPDATE {table}
+                    SET global_id = COALESCE(global_id, lower(hex(randomblob(16)))),
+                        updated_at = COALESCE(updated_at, strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+                    WHERE id = NEW.id;
+                END
+            """)
+            # Writers that set updated_at themselves (sync import) keep their value
+            self.cursor.execute(f"""
+                CREATE TRIGGER sync_{table}_update AFTER UPDATE ON {table}
+                WHEN NEW.updated_at IS OLD.updated_at
+                BEGIN
+                    UPDATE {table} SET updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') WHERE id = NEW.id;
+                END
+            """)
+            archived_check = "AND (SELECT value FROM app_meta WHERE key = 'archiving') IS NOT 1" if table == "payments" else ""
+            self.cursor.execute(f"""
+                CREATE TRIGGER sync_{table}_delete AFTER DELETE ON {table}
+                WHEN OLD.global_id IS NOT NULL {archived_check}
+                BEGIN
+                    INSERT OR REPLACE INTO sync_tombstones (global_id, table_name, deleted_at)
+                    VALUES (OLD.global_id, '{table}', strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+                END
+            """)
+        self.cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('branch_id', lower(hex(randomblob(4))))")
+
+    def ledger_balance_query(self, as_of=None, student_id=None):
+        """Return (query, params) giving (student_id, balance_paise) as of a date.
+
+        Starts from the latest snapshot on or before the date and adds the short tail of
+        ledger entries it doesn't cover: those dated after the snapshot, plus any appended
+        since the snapshot with an earlier (back-dated) entry date. Without a date every
+        entry counts, including a coming year's fee charged ahead by a rollover.
+        """
+        if as_of is None:
+            as_of = '9999-12-31'
+        self.cursor.execute('''
+            SELECT as_of, MAX(ledger_id) FROM balance_snapshots
+            WHERE as_of = (SELECT MAX(as_of) FROM balance_snapshots WHERE as_of <= ?)
+        ''', (as_of,))
+        snap_as_of, snap_ledger_id = self.cursor.fetchone()
+        if snap_as_of is None:
+            snap_as_of, snap_ledger_id = '', 0
+        student_filter = " AND student_id = ?" if student_id is not None else ""
+        extra = [student_id] if student_id is not None else []
+        query = f'''
+            SELECT student_id, SUM(amount_paise) AS balance_paise FROM (
+                SELECT student_id, balance_paise AS amount_paise FROM balance_snapshots WHERE as_of = ?{student_filter}
+                UNION ALL
+                SELECT student_id, amount_paise FROM ledger WHERE entry_date > ? AND entry_date <= ?{student_filter}
+                UNION ALL
+                SELECT student_id, amount_paise FROM ledger WHERE id > ? AND entry_date <= ?{student_filter}
+            )
+            GROUP BY student_id
+        '''
+        params = [snap_as_of] + extra + [snap_as_of, as_of] + extra + [snap_ledger_id, snap_as_of] + extra
+        return query, params
+
+    def checkpoint_balances(self):
+        """Write a balance snapshot for every month end since the last one, up to last month"""
+        self.cursor.execute("SELECT MAX(as_of) FROM balance_snapshots")
+        last = self.cursor.fetchone()[0]
+        if last is None:
+            self.cursor.execute("SELECT MIN(entry_date) FROM ledger")
+            first_entry = self.cursor.fetchone()[0]
+            if first_entry is None:
+                return
+            year, month = int(first_entry[:4]), int(first_entry[5:7])
+        else:
+            year, month = int(last[:4]), int(last[5:7]) + 1
+        this_month = date.today().replace(day=1)
+        while True:
+            if month > 12:
+                year, month = year + 1, 1
+            month_end = date.fromordinal((date(year + month // 12, month % 12 + 1, 1)).toordinal() - 1)
+            if month_end >= this_month:
+                break
+            query, params = self.ledger_balance_query(month_end.isoformat())
+            self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM ledger")
+            ledger_id = self.cursor.fetchone()[0]
+            self.cursor.execute(f'''
+                INSERT OR REPLACE INTO balance_snapshots (as_of, student_id, ledger_id, balance_paise)
+                SELECT ?, student_id, ?, balance_paise FROM ({query})
+            ''', [month_end.isoformat(), ledger_id] + params)
+            month += 1
+
+    def add_fee_adjustment(self):
+        """Append a manual adjustment (extra charge or concession) to the selected student's ledger"""
+        from tkinter import simpledialog
+        if not self.student_combo.get():
+            messagebox.showerror("Error", "Please select a student!")
+            return
+        student_id = int(self.student_combo.get().split("ID:")[1])
+        amount = simpledialog.askfloat("Fee Adjustment",
+                                       "Amount to add to the amount owed (₹).\nUse a negative amount for a concession:",
+                                       parent=self.root)
+        if not amount:
+            return
+        try:
+            amount_paise = to_paise(amount)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        note = simpledialog.askstring("Fee Adjustment", "Reason for the adjustment:", parent=self.root) or ''
+        try:
+            self.cursor.execute(
+                "INSERT INTO ledger (student_id, entry_type, amount_paise, entry_date, note) VALUES (?, 'adjustment', ?, ?, ?)",
+                (student_id, amount_paise, date.today().isoformat(), note.strip())
+            )
+            self.refresh_payment_statuses([student_id])
+            self.conn.commit()
+            self.student_cache.invalidate(student_id)
+            self.changes.publish('payments')
+            messagebox.showinfo("Success", "Adjustment recorded in the ledger.")
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Error recording adjustment: {e}")
+
+    def show_balances_as_of(self):
+        """Show what each student owed on a chosen date, reconstructed from the ledger"""
+        balance_win = tk.Toplevel(self.root)
+        balance_win.title("Outstanding Balances As Of Date")
+        balance_win.geometry("700x500")
+
+        top_frame = ttk.Frame(balance_win, padding="5")
+        top_frame.pack(fill='x')
+        ttk.Label(top_frame, text="As of:").pack(side='left', padx=5)
+        as_of_entry = DateEntry(top_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
+        as_of_entry.pack(side='left', padx=5)
+        total_var = tk.StringVar(value='')
+        ttk.Label(top_frame, textvariable=total_var, font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+
+        columns = ('Name', 'Class', 'Contact', 'Outstanding')
+        tree = ttk.Treeview(balance_win, columns=columns, show='headings')
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=150)
+        tree.pack(fill='both', expand=True, padx=5, pady=5)
+
+        def load():
+            for item in tree.get_children():
+                tree.delete(item)
+            query, params = self.ledger_balance_query(as_of_entry.get())
+            self.cursor.execute(f'''
+                SELECT s.name, s.class, s.contact, b.balance_paise
+                FROM ({query}) b
+                JOIN students s ON s.id = b.student_id
+                WHERE b.balance_paise > 0
+                ORDER BY s.class, s.name
+            ''', params)
+            rows = self.cursor.fetchall()
+            for i, (name, class_name, contact, balance_paise) in enumerate(rows):
+                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
+                tree.insert('', 'end', values=(name, class_name, contact, f"₹{balance_paise / 100:.2f}"), tags=(tag,))
+            total_var.set(f"{len(rows)} students owed ₹{sum(row[3] for row in rows) / 100:.2f}")
+
+        tree.tag_configure('evenrow', background='lightblue')
+        tree.tag_configure('oddrow', background='white')
+        ttk.Button(top_frame, text="Show", command=load).pack(side='left', padx=5)
+        load()
+
+    def rebuild_rollups(self):
+        """Recompute both rollup tables from scratch with a single pass over payments"""
+        self.cursor.execute("DELETE FROM collection_daily")
+        self.cursor.execute("DELETE FROM collection_monthly")
+        self.cursor.execute('''
+            INSERT INTO collection_daily (day, class, payment_mode, amount_paise, payments)
+            SELECT COALESCE(p.paid_date, date(p.created_date)), COALESCE(p.student_class, s.class, 'Unknown'),
+                   COALESCE(p.payment_mode, 'Other'), SUM(p.amount_paise), COUNT(*)
+            FROM payments p
+            LEFT JOIN students s ON s.id = p.student_id
+            GROUP BY 1, 2, 3
+        ''')
+        self.cursor.execute('''
+            INSERT INTO collection_monthly (month, class, payment_mode, amount_paise, payments)
+            SELECT substr(day, 1, 7), class, payment_mode, SUM(amount_paise), SUM(payments)
+            FROM collection_daily
+            GROUP BY 1, 2, 3
+        ''')
+    
+    def data_version(self):
+        """Return the current data version of the payments and students tables"""
+        self.cursor.execute("SELECT value FROM app_meta WHERE key = 'data_version'")
+        return self.cursor.fetchone()[0]
+
+    def cached_query(self, key, query, params=()):
+        """Run a read query, reusing the cached rows while the data version is unchanged"""
+        version = self.data_version()
+        rows = self.query_cache.get(key, version)
+        if rows is None:
+            self.cursor.execute(query, params)
+            rows = self.cursor.fetchall()
+            self.query_cache.put(key, version, rows)
+        return rows
+
+    def student_record(self, student_id):
+        """Return a student's StudentRecord, reading it from the database only on a cache miss"""
+        record = self.student_cache.get(student_id)
+        if record is None:
+            self.cursor.execute(self.STUDENT_RECORD_SQL + " WHERE s.id = ?", (self.year_start_day(), student_id))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            record = StudentRecord(*row)
+            self.student_cache.put(record)
+        return record
+
+    def load_student_records(self):
+        """Read every current student in one query, refilling the cache, and return their records by class and name"""
+        self.cursor.execute(self.STUDENT_RECORD_SQL + " WHERE s.left_date IS NULL ORDER BY s.class, s.name",
+                            (self.year_start_day(),))
+        records = [StudentRecord(*row) for row in self.cursor.fetchall()]
+        for record in records:
+            self.student_cache.put(record)
+        return records
+
+    def create_widgets(self):
+        """Create the main GUI interface"""
+        # Create notebook for tabs
+        notebook = ttk.Notebook(self.root)
+        notebook.pack(fill='both', expand=True, padx=10, pady=10)
+        
+        # Tab 1: Student Management
+        student_frame = ttk.Frame(notebook)
+        notebook.add(student_frame, text="Student Management")
+        self.create_student_tab(student_frame)
+        
+        # Tab 2: Fee Payment
+        payment_frame = ttk.Frame(notebook)
+        notebook.add(payment_frame, text="Fee Payment")
+        self.create_payment_tab(payment_frame)
+        
+        # Tab 3: Payment History
+        history_frame = ttk.Frame(notebook)
+        notebook.add(history_frame, text="Payment History")
+        self.create_history_tab(history_frame)
+
+        # Tab 4: Dashboard
+        dashboard_frame = ttk.Frame(notebook)
+        notebook.add(dashboard_frame, text="Dashboard")
+        self.create_dashboard_tab(dashboard_frame)
+        # Refresh the dashboard whenever it is brought to the front
+        notebook.bind('<<NotebookTabChanged>>', lambda e: self.load_dashboard() if notebook.select() == str(dashboard_frame) else None)
+        self.subscribe_views(notebook, student_frame, payment_frame, history_frame)
+        
+        # Tab 5: Settings
+        settings_frame = ttk.Frame(notebook)
+        notebook.add(settings_frame, text="Settings")
+        self.create_settings_tab(settings_frame)
+
+    def subscribe_views(self, notebook, student_frame, payment_frame, history_frame):
+        """Subscribe each view to the tables it shows; views on a hidden tab catch up when it is selected"""
+        def on_screen(frame):
+            return lambda: notebook.select() == str(frame)
+
+        def refresh_fee_info(changes):
+            # Cached, so cheap; only skipped when other students were edited
+            student_ids = changes.get('students', ())
+            selected = self.student_combo.get()
+            if 'payments' in changes or student_ids is None or (
+                    "ID:" in selected and int(selected.split("ID:")[1]) in student_ids):
+                self.update_fee_info()
+
+        def refresh_history(changes):
+            self.load_history_page()
+            self.update_summary_bar()
+
+        self.changes.subscribe(('students',), lambda changes: self.load_students(self.student_search_entry.get()),
+                               on_screen(student_frame))
+        self.changes.subscribe(('students',), lambda changes: self.load_student_combo(), on_screen(payment_frame))
+        self.changes.subscribe(('students', 'payments'), lambda changes: self.load_recent_page(), on_screen(payment_frame))
+        self.changes.subscribe(('students', 'payments'), refresh_fee_info, on_screen(payment_frame))
+        self.changes.subscribe(('students', 'payments'), refresh_history, on_screen(history_frame))
+        notebook.bind('<<NotebookTabChanged>>', lambda e: self.changes.flush(), add='+')
+    
+    def create_student_tab(self, parent):
+        """Create student management interface"""
+        # Create two main frames: one for the form, one for the list
+        main_frame = ttk.Frame(parent, padding="10")
+        main_frame.pack(fill='both', expand=True)
+
+        # Form Frame (left side)
+        form_frame = ttk.LabelFrame(main_frame, text="Student Details", padding="10")
+        form_frame.pack(side='left', fill='y', padx=5, pady=5)
+
+        # List Frame (right side)
+        list_frame = ttk.LabelFrame(main_frame, text="All Students", padding="10")
+        list_frame.pack(side='right', fill='both', expand=True, padx=5, pady=5)
+
+        # --- Search Frame ---
+        search_frame = ttk.Frame(list_frame, padding="5")
+        search_frame.pack(fill='x')
+
+        ttk.Label(search_frame, text="Search:").pack(side='left', padx=5)
+        self.student_search_entry = ttk.Entry(search_frame, width=40)
+        self.student_search_entry.pack(side='left', padx=5, fill='x', expand=True)
+        ttk.Button(search_frame, text="Search", command=self.search_students).pack(side='left', padx=5)
+        ttk.Button(search_frame, text="Clear Search", command=self.clear_student_search).pack(side='left', padx=5)
+
+        # --- Form Widgets ---
+        row_counter = 0
+        ttk.Label(form_frame, text="Student Name:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
+        self.student_name = ttk.Entry(form_frame, width=30)
+        self.student_name.grid(row=row_counter, column=1, padx=5, pady=5)
+        row_counter += 1
+
+        ttk.Label(form_frame, text="Class:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
+        self.student_class = ttk.Combobox(form_frame, width=27, state='readonly', values=self.CLASS_OPTIONS)
+        self.student_class.grid(row=row_counter, column=1, padx=5, pady=5)
+        row_counter += 1
+
+        ttk.Label(form_frame, text="Contact Number:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
+        self.student_contact = ttk.Entry(form_frame, width=30)
+        self.student_contact.grid(row=row_counter, column=1, padx=5, pady=5)
+        row_counter += 1
+
+        ttk.Label(form_frame, text="Mother Name:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
+        self.mother_name = ttk.Entry(form_frame, width=30)
+        self.mother_name.grid(row=row_counter, column=1, padx=5, pady=5)
+        row_counter += 1
+
+        ttk.Label(form_frame, text="Father Name:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
+        self.father_name = ttk.Entry(form_frame, width=30)
+        self.father_name.grid(row=row_counter, column=1, padx=5, pady=5)
+        row_counter += 1
+
+        ttk.Label(form_frame, text="Parent Number:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
+        self.parent_number = ttk.Entry(form_frame, width=30)
+        self.parent_number.grid(row=row_counter, column=1, padx=5, pady=5)
+        row_counter += 1
+
+        ttk.Label(form_frame, text="Parent Email:").grid(row=row_counter, column=0, sticky='w', padx=5, pady=5)
+        self.parent_email = ttk.Entry(form_frame, width=30)
+        self.parent_email.grid(row=row_counter, column=1, padx=5, pady=5)
+        row_counter += 1
+
+        # --- Form Buttons ---
+        button_frame = ttk.Frame(form_frame)
+        button_frame.grid(row=row_counter, column=0, columnspan=2, pady=10)
+
+        self.add_update_button = ttk.Button(button_frame, text="Add Student", command=self.save_student_changes)
+        self.add_update_button.pack(side='left', padx=5)
+
+        self.clear_button = ttk.Button(button_frame, text="Clear Form", command=self.clear_student_form)
+        self.clear_button.pack(side='left', padx=5)
+        
+        # Import CSV Button (moved to form section)
+        ttk.Button(button_frame, text="Import from CSV", command=self.import_students_csv).pack(side='left', padx=5)
+        
+        self.selected_student_id = None # To keep track of student being edited
+
+        # --- List Widgets ---
+        columns = ('ID', 'Name', 'Class', 'Contact', 'Mother Name', 'Father Name', 'Parent Number', 'Parent Email', 'Created Date')
+        self.student_tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=15)
+
+        for col in columns:
+            self.student_tree.heading(col, text=col)
+            self.student_tree.column(col, width=100)
+
+        # Scrollbar
+        scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.student_tree.yview)
+        self.student_tree.configure(yscrollcommand=scrollbar.set)
+
+        self.student_tree.pack(side='top', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        
+        # Configure tags for alternating row colors
+        self.student_tree.tag_configure('evenrow', background='lightblue') # Light blue
+        self.student_tree.tag_configure('oddrow', background='white')  # White
+        self.make_sortable('students', self.student_tree, {'ID': 'q'})
+        
+        # --- List Buttons ---
+        list_button_frame = ttk.Frame(list_frame)
+        list_button_frame.pack(side='bottom', fill='x', pady=5)
+
+        # Edit Button
+        ttk.Button(list_button_frame, text="Edit Selected Student", command=self.select_student_for_edit).pack(side='left', padx=5)
+        
+        # Delete Button
+        ttk.Button(list_button_frame, text="Delete Selected Student", command=self.delete_selected_student).pack(side='left', padx=5)
+        ttk.Button(list_button_frame, text="Find Duplicates", command=self.show_duplicates).pack(side='left', padx=5)
+
+        # Quick class filter over the loaded list
+        self.student_class_quick = ttk.Combobox(list_button_frame, width=10, state='readonly', values=['All'] + self.CLASS_OPTIONS)
+        self.student_class_quick.set('All')
+        self.student_class_quick.pack(side='right', padx=5)
+        self.student_class_quick.bind('<<ComboboxSelected>>', lambda e: self.quick_filter('students', 'Class', self.student_class_quick.get()))
+        ttk.Label(list_button_frame, text="Show Class:").pack(side='right')
+
+        # Bind treeview selection to load student data
+        self.student_tree.bind('<<TreeviewSelect>>', self.select_student_for_edit)
+
+        # Load students initially
+        self.load_students()
+    
+    def create_payment_tab(self, parent):
+        """Create payment processing interface"""
+        # Payment Form
+        form_frame = ttk.LabelFrame(parent, text="Record Fee Payment", padding="10")
+        form_frame.pack(fill='x', padx=10, pady=5)
+        
+        # Class filter for students
+        filter_frame = ttk.Frame(parent)
+        filter_frame.pack(fill='x', padx=10, pady=2)
+        ttk.Label(filter_frame, text="Filter by Class:").pack(side='left', padx=5)
+        self.payment_class_filter = ttk.Combobox(filter_frame, width=15, state='readonly', values=['All'] + self.CLASS_OPTIONS)
+        self.payment_class_filter.set('All')
+        self.payment_class_filter.pack(side='left', padx=5)
+        self.payment_class_filter.bind('<<ComboboxSelected>>', self.update_payment_student_list)
+        # Search box with auto-complete
+        ttk.Label(filter_frame, text="Search Student:").pack(side='left', padx=5)
+        self.student_search_var = tk.StringVar()
+        self.student_search = ttk.Entry(filter_frame, textvariable=self.student_search_var, width=25)
+        self.student_search.pack(side='left', padx=5)
+        self.student_search.bind('<KeyRelease>', self.autocomplete_student_search)
+        self.student_search.bind('<Return>', self.select_autocomplete_student)
+        self.student_search_suggestions = tk.Listbox(filter_frame, width=25, height=3)
+        self.student_search_suggestions.pack_forget()
+        self.student_search_suggestions.bind('<<ListboxSelect>>', self.select_autocomplete_student)
+        
+        # Student Selection
+        ttk.Label(form_frame, text="Select Student:").grid(row=0, column=0, sticky='w', padx=5, pady=5)
+        self.student_combo = ttk.Combobox(form_frame, width=30, state='readonly')
+        self.student_combo.grid(row=0, column=1, padx=5, pady=5)
+        self.student_combo.bind("<<ComboboxSelected>>", self.update_fee_info)
+        # Class (read-only)
+        ttk.Label(form_frame, text="Class:").grid(row=0, column=2, sticky='w', padx=5, pady=5)
+        self.selected_class = ttk.Entry(form_frame, width=15, state='readonly')
+        self.selected_class.grid(row=0, column=3, padx=5, pady=5)
+        # Contact (read-only)
+        ttk.Label(form_frame, text="Contact:").grid(row=1, column=0, sticky='w', padx=5, pady=5)
+        self.selected_contact = ttk.Entry(form_frame, width=20, state='readonly')
+        self.selected_contact.grid(row=1, column=1, padx=5, pady=5)
+        # Paid Date
+        ttk.Label(form_frame, text="Paid Date:").grid(row=1, column=2, sticky='w', padx=5, pady=5)
+        
+        self.paid_date_entry = DateEntry(form_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
+        self.paid_date_entry.grid(row=1, column=3, padx=5, pady=5, sticky='we')
+        
+        # Due Date
+        ttk.Label(form_frame, text="Due Date:").grid(row=4, column=0, sticky='w', padx=5, pady=5)
+        
+        self.due_date_entry = DateEntry(form_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
+        self.due_date_entry.grid(row=4, column=1, padx=5, pady=5, sticky='we')
+        
+        # Mini-summary
+        self.fee_summary_var = tk.StringVar(value="")
+        ttk.Label(form_frame, textvariable=self.fee_summary_var, font=("Helvetica", 10, "bold")).grid(row=2, column=0, columnspan=4, sticky='w', padx=5, pady=5)
+        # Amount Paid
+        ttk.Label(form_frame, text="Amount Paid (₹):").grid(row=3, column=0, sticky='w', padx=5, pady=5)
+        self.amount = ttk.Entry(form_frame, width=15)
+        self.amount.grid(row=3, column=1, padx=5, pady=5)
+        # Pay Full Due button
+        ttk.Button(form_frame, text="Pay Full Due", command=self.pay_full_due).grid(row=3, column=2, padx=5, pady=5)
+        # Show All Dues button
+        ttk.Button(form_frame, text="Show All Pending", command=self.show_all_pending).grid(row=3, column=3, padx=5, pady=5)
+        # Aging Report button
+        ttk.Button(form_frame, text="Aging Report", command=self.show_aging_report).grid(row=5, column=3, padx=5, pady=5)
+        
+        # Total Fee (read-only, always 18000)
+        ttk.Label(form_frame, text="Total Fee (₹):").grid(row=4, column=0, sticky='w', padx=5, pady=5)
+        self.total_fee = ttk.Entry(form_frame, width=15, state='readonly')
+        self.total_fee.grid(row=4, column=1, padx=5, pady=5)
+        self.total_fee.config(state='normal'); self.total_fee.delete(0, tk.END); self.total_fee.insert(0, str(self.TOTAL_FEE)); self.total_fee.config(state='readonly')
+        
+        # Fee Info Labels
+        self.fee_paid_so_far_var = tk.StringVar(value="Fee Paid So Far: ₹0.00")
+        self.fee_remaining_var = tk.StringVar(value="Fee Remaining: ₹0.00")
+        ttk.Label(form_frame, textvariable=self.fee_paid_so_far_var).grid(row=4, column=2, padx=5, pady=5, sticky='w')
+        ttk.Label(form_frame, textvariable=self.fee_remaining_var).grid(row=4, column=3, padx=5, pady=5, sticky='w')
+        
+        # Payment Mode
+        ttk.Label(form_frame, text="Payment Mode:").grid(row=5, column=0, sticky='w', padx=5, pady=5)
+        self.payment_mode = ttk.Combobox(form_frame, width=27, state='readonly', values=self.PAYMENT_MODES)
+        self.payment_mode.grid(row=5, column=1, padx=5, pady=5)
+        self.payment_mode.set("Cash") # Default value
+        # Reference (UTR / cheque number)
+        reference_frame = ttk.Frame(form_frame)
+        reference_frame.grid(row=5, column=2, padx=5, pady=5, sticky='w')
+        ttk.Label(reference_frame, text="Reference:").pack(side='left')
+        self.payment_reference = ttk.Entry(reference_frame, width=14)
+        self.payment_reference.pack(side='left', padx=5)
+        
+        # Buttons
+        button_frame = ttk.Frame(form_frame)
+        button_frame.grid(row=6, column=0, columnspan=4, pady=10)
+        
+        ttk.Button(button_frame, text="Record Payment", command=self.record_payment).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Generate Receipt", command=self.generate_receipt).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Refresh Students", command=self.load_student_combo).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Fee Adjustment", command=self.add_fee_adjustment).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Balances As Of", command=self.show_balances_as_of).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Batch Entry", command=self.show_batch_entry).pack(side='left', padx=5)
+        
+        # Recent Payments
+        recent_frame = ttk.LabelFrame(parent, text="Recent Payments", padding="10")
+        recent_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        # Treeview for recent payments
+        payment_columns = ('ID', 'Student', 'Class', 'Due Date', 'Paid Date', 'Amount', 'Status', 'Payment Mode')
+        self.payment_tree = ttk.Treeview(recent_frame, columns=payment_columns, show='headings', height=12)
+        
+        for col in payment_columns:
+            self.payment_tree.heading(col, text=col)
+            self.payment_tree.column(col, width=100)
+        
+        # Scrollbar for payments
+        payment_scrollbar = ttk.Scrollbar(recent_frame, orient='vertical', command=self.payment_tree.yview)
+        self.payment_tree.configure(yscrollcommand=payment_scrollbar.set)
+        
+        self.payment_tree.pack(side='left', fill='both', expand=True)
+        payment_scrollbar.pack(side='right', fill='y')
+        
+        # Configure tags for alternating row colors
+        self.payment_tree.tag_configure('evenrow', background='lightblue') # Light blue
+        self.payment_tree.tag_configure('oddrow', background='white')  # White
+        self.payment_tree.tag_configure('cleared', background='#d4f7d4')
+        self.payment_tree.tag_configure('pending', background='#ffd6d6')
+        self.make_sortable('recent', self.payment_tree, {'ID': 'q', 'Amount': 'd'})
+        
+        # Delete Payment Button
+        delete_btn = ttk.Button(recent_frame, text="Delete Payment", command=self.delete_selected_payment)
+        delete_btn.pack(side='bottom', pady=5, anchor='e')
+        
+        # Filter buttons for status
+        filter_frame2 = ttk.Frame(parent)
+        filter_frame2.pack(fill='x', padx=10, pady=2)
+        ttk.Button(filter_frame2, text='All', command=lambda: self.filter_payments_tree('All')).pack(side='left', padx=2)
+        ttk.Button(filter_frame2, text='Cleared', command=lambda: self.filter_payments_tree('Cleared')).pack(side='left', padx=2)
+        ttk.Button(filter_frame2, text='Pending', command=lambda: self.filter_payments_tree('Pending')).pack(side='left', padx=2)
+        self.create_quick_filters(filter_frame2, 'recent')
+        self.create_page_controls(filter_frame2, 'recent', self.load_recent_page)
+        
+        # Load data
+        self.load_student_combo()
+        self.load_recent_payments()
+    
+    def create_history_tab(self, parent):
+        """Create payment history interface"""
+        # Filter Frame
+        filter_frame = ttk.LabelFrame(parent, text="Filter Options", padding="10")
+        filter_frame.pack(fill='x', padx=10, pady=5)
+        
+        # Class Filter (Row 0)
+        ttk.Label(filter_frame, text="Filter by Class:").grid(row=0, column=0, padx=5, pady=5, sticky='w')
+        self.filter_class = ttk.Combobox(filter_frame, width=15, values=['All'] + self.CLASS_OPTIONS, state='readonly')
+        self.filter_class.grid(row=0, column=1, padx=5, pady=5, sticky='we')
+        self.filter_class.set('All')
+        
+        # Status Filter (Row 0)
+        ttk.Label(filter_frame, text="Filter by Status:").grid(row=0, column=2, padx=5, pady=5, sticky='w')
+        self.filter_status = ttk.Combobox(filter_frame, values=['All', 'Pending', 'Cleared'], width=15)
+        self.filter_status.grid(row=0, column=3, padx=5, pady=5, sticky='we')
+        self.filter_status.set('All')
+
+        # Date Range Filter (Row 1)
+        row_counter = 1
+        ttk.Label(filter_frame, text="From Paid Date:").grid(row=row_counter, column=0, padx=5, pady=5, sticky='w')
+        
+        self.filter_start_date_entry = DateEntry(filter_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
+        self.filter_start_date_entry.grid(row=row_counter, column=1, padx=5, pady=5, sticky='we')
+
+        ttk.Label(filter_frame, text="To Paid Date:").grid(row=row_counter, column=2, padx=5, pady=5, sticky='w')
+
+        self.filter_end_date_entry = DateEntry(filter_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
+        self.filter_end_date_entry.grid(row=row_counter, column=3, padx=5, pady=5, sticky='we')
+
+        self.filter_use_dates = tk.BooleanVar(value=True)
+        ttk.Checkbutton(filter_frame, text="Use date range", variable=self.filter_use_dates, command=self.schedule_live_filter).grid(row=row_counter, column=5, padx=5, pady=5, sticky='w')
+
+        # Re-run the filter live as any filter changes
+        self.filter_class.bind('<<ComboboxSelected>>', self.schedule_live_filter)
+        self.filter_status.bind('<<ComboboxSelected>>', self.schedule_live_filter)
+        self.filter_status.bind('<KeyRelease>', self.schedule_live_filter)
+        self.filter_start_date_entry.bind('<<DateEntrySelected>>', self.schedule_live_filter)
+        self.filter_end_date_entry.bind('<<DateEntrySelected>>', self.schedule_live_filter)
+
+        # Buttons (Row 0 and Row 1)
+        button_frame = ttk.Frame(filter_frame)
+        button_frame.grid(row=0, column=4, rowspan=2, padx=5, pady=5, sticky='ns')
+
+        ttk.Button(button_frame, text="Apply Filter", command=self.apply_filter).pack(pady=2)
+        ttk.Button(button_frame, text="Export to CSV", command=self.export_to_csv).pack(pady=2)
+        ttk.Button(button_frame, text="Export to Excel", command=self.export_to_xlsx).pack(pady=2)
+        ttk.Button(button_frame, text="Reconcile Statement", command=self.show_reconciliation).pack(pady=2)
+        
+        # --- Search Frame (Row 2) ---
+        row_counter += 1
+        search_frame = ttk.Frame(filter_frame)
+        search_frame.grid(row=row_counter, column=0, columnspan=4, padx=5, pady=5, sticky='we')
+        
+        ttk.Label(search_frame, text="Search Student:").pack(side='left', padx=5)
+        self.history_search_entry = ttk.Entry(search_frame, width=40)
+        self.history_search_entry.pack(side='left', padx=5, fill='x', expand=True)
+        self.history_search_entry.bind('<KeyRelease>', self.schedule_live_filter) # Search as you type
+        ttk.Button(search_frame, text="Search", command=self.apply_filter).pack(side='left', padx=5)
+        ttk.Button(search_frame, text="Clear Search", command=self.clear_history_search).pack(side='left', padx=5)
+
+        # Summary bar
+        self.summary_var = tk.StringVar(value='')
+        summary_label = ttk.Label(parent, textvariable=self.summary_var, font=('Helvetica', 12, 'bold'))
+        summary_label.pack(fill='x', padx=10, pady=2)
+        
+        # Collection in Range Summary
+        self.range_collection_var = tk.StringVar(value='')
+        range_collection_label = ttk.Label(parent, textvariable=self.range_collection_var, font=('Helvetica', 10, 'italic'))
+        range_collection_label.pack(fill='x', padx=10, pady=1)
+
+        # Filter buttons for status
+        filter_frame2 = ttk.Frame(parent)
+        filter_frame2.pack(fill='x', padx=10, pady=2)
+        ttk.Button(filter_frame2, text='All', command=lambda: self.filter_history_tree('All')).pack(side='left', padx=2)
+        ttk.Button(filter_frame2, text='Cleared', command=lambda: self.filter_history_tree('Cleared')).pack(side='left', padx=2)
+        ttk.Button(filter_frame2, text='Pending', command=lambda: self.filter_history_tree('Pending')).pack(side='left', padx=2)
+        self.create_quick_filters(filter_frame2, 'history')
+        self.create_page_controls(filter_frame2, 'history', self.load_history_page)
+        
+        # History Tree
+        history_frame = ttk.LabelFrame(parent, text="Payment History", padding="10")
+        history_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        history_columns = ('ID', 'Student', 'Class', 'Contact', 'Due Date', 'Paid Date', 'Amount', 'Status', 'Receipt', 'Payment Mode')
+        self.history_tree = ttk.Treeview(history_frame, columns=history_columns, show='headings', height=15)
+        
+        for col in history_columns:
+            self.history_tree.heading(col, text=col)
+            self.history_tree.column(col, width=100)
+        
+        # Scrollbar for history
+        history_scrollbar = ttk.Scrollbar(history_frame, orient='vertical', command=self.history_tree.yview)
+        self.history_tree.configure(yscrollcommand=history_scrollbar.set)
+        
+        self.history_tree.pack(side='left', fill='both', expand=True)
+        history_scrollbar.pack(side='right', fill='y')
+        self.history_tree.tag_configure('evenrow', background='lightblue')
+        self.history_tree.tag_configure('oddrow', background='white')
+        self.history_tree.tag_configure('cleared', background='#d4f7d4')
+        self.history_tree.tag_configure('pending', background='#ffd6d6')
+        self.make_sortable('history', self.history_tree, {'ID': 'q', 'Amount': 'd'})
+        
+        # Context menu for history
+        self.history_tree.bind("<Double-1>", self.open_receipt)
+        
+        # Generate Receipt Button
+        gen_receipt_btn = ttk.Button(history_frame, text="Generate Receipt", command=self.generate_receipt_from_history)
+        gen_receipt_btn.pack(side='bottom', pady=5, anchor='e')
+        ttk.Button(history_frame, text="E-mail Receipts", command=self.email_selected_receipts).pack(side='bottom', pady=5, anchor='e')
+        ttk.Button(history_frame, text="Print Batch (2 per A4)", command=self.print_batch_from_history).pack(side='bottom', pady=5, anchor='e')
+        
+        self.load_payment_history()
+        self.load_class_filter()
+    
+    def create_dashboard_tab(self, parent):
+        """Create collections dashboard interface"""
+        # Totals
+        totals_frame = ttk.LabelFrame(parent, text="Collections", padding="10")
+        totals_frame.pack(fill='x', padx=10, pady=5)
+        self.dashboard_vars = {}
+        for column, period in enumerate(("Today", "This Month", "This Year", "All Time")):
+            ttk.Label(totals_frame, text=f"{period}:", font=('Helvetica', 10, 'bold')).grid(row=0, column=column, padx=15, sticky='w')
+            self.dashboard_vars[period] = tk.StringVar(value="₹0.00")
+            ttk.Label(totals_frame, textvariable=self.dashboard_vars[period], font=('Helvetica', 14)).grid(row=1, column=column, padx=15, sticky='w')
+        ttk.Button(totals_frame, text="Refresh", command=self.load_dashboard).grid(row=0, column=4, rowspan=2, padx=15)
+
+        # Monthly trend chart
+        trend_frame = ttk.LabelFrame(parent, text="Monthly Collections (Last 12 Months)", padding="10")
+        trend_frame.pack(fill='x', padx=10, pady=5)
+        self.trend_canvas = tk.Canvas(trend_frame, height=200, bg='white', highlightthickness=0)
+        self.trend_canvas.pack(fill='x', expand=True)
+        self.trend_canvas.bind('<Configure>', lambda e: self.draw_trend_chart())
+        self.trend_data = []
+
+        # Breakdown by class and by payment mode
+        breakdown_frame = ttk.Frame(parent)
+        breakdown_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        breakdown_columns = ('Name', 'This Month', 'This Year', 'Payments (Year)')
+        self.dashboard_class_tree = ttk.Treeview(breakdown_frame, columns=breakdown_columns, show='headings', height=6)
+        self.dashboard_mode_tree = ttk.Treeview(breakdown_frame, columns=breakdown_columns, show='headings', height=6)
+        for tree, title in ((self.dashboard_class_tree, 'Class'), (self.dashboard_mode_tree, 'Payment Mode')):
+            for col in breakdown_columns:
+                tree.heading(col, text=title if col == 'Name' else col)
+                tree.column(col, width=110)
+            tree.pack(side='left', fill='both', expand=True, padx=5)
+
+        self.load_dashboard()
+
+    def load_dashboard(self):
+        """Load dashboard totals and trends from the collection rollup tables"""
+        today = date.today()
+        this_month = today.strftime('%Y-%m')
+        # "This Year" is the current academic year, as everywhere else in the app
+        year_start, year_end = (day[:7] for day in self.academic_year_bounds(self.academic_year_label(today)))
+
+        self.cursor.execute("SELECT COALESCE(SUM(amount_paise), 0) FROM collection_daily WHERE day = ?", (today.isoformat(),))
+        self.dashboard_vars["Today"].set(f"₹{self.cursor.fetchone()[0] / 100:.2f}")
+        self.cursor.execute("SELECT COALESCE(SUM(amount_paise), 0) FROM collection_monthly WHERE month = ?", (this_month,))
+        self.dashboard_vars["This Month"].set(f"₹{self.cursor.fetchone()[0] / 100:.2f}")
+        self.cursor.execute("SELECT COALESCE(SUM(amount_paise), 0) FROM collection_monthly WHERE month BETWEEN ? AND ?", (year_start, year_end))
+        self.dashboard_vars["This Year"].set(f"₹{self.cursor.fetchone()[0] / 100:.2f}")
+        self.cursor.execute("SELECT COALESCE(SUM(amount_paise), 0) FROM collection_monthly")
+        self.dashboard_vars["All Time"].set(f"₹{self.cursor.fetchone()[0] / 100:.2f}")
+
+        self.cursor.execute("""
+            SELECT month, SUM(amount_paise), SUM(payments)
+            FROM collection_monthly
+            GROUP BY month
+            ORDER BY month DESC
+            LIMIT 12
+        """)
+        self.trend_data = [(month, paise / 100, count) for month, paise, count in reversed(self.cursor.fetchall())]
+        self.draw_trend_chart()
+
+        for tree, column in ((self.dashboard_class_tree, 'class'), (self.dashboard_mode_tree, 'payment_mode')):
+            for item in tree.get_children():
+                tree.delete(item)
+            self.cursor.execute(f"""
+                SELECT {column},
+                       SUM(CASE WHEN month = ? THEN amount_paise ELSE 0 END),
+                       SUM(amount_paise),
+                       SUM(payments)
+                FROM collection_monthly
+                WHERE month BETWEEN ? AND ?
+                GROUP BY {column}
+                ORDER BY SUM(amount_paise) DESC
+            """, (this_month, year_start, year_end))
+            for name, month_total, year_total, count in self.cursor.fetchall():
+                tree.insert('', 'end', values=(name, f"₹{month_total / 100:.2f}", f"₹{year_total / 100:.2f}", count))
+
+    def draw_trend_chart(self):
+        """Draw the monthly collection bars on the dashboard canvas"""
+        canvas = self.trend_canvas
+        canvas.delete('all')
+        if not self.trend_data:
+            canvas.create_text(10, 10, anchor='nw', text="No collections recorded yet.")
+            return
+        width = max(canvas.winfo_width(), 400)
+        height = int(canvas['height'])
+        top, bottom = 20, height - 25
+        peak = max(total for _, total, _ in self.trend_data) or 1
+        slot = width / len(self.trend_data)
+        for i, (month, total, count) in enumerate(self.trend_data):
+            x0 = i * slot + slot * 0.2
+            x1 = (i + 1) * slot - slot * 0.2
+            y0 = bottom - (bottom - top) * max(total, 0) / peak
+            canvas.create_rectangle(x0, y0, x1, bottom, fill='#5fa8d3', outline='#1a355e')
+            canvas.create_text((x0 + x1) / 2, y0 - 8, text=f"₹{total:,.0f}", font=('Helvetica', 8))
+            canvas.create_text((x0 + x1) / 2, bottom + 12, text=month, font=('Helvetica', 8))
+
+    def create_settings_tab(self, parent):
+        """Create settings interface"""
+        settings_frame = ttk.LabelFrame(parent, text="Application Settings", padding="20")
+        settings_frame.pack(fill='x', padx=10, pady=5)
+        # School Info (fixed, not editable)
+        ttk.Label(settings_frame, text="School Name:").grid(row=0, column=0, sticky='w', padx=5, pady=5)
+        self.school_name = ttk.Entry(settings_frame, width=40, state='readonly')
+        self.school_name.grid(row=0, column=1, padx=5, pady=5)
+        self.school_name.config(state='normal'); self.school_name.delete(0, tk.END); self.school_name.insert(0, "Little Angels Pre-School"); self.school_name.config(state='readonly')
+        ttk.Label(settings_frame, text="School Address:").grid(row=1, column=0, sticky='w', padx=5, pady=5)
+        self.school_address = ttk.Entry(settings_frame, width=40, state='readonly')
+        self.school_address.grid(row=1, column=1, padx=5, pady=5)
+        self.school_address.config(state='normal'); self.school_address.delete(0, tk.END); self.school_address.insert(0, "Shivane, Pune-23"); self.school_address.config(state='readonly')
+        ttk.Label(settings_frame, text="Contact Number:").grid(row=2, column=0, sticky='w', padx=5, pady=5)
+        self.school_contact = ttk.Entry(settings_frame, width=40, state='readonly')
+        self.school_contact.grid(row=2, column=1, padx=5, pady=5)
+        self.school_contact.config(state='normal'); self.school_contact.delete(0, tk.END); self.school_contact.insert(0, "8657633646 & 9765848509"); self.school_contact.config(state='readonly')
+        # Buttons
+        button_frame = ttk.Frame(settings_frame)
+        button_frame.grid(row=3, column=0, columnspan=2, pady=20)
+        ttk.Button(button_frame, text="Open Receipts Folder", command=self.open_receipts_folder).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Backup Database", command=self.backup_database).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Archive Closed Years", command=self.show_archive_dialog).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Export Changes", command=self.export_changeset).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Import Changes", command=self.import_changeset).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="WhatsApp Web", command=self.open_whatsapp_web).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="E-mail Settings", command=self.show_email_settings).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="E-mail Outbox", command=self.show_email_outbox).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Parent Statements", command=self.export_statements).pack(side='left', padx=5)
+        tools_frame = ttk.Frame(settings_frame)
+        tools_frame.grid(row=4, column=0, columnspan=2)
+        ttk.Button(tools_frame, text="Slow Queries", command=self.show_slow_queries).pack(side='left', padx=5)
+        ttk.Button(tools_frame, text="Database Maintenance", command=self.show_maintenance).pack(side='left', padx=5)
+        ttk.Button(tools_frame, text="Jobs", command=self.show_jobs).pack(side='left', padx=5)
+        ttk.Button(tools_frame, text="Year Rollover", command=self.show_rollover).pack(side='left', padx=5)
+    
+    def add_student(self):
+        """Add a new student to the database"""
+        name = self.student_name.get().strip()
+        class_name = self.student_class.get().strip()
+        contact = self.student_contact.get().strip()
+        mother_name = self.mother_name.get().strip()
+        father_name = self.father_name.get().strip()
+        parent_number = self.parent_number.get().strip()
+        parent_email = self.parent_email.get().strip()
+        
+        if not name or not class_name:
+            messagebox.showerror("Error", "Name and Class are required fields!")
+            return
+        if not self.confirm_not_duplicate((None, name, class_name, contact, mother_name, father_name, parent_number)):
+            return
+        
+        try:
+            self.cursor.execute(
+                "INSERT INTO students (name, class, contact, mother_name, father_name, parent_number, parent_email) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, class_name, contact, mother_name, father_name, parent_number, parent_email)
+            )
+            student_id = self.cursor.lastrowid
+            self.conn.commit()
+            self.changes.publish('students', [student_id])
+            
+            # Clear form
+            self.student_name.delete(0, tk.END)
+            self.student_class.delete(0, tk.END)
+            self.student_contact.delete(0, tk.END)
+            self.mother_name.delete(0, tk.END)
+            self.father_name.delete(0, tk.END)
+            self.parent_number.delete(0, tk.END)
+            self.parent_email.delete(0, tk.END)
+            
+            messagebox.showinfo("Success", f"Student '{name}' added successfully!")
+            
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Error adding student: {e}")
+    
+    def load_students(self, query=""):
+        """Load all students into the treeview, optionally filtered by a query"""
+        # Fetch and display students, sorted by class then name
+        sql_query = "SELECT id, name, class, contact, mother_name, father_name, parent_number, parent_email, created_date FROM students"
+        params = []
+
+        if query:
+            sql_query += " WHERE name LIKE ? OR class LIKE ? OR contact LIKE ? OR mother_name LIKE ? OR father_name LIKE ? OR parent_number LIKE ? OR parent_email LIKE ?"
+            search_term = f"%{query}%"
+            params = [search_term] * 7 # Apply search term to all searchable columns
+
+        sql_query += " ORDER BY class, name"
+
+        self.cursor.execute(sql_query, params)
+        self.show_rows('students', self.cursor.fetchall())
+
+    def search_students(self):
+        """Perform search based on the text in the search entry"""
+        query = self.student_search_entry.get()
+        self.load_students(query)
+
+    def clear_student_search(self):
+        """Clear the search entry and reload all students"""
+        self.student_search_entry.delete(0, tk.END)
+        self.load_students()
+    
+    def load_student_combo(self):
+        # Load students into the combobox for payment form, respecting class filter
+        selected_class = getattr(self, 'payment_class_filter', None)
+        if selected_class and selected_class.get() != 'All':
+            self.cursor.execute("SELECT id, name, class FROM students WHERE class = ? AND left_date IS NULL ORDER BY name", (selected_class.get(),))
+        else:
+            self.cursor.execute("SELECT id, name, class FROM students WHERE left_date IS NULL ORDER BY class, name")
+        students = self.cursor.fetchall()
+        student_list = [f"{s[1]} ({s[2]}) - ID:{s[0]}" for s in students]
+        self.student_combo['values'] = student_list
+        self.autocomplete_student_names = [s[1] for s in students]
+    
+    def record_payment(self):
+        """Record a new payment"""
+        if not self.student_combo.get():
+            messagebox.showerror("Error", "Please select a student!")
+            return
+        try:
+            # Extract student ID from combo selection
+            student_info = self.student_combo.get()
+            student_id = int(student_info.split("ID:")[1])
+            payment_mode = self.payment_mode.get() # Get payment mode
+            reference = self.payment_reference.get().strip()
+            # Validate the amount (Fee Paid Currently) and dates
+            amount, paid_date, due_date = validate_payment(self.amount.get(), self.paid_date_entry.get(),
+                                                           self.due_date_entry.get())
+            # Insert payment as 'Pending' by default
+            status = "Pending"
+            self.cursor.execute(
+                """INSERT INTO payments (student_id, due_date, paid_date, amount, status, payment_mode, reference) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (student_id, due_date, paid_date, amount, status, payment_mode, reference or None)
+            )
+            payment_id = self.cursor.lastrowid
+            # Update this student's statuses in the same transaction, so another counter
+            # recording for the same student cannot interleave between the two writes
+            self.refresh_payment_statuses([student_id])
+            self.conn.commit()
+            self.student_cache.invalidate(student_id)
+            self.changes.publish('payments', [payment_id])
+            # Clear form
+            self.amount.delete(0, tk.END)
+            self.payment_reference.delete(0, tk.END)
+            messagebox.showinfo("Success", "Payment recorded successfully!")
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid input: {e}")
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            messagebox.showerror("Database Error", f"Error recording payment: {e}")
+    
+    def show_batch_entry(self):
+        """Open a grid for entering many payments from a paper register and committing them together"""
+        batch_win = tk.Toplevel(self.root)
+        batch_win.title("Batch Payment Entry")
+        batch_win.geometry("900x600")
+
+        # Entry row: Return in any field adds the row and goes back to the student field
+        entry_frame = ttk.LabelFrame(batch_win, text="Add Row", padding="5")
+        entry_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(entry_frame, text="Student ID / Name:").grid(row=0, column=0, sticky='w', padx=5)
+        student_entry = ttk.Entry(entry_frame, width=25)
+        student_entry.grid(row=0, column=1, padx=5)
+        ttk.Label(entry_frame, text="Amount (₹):").grid(row=0, column=2, sticky='w', padx=5)
+        amount_entry = ttk.Entry(entry_frame, width=10)
+        amount_entry.grid(row=0, column=3, padx=5)
+        ttk.Label(entry_frame, text="Paid Date:").grid(row=0, column=4, sticky='w', padx=5)
+        paid_date_entry = DateEntry(entry_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
+        paid_date_entry.grid(row=0, column=5, padx=5)
+        ttk.Label(entry_frame, text="Mode:").grid(row=0, column=6, sticky='w', padx=5)
+        mode_combo = ttk.Combobox(entry_frame, width=10, state='readonly', values=self.PAYMENT_MODES)
+        mode_combo.set("Cash")
+        mode_combo.grid(row=0, column=7, padx=5)
+        ttk.Label(entry_frame, text="Due Date (all rows):").grid(row=1, column=0, sticky='w', padx=5, pady=5)
+        due_date_entry = DateEntry(entry_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='yyyy-mm-dd')
+        due_date_entry.grid(row=1, column=1, padx=5, pady=5, sticky='w')
+        receipts_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(entry_frame, text="Generate receipts in background", variable=receipts_var).grid(row=1, column=2, columnspan=4, sticky='w', padx=5)
+
+        # Grid of pending rows; double-click a cell to edit it in place
+        grid_frame = ttk.Frame(batch_win)
+        grid_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        columns = ('Student', 'Name', 'Class', 'Amount', 'Paid Date', 'Mode', 'Check')
+        tree = ttk.Treeview(grid_frame, columns=columns, show='headings')
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=110)
+        tree.column('Check', width=200)
+        scrollbar = ttk.Scrollbar(grid_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        tree.tag_configure('invalid', background='#f8d7da')
+
+        # One lookup of all current students so validating hundreds of rows needs no further queries
+        self.cursor.execute("SELECT id, name, class FROM students WHERE left_date IS NULL")
+        students = {row[0]: row for row in self.cursor.fetchall()}
+        by_name = {}
+        for student_id, name, _ in students.values():
+            by_name.setdefault(name.strip().lower(), []).append(student_id)
+
+        def resolve_student(value):
+            value = str(value).strip()
+            if value.isdigit():
+                return int(value) if int(value) in students else None
+            matches = by_name.get(value.lower(), [])
+            return matches[0] if len(matches) == 1 else None
+
+        def check_row(item):
+            """Validate one grid row, fill in name/class and return the insert tuple or None"""
+            student, _, _, amount_text, paid_date, mode, _ = (str(value) for value in tree.item(item, 'values'))
+            problem = ""
+            student_id = resolve_student(student)
+            if student_id is None:
+                problem = "Unknown or ambiguous student"
+                name = class_name = ""
+            else:
+                _, name, class_name = students[student_id]
+            amount = None
+            try:
+                amount = to_paise(amount_text) / 100
+                if amount <= 0:
+                    raise ValueError
+            except ValueError:
+                problem = problem or "Amount must be a positive number of rupees and paise"
+            try:
+                paid_date = parse_iso_date(paid_date)
+            except ValueError:
+                problem = problem or "Paid date must be YYYY-MM-DD"
+            if mode not in self.PAYMENT_MODES:
+                problem = problem or "Unknown payment mode"
+            tree.item(item, values=(student, name, class_name, amount_text, paid_date, mode, problem or "OK"),
+                      tags=('invalid',) if problem else ())
+            if problem:
+                return None
+            return (student_id, paid_date, amount, mode)
+
+        def add_row(event=None):
+            if not student_entry.get().strip():
+                return
+            item = tree.insert('', 'end', values=(student_entry.get().strip(), "", "", amount_entry.get().strip(),
+                                                  paid_date_entry.get(), mode_combo.get(), ""))
+            check_row(item)
+            tree.see(item)
+            student_entry.delete(0, tk.END)
+            amount_entry.delete(0, tk.END)
+            student_entry.focus_set()
+
+        def edit_cell(event):
+            item = tree.identify_row(event.y)
+            column = tree.identify_column(event.x)
+            col_name = columns[int(column[1:]) - 1] if column else None
+            if not item or col_name not in ('Student', 'Amount', 'Paid Date', 'Mode'):
+                return
+            x, y, width, height = tree.bbox(item, column)
+            if col_name == 'Mode':
+                editor = ttk.Combobox(tree, state='readonly', values=self.PAYMENT_MODES)
+            else:
+                editor = ttk.Entry(tree)
+            editor.place(x=x, y=y, width=width, height=height)
+            if col_name == 'Mode':
+                editor.set(tree.set(item, col_name))
+            else:
+                editor.insert(0, tree.set(item, col_name))
+            editor.focus_set()
+
+            def finish(event=None):
+                tree.set(item, col_name, editor.get().strip())
+                editor.destroy()
+                check_row(item)
+
+            editor.bind('<Return>', finish)
+            editor.bind('<FocusOut>', finish)
+            editor.bind('<<ComboboxSelected>>', finish)
+            editor.bind('<Escape>', lambda e: editor.destroy())
+
+        def delete_rows():
+            for item in tree.selection():
+                tree.delete(item)
+            update_count()
+
+        def update_count():
+            rows = tree.get_children()
+            total = sum(float(tree.set(item, 'Amount')) for item in rows if tree.set(item, 'Check') == "OK")
+            count_var.set(f"{len(rows)} rows, ₹{total:.2f}")
+
+        def commit_batch():
+            items = tree.get_children()
+            if not items:
+                messagebox.showerror("Error", "Add at least one payment row.", parent=batch_win)
+                return
+            try:
+                due_date = parse_iso_date(due_date_entry.get())
+            except ValueError:
+                messagebox.showerror("Error", "Due date must be YYYY-MM-DD.", parent=batch_win)
+                return
+            # Validate everything first so the batch goes in whole or not at all
+            rows = [check_row(item) for item in items]
+            update_count()
+            bad = sum(1 for row in rows if row is None)
+            if bad:
+                messagebox.showerror("Error", f"{bad} row(s) need fixing before the batch can be saved.", parent=batch_win)
+                return
+            try:
+                # The ids are collected inside the transaction, so payments recorded meanwhile
+                # at another counter never end up in this batch's receipts
+                payment_ids = []
+                for student_id, paid_date, amount, mode in rows:
+                    self.cursor.execute(
+                        """INSERT INTO payments (student_id, due_date, paid_date, amount, status, payment_mode)
+                           VALUES (?, ?, ?, ?, 'Pending', ?)""",
+                        (student_id, due_date, paid_date, amount, mode)
+                    )
+                    payment_ids.append(self.cursor.lastrowid)
+                self.refresh_payment_statuses({row[0] for row in rows})
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                messagebox.showerror("Database Error", f"Error saving batch: {e}", parent=batch_win)
+                return
+            self.student_cache.invalidate(*{row[0] for row in rows})
+            self.changes.publish('payments')
+            if receipts_var.get():
+                self.queue_receipts(payment_ids)
+            messagebox.showinfo("Success", f"{len(rows)} payments recorded.", parent=batch_win)
+            batch_win.destroy()
+
+        for widget in (student_entry, amount_entry, paid_date_entry, mode_combo):
+            widget.bind('<Return>', lambda e: (add_row(), update_count()))
+        tree.bind('<Double-1>', edit_cell)
+        tree.bind('<Delete>', lambda e: delete_rows())
+
+        button_frame = ttk.Frame(batch_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        count_var = tk.StringVar(value="0 rows, ₹0.00")
+        ttk.Label(button_frame, textvariable=count_var).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Save All", command=commit_batch).pack(side='right', padx=5)
+        ttk.Button(button_frame, text="Delete Row", command=delete_rows).pack(side='right', padx=5)
+        ttk.Button(button_frame, text="Add Row", command=lambda: (add_row(), update_count())).pack(side='right', padx=5)
+        student_entry.focus_set()
+
+    def queue_receipts(self, payment_ids):
+        """Generate receipts for the given payments in the background, adding to a receipts job already queued"""
+        payment_ids = list(payment_ids)
+        if not payment_ids:
+            return
+        active = self.jobs.active('receipts')
+        if active:
+            job_id, params = active
+            known = set(params['payment_ids'])
+            params['payment_ids'].extend(dict.fromkeys(pid for pid in payment_ids if pid not in known))
+            self.jobs.update_params(job_id, params, len(params['payment_ids']))
+        else:
+            self.jobs.enqueue('receipts', 'receipts', {'payment_ids': list(dict.fromkeys(payment_ids))}, len(payment_ids))
+        self.conn.commit()
+        self.schedule_jobs()
+
+    def job_receipts(self, params, checkpoint):
+        """Job step: generate the next few receipts and release any e-mails waiting for them.
+
+        A receipt that cannot be drawn fails the e-mails waiting for it and is counted in the
+        checkpoint, so the rest of the job carries on and the failures show under Jobs.
+        """
+        payment_ids = params['payment_ids']
+        if not isinstance(checkpoint, dict):
+            checkpoint = {'next': checkpoint or 0, 'failed': 0, 'last_error': None}
+        start = end = checkpoint['next']
+        deadline = time.perf_counter() + self.JOB_STEP_MS / 1000
+        for payment_id in payment_ids[start:start + self.RECEIPT_JOB_CHUNK]:
+            if end > start and time.perf_counter() > deadline:
+                break
+            end += 1
+            try:
+                self.cursor.execute(self.RECEIPT_SELECT_SQL + " WHERE p.id = ?", (payment_id,))
+                payment_data = self.cursor.fetchone()
+                if payment_data:
+                    receipt_path = self.create_pdf_receipt(payment_data)
+                    self.cursor.execute("UPDATE payments SET receipt_path = ? WHERE id = ?", (receipt_path, payment_id))
+                    # E-mails waiting for this receipt can now be sent
+                    self.cursor.execute("""
+                        UPDATE email_outbox SET attachment_path = ?, status = 'queued'
+                        WHERE payment_id = ? AND status = 'waiting'
+                    """, (receipt_path, payment_id))
+                    if self.email_sender is not None and self.cursor.rowcount:
+                        self.email_sender.wake()
+                else:
+                    self.cursor.execute("""
+                        UPDATE email_outbox SET status = 'failed', last_error = 'Payment no longer exists'
+                        WHERE payment_id = ? AND status = 'waiting'
+                    """, (payment_id,))
+            except Exception as e:
+                error = f"Receipt for payment {payment_id} could not be generated: {e}"
+                self.cursor.execute("""
+                    UPDATE email_outbox SET status = 'failed', last_error = ?
+                    WHERE payment_id = ? AND status = 'waiting'
+                """, (error, payment_id))
+                checkpoint['failed'] += 1
+                checkpoint['last_error'] = error
+        checkpoint['next'] = end
+        return checkpoint, end, len(payment_ids), end == len(payment_ids)
+
+    def generate_receipt(self):
+        """Generate PDF receipt for the last payment"""
+        if not self.student_combo.get():
+            messagebox.showerror("Error", "Please select a student first!")
+            return
+        
+        try:
+            # Get the last payment for this student
+            student_info = self.student_combo.get()
+            student_id = int(student_info.split("ID:")[1])
+            
+            self.cursor.execute("""
+                SELECT id, student_id, due_date, paid_date, amount, status, receipt_path, created_date, payment_mode
+                FROM payments
+                WHERE student_id = ?
+                ORDER BY created_date DESC
+                LIMIT 1
+            """, (student_id,))
+            
+            payment = self.cursor.fetchone()
+            record = self.student_record(student_id)
+            if not payment or not record:
+                messagebox.showerror("Error", "No payment found for this student!")
+                return
+            # Student fields come from the cache, in RECEIPT_SELECT_SQL order
+            payment_data = payment + tuple(record[1:8])
+            
+            # Generate receipt
+            receipt_path = self.create_pdf_receipt(payment_data)
+            
+            # Update database with receipt path
+            self.cursor.execute(
+                "UPDATE payments SET receipt_path = ? WHERE id = ?",
+                (receipt_path, payment_data[0])
+            )
+            self.conn.commit()
+            self.changes.publish('payments', [payment_data[0]])
+            
+            # Ask if user wants to open the receipt
+            if messagebox.askyesno("Receipt Generated", 
+                                 f"Receipt saved as:\n{receipt_path}\n\nWould you like to open the Receipts folder to send it via WhatsApp?"): # Modified message
+                self.open_receipts_folder() # Open folder instead of file directly
+                # Add prompt to open WhatsApp Web
+                if messagebox.askyesno("Send via WhatsApp", "Would you like to open WhatsApp Web now to send the receipt?"):
+                    self.open_whatsapp_web()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Error generating receipt: {e}")
+    
+    def create_pdf_receipt(self, payment_data):
+        """Create a PDF receipt matching the provided template, now with parent info"""
+        # Unpack payment data
+        # payment_id, student_id, due_date, paid_date, amount, status, receipt_path, created_date, payment_mode, name, class_name, contact, mother_name, father_name, parent_number, parent_email
+        payment_id, student_id, due_date, paid_date, amount, status, receipt_path, created_date, payment_mode, name, class_name, contact, mother_name, father_name, parent_number, parent_email = payment_data
+        # Create filename
+        safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip()
+        base_filename = f"{safe_name}_{class_name}_{paid_date}"
+        filename = f"{base_filename}.pdf"
+        receipt_path = os.path.join("receipts", filename)
+
+        # Check if file exists and generate a unique name if necessary
+        counter = 1
+        while os.path.exists(receipt_path):
+            filename = f"{base_filename}_{counter}.pdf"
+            receipt_path = os.path.join("receipts", filename)
+            counter += 1
+
+        # Create PDF
+        full_width, full_height = A4
+        half_a4_height = full_height / 2
+        c = canvas.Canvas(receipt_path, pagesize=(full_width, half_a4_height))
+        self.draw_receipt(c, payment_data, full_width, half_a4_height)
+        c.save()
+        return receipt_path
+
+    def receipt_totals(self, student_id, amount):
+        """Return (total fee, remaining balance) printed on a student's receipt"""
+        # Try to get total fee and the ledger balance for this student
+        try:
+            record = self.student_record(student_id)
+            total_fee = float(self.total_fee.get()) if hasattr(self, 'total_fee') and self.total_fee.get() else self.TOTAL_FEE
+            remaining = max(record.balance, 0.0) if record else 0.0
+        except Exception:
+            total_fee = amount
+            remaining = 0.0
+        return total_fee, remaining
+
+    def draw_receipt(self, c, payment_data, width, height):
+        """Draw one receipt onto canvas c in a width x height area with its origin at the bottom left"""
+        payment_id, student_id, due_date, paid_date, amount, status, receipt_path, created_date, payment_mode, name, class_name, contact, mother_name, father_name, parent_number, parent_email = payment_data
+        total_fee, remaining = self.receipt_totals(student_id, amount)
+        # Colors and fonts
+        blue = HexColor('#1a355e')
+        light_blue = HexColor('#5fa8d3')
+        # Logo
+        logo_path = os.path.join("templates", "logo.png")
+        if os.path.exists(logo_path):
+            # Adjust logo vertical position
+            c.drawImage(logo_path, 40, height - 80, width=80, height=80, mask='auto') # Adjusted from height - 110
+        # School name and slogan
+        c.setFont("Helvetica-Bold", 18)
+        c.setFillColor(blue)
+        # Adjust school name vertical position
+        c.drawString(140, height - 30, self.school_name.get()) # Adjusted from height - 60
+        c.setFont("Helvetica", 12)
+        c.setFillColor(light_blue)
+        # Adjust slogan vertical position
+        c.drawString(140, height - 50, "CHOOSE SMART, BE SMART") # Adjusted from height - 80
+
+        # Add School Address and Contact
+        c.setFont("Helvetica", 10)
+        c.setFillColor(black)
+        # Adjust address and contact vertical positions
+        c.drawString(140, height - 70, f"Address: {self.school_address.get()}") # Adjusted from height - 100
+        c.drawString(140, height - 85, f"Contact: {self.school_contact.get()}") # Adjusted from height - 115
+
+        # Fee Receipt title
+        c.setFont("Helvetica-Bold", 18)
         c.setFillColor(blue)
         # Adjust title vertical position
         c.drawRightString(width - 40, height - 30, "FEE RECEIPT") # Adjusted from height - 60
@@ -882,186 +3561,1837 @@ class FeeReceiptApp:
         c.setStrokeColor(blue)
         c.setLineWidth(1)
         c.line(40, y, width - 40, y)
+
+    def create_print_batch(self, payment_ids):
+        """Lay out the receipts of the given payments two per A4 sheet in one PDF and return its path.
+
+        Uses the same drawing as the single half-A4 receipts; each sheet is finished as
+        soon as both halves are drawn.
+        """
+        payment_ids = list(payment_ids)
+        rows = []
+        for start in range(0, len(payment_ids), 500):
+            chunk = payment_ids[start:start + 500]
+            self.cursor.execute(self.RECEIPT_SELECT_SQL + f" WHERE p.id IN ({', '.join('?' * len(chunk))})", chunk)
+            rows.extend(self.cursor.fetchall())
+        # Print in paid date order, then by class and name, so a day's receipts come out together
+        rows.sort(key=lambda row: (row[3] or '', row[10] or '', row[9] or '', row[0]))
+
+        full_width, full_height = A4
+        half_a4_height = full_height / 2
+        path = os.path.join("receipts", f"print_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
+        c = canvas.Canvas(path, pagesize=A4)
+        for i, payment_data in enumerate(rows):
+            top = i % 2 == 0
+            if top and i:
+                c.showPage()
+            c.saveState()
+            if top:
+                c.translate(0, half_a4_height)
+            self.draw_receipt(c, payment_data, full_width, half_a4_height)
+            c.restoreState()
+            if top:
+                # Dashed cutting guide between the two receipts
+                c.saveState()
+                c.setDash(4, 4)
+                c.setStrokeColor(HexColor('#999999'))
+                c.line(20, half_a4_height, full_width - 20, half_a4_height)
+                c.restoreState()
         c.save()
-        return receipt_path
+        return path, len(rows)
+
+    def print_batch_from_history(self):
+        """Print the selected history rows (or every row shown) as one 2-up A4 PDF"""
+        items = self.history_tree.selection()
+        if not items:
+            items = self.history_tree.get_children()
+            if not items:
+                messagebox.showerror("Error", "No payments to print.")
+                return
+            if not messagebox.askyesno("Print Batch", f"No rows selected. Print all {len(items)} receipts shown?"):
+                return
+        payment_ids = [int(self.history_tree.item(item, 'values')[0]) for item in items]
+        try:
+            path, count = self.create_print_batch(payment_ids)
+        except Exception as e:
+            messagebox.showerror("Error", f"Error creating print batch: {e}")
+            return
+        sheets = (count + 1) // 2
+        if messagebox.askyesno("Print Batch", f"{count} receipts on {sheets} A4 sheets saved as:\n{path}\n\nOpen it now?"):
+            self.open_file(path)
+
+    def make_sortable(self, view, tree, numeric=None):
+        """Register a Treeview for in-memory sorting (click a heading) and quick filters"""
+        columns = tree['columns']
+        self.tree_views[view] = {'tree': tree, 'columns': columns, 'numeric': numeric or {},
+                                 'store': RowStore(columns, [], numeric), 'sort': None, 'reverse': False, 'filters': {}}
+        for col in columns:
+            tree.heading(col, command=lambda c=col: self.sort_tree(view, c))
+
+    def show_rows(self, view, rows):
+        """Snapshot rows for a view and render them with its current sort and quick filters"""
+        state = self.tree_views[view]
+        state['store'] = RowStore(state['columns'], rows, state['numeric'])
+        self.render_rows(view)
+
+    def render_rows(self, view):
+        """Refill a Treeview from its row store"""
+        state = self.tree_views[view]
+        tree, store = state['tree'], state['store']
+        tree.delete(*tree.get_children())
+        has_status = 'Status' in store.columns
+        for n, i in enumerate(store.select(state['sort'], state['reverse'], state['filters'])):
+            tags = ('evenrow' if n % 2 == 0 else 'oddrow',)
+            if has_status:
+                tags += ('cleared' if store.value('Status', i) == 'Cleared' else 'pending',)
+            tree.insert('', 'end', values=store.row(i), tags=tags)
+
+    def sort_tree(self, view, column):
+        """Sort a view on column; clicking the same heading again reverses the order"""
+        state = self.tree_views[view]
+        if state['sort'] == column:
+            state['reverse'] = not state['reverse']
+        else:
+            state['sort'], state['reverse'] = column, False
+        for col in state['columns']:
+            arrow = (' ▼' if state['reverse'] else ' ▲') if col == column else ''
+            state['tree'].heading(col, text=col + arrow)
+        self.render_rows(view)
+
+    def quick_filter(self, view, column, value):
+        """Show only the loaded rows whose column equals value ('All' clears the filter)"""
+        filters = self.tree_views[view]['filters']
+        if value in (None, '', 'All'):
+            filters.pop(column, None)
+        else:
+            filters[column] = value
+        self.render_rows(view)
+
+    def create_quick_filters(self, parent, view):
+        """Add class and payment mode comboboxes that narrow a view's loaded rows in memory"""
+        for label, column, values in (("Class:", 'Class', self.CLASS_OPTIONS), ("Mode:", 'Payment Mode', self.PAYMENT_MODES)):
+            ttk.Label(parent, text=label).pack(side='left', padx=(10, 2))
+            combo = ttk.Combobox(parent, width=10, state='readonly', values=['All'] + values)
+            combo.set('All')
+            combo.pack(side='left', padx=2)
+            combo.bind('<<ComboboxSelected>>', lambda e, c=column, w=combo: self.quick_filter(view, c, w.get()))
+
+    def page_is_complete(self, view):
+        """True when the loaded page of a paginated view holds every matching row"""
+        state = self.page_state.get(view, {})
+        return not state.get('has_older') and not state.get('has_newer')
+
+    def fetch_payment_page(self, view, select_sql, conditions, params, key, direction=None):
+        """Fetch one page of payments using keyset (seek) pagination on (created_date, id).
+
+        direction is None for the first (newest) page, 'older' for the page after the
+        current one and 'newer' for the page before it. The select must end with
+        p.created_date so the page boundaries can be remembered.
+        """
+        query, query_params, direction, boundary = self.build_page_query(view, select_sql, conditions, params, direction)
+        rows = self.cached_query(key + (direction, boundary), query, query_params)
+        page = self.finish_page(view, rows, direction)
+        if page is None:
+            # The data moved under us (e.g. rows deleted); start again from the newest page
+            return self.fetch_payment_page(view, select_sql, conditions, params, key)
+        return page
+
+    def build_page_query(self, view, select_sql, conditions, params, direction=None):
+        """Build the seek query for a page, returning (query, params, direction, boundary)"""
+        page_size = self.HISTORY_PAGE_SIZE if view == 'history' else self.RECENT_PAGE_SIZE
+        state = self.page_state.setdefault(view, {'first': None, 'last': None, 'page': 1, 'has_older': False, 'has_newer': False})
+        if direction == 'older' and state['last'] is None or direction == 'newer' and state['first'] is None:
+            direction = None
+
+        conditions = list(conditions)
+        params = list(params)
+        order = 'DESC'
+        boundary = None
+        if direction == 'older':
+            boundary = state['last']
+            conditions.append("(p.created_date, p.id) < (?, ?)")
+            params.extend(boundary)
+        elif direction == 'newer':
+            boundary = state['first']
+            conditions.append("(p.created_date, p.id) > (?, ?)")
+            params.extend(boundary)
+            order = 'ASC'
+        query = select_sql
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY p.created_date {order}, p.id {order} LIMIT ?"
+        params.append(page_size + 1)  # One extra row tells us whether another page exists
+        return query, params, direction, boundary
+
+    def finish_page(self, view, rows, direction=None):
+        """Trim fetched rows to a page and update the view's pagination state.
+
+        Returns None if a Newer/Older page came back empty, in which case the caller
+        should reload the first page.
+        """
+        page_size = self.HISTORY_PAGE_SIZE if view == 'history' else self.RECENT_PAGE_SIZE
+        state = self.page_state[view]
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        if direction == 'newer':
+            rows = rows[::-1]
+        if not rows and direction is not None:
+            return None
+
+        if direction is None:
+            state['page'], state['has_newer'], state['has_older'] = 1, False, more
+        elif direction == 'older':
+            state['page'], state['has_newer'], state['has_older'] = state['page'] + 1, True, more
+        else:
+            state['page'] = state['page'] - 1 if more else 1
+            state['has_newer'], state['has_older'] = more, True
+        state['first'] = (rows[0][-1], rows[0][0]) if rows else None
+        state['last'] = (rows[-1][-1], rows[-1][0]) if rows else None
+        self.update_page_controls(view)
+        return rows
+
+    def create_page_controls(self, parent, view, command):
+        """Add Newer/Older page buttons and a page label for a paginated view"""
+        newer_button = ttk.Button(parent, text="◀ Newer", command=lambda: command('newer'), state='disabled')
+        older_button = ttk.Button(parent, text="Older ▶", command=lambda: command('older'), state='disabled')
+        label_var = tk.StringVar(value="Page 1")
+        older_button.pack(side='right', padx=2)
+        ttk.Label(parent, textvariable=label_var).pack(side='right', padx=5)
+        newer_button.pack(side='right', padx=2)
+        self.page_controls[view] = (newer_button, older_button, label_var)
+
+    def update_page_controls(self, view):
+        """Enable or disable the page buttons of a view to match its pagination state"""
+        if view not in self.page_controls:
+            return
+        newer_button, older_button, label_var = self.page_controls[view]
+        state = self.page_state[view]
+        newer_button.config(state='normal' if state['has_newer'] else 'disabled')
+        older_button.config(state='normal' if state['has_older'] else 'disabled')
+        label_var.set(f"Page {state['page']}")
+
+    def load_recent_payments(self):
+        """Load the newest page of recent payments into the treeview"""
+        self.recent_status = 'All'
+        self.load_recent_page()
+
+    def load_recent_page(self, direction=None):
+        """Load a page of recent payments, honouring the current status filter"""
+        conditions, params = [], []
+        if self.recent_status != 'All':
+            conditions.append("p.status = ?")
+            params.append(self.recent_status)
+        payments = self.fetch_payment_page('recent', """
+            SELECT p.id, s.name, s.class, p.due_date, p.paid_date, p.amount, p.status, p.payment_mode, p.created_date
+            FROM payments p
+            JOIN students s ON p.student_id = s.id
+        """, conditions, params, ('recent', params[0] if params else None), direction)
+
+        # The treeview has 8 columns; the trailing created_date is only used for paging
+        self.show_rows('recent', [payment[:8] for payment in payments])
+
+    def load_payment_history(self):
+        """Load complete payment history, starting from the newest page"""
+        self.history_filter = ([], [], self.history_filter_key(), {})
+        self.load_history_page()
+        self.update_summary_bar()
+
+    def load_history_page(self, direction=None):
+        """Load a page of payment history for the current history filter"""
+        # A synchronous load supersedes any live filter still running in the background
+        self.history_generation += 1
+        conditions, params, key, archives = self.history_filter
+        select_sql = self.HISTORY_SELECT_SQL.format(payments=self.payments_source(archives))
+        payments = self.fetch_payment_page('history', select_sql, conditions, params, key, direction)
+        self.show_history_rows(payments)
+
+    def show_history_rows(self, payments):
+        """Replace the history treeview contents with a page of payment rows"""
+        # Show Yes/No for the receipt path, followed by the payment mode
+        self.show_rows('history', [payment[:8] + ("Yes" if payment[8] else "No", payment[9]) for payment in payments])
+
+    def history_filter_key(self, class_name='All', status='All', start_date='', end_date='', search=''):
+        """Normalize history filter values into a cache key; 'All' and blanks mean no filter"""
+        def normalize(value):
+            value = (value or '').strip()
+            return None if value in ('', 'All') else value
+        search = normalize(search)
+        return ('history', normalize(class_name), normalize(status), normalize(start_date),
+                normalize(end_date), search.casefold() if search else None)
+
+    def load_class_filter(self):
+        """Load unique classes for filter dropdown"""
+        self.filter_class['values'] = ['All'] + self.CLASS_OPTIONS
+        self.filter_class.set('All')
+    
+    def build_history_filter(self):
+        """Build (conditions, params, cache key, archives) from the history filter widgets"""
+        conditions = []
+        params = []
+
+        if self.filter_class.get() and self.filter_class.get() != 'All':
+            conditions.append("s.class = ?")
+            params.append(self.filter_class.get())
+
+        if self.filter_status.get() != 'All':
+            conditions.append("p.status = ?")
+            params.append(self.filter_status.get())
+
+        # Add date range filter
+        start_date = end_date = ''
+        if self.filter_use_dates.get():
+            start_date = self.filter_start_date_entry.get().strip()
+            end_date = self.filter_end_date_entry.get().strip()
+
+        # Compared as day numbers, so a date typed without leading zeros still filters correctly
+        start_date = parse_iso_date(start_date) if start_date else ''
+        end_date = parse_iso_date(end_date) if end_date else ''
+        if start_date and end_date:
+            conditions.append("p.paid_day BETWEEN ? AND ?")
+            params.append(date.fromisoformat(start_date).toordinal())
+            params.append(date.fromisoformat(end_date).toordinal())
+        elif start_date:
+            conditions.append("p.paid_day >= ?")
+            params.append(date.fromisoformat(start_date).toordinal())
+        elif end_date:
+            conditions.append("p.paid_day <= ?")
+            params.append(date.fromisoformat(end_date).toordinal())
+            
+        # Add search filter
+        search_query = self.history_search_entry.get().strip()
+        if search_query:
+            conditions.append("(s.name LIKE ? OR s.class LIKE ? OR s.contact LIKE ?)")
+            search_term = f"%{search_query}%"
+            params.extend([search_term] * 3)
+
+        key = self.history_filter_key(self.filter_class.get(), self.filter_status.get(), start_date, end_date, search_query)
+        # Closed academic years are only brought in when the date range reaches back into them
+        archives = self.archives_for_range(start_date, end_date)
+        return conditions, params, key, archives
+
+    def apply_filter(self):
+        """Apply filters (class, status, date range, search) to payment history"""
+        print("[DEBUG] Applying history filter...") # Debug print
+        try:
+            self.history_filter = self.build_history_filter()
+            self.load_history_page()
+            self.update_summary_bar()
+
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error applying filter: {e}")
+
+    def schedule_live_filter(self, event=None):
+        """Debounce filter edits: run the history query once typing pauses"""
+        if self.live_filter_job is not None:
+            self.root.after_cancel(self.live_filter_job)
+        self.live_filter_job = self.root.after(self.LIVE_FILTER_DELAY_MS, self.run_live_filter)
+
+    def run_live_filter(self):
+        """Run the current history filter in the background, superseding any query in flight"""
+        self.live_filter_job = None
+        try:
+            history_filter = self.build_history_filter()
+        except ValueError:
+            return  # A date is still being typed; keep showing the last results
+        self.history_generation += 1
+        self.history_filter = history_filter
+        conditions, params, key, archives = self.history_filter
+        self.page_state.pop('history', None)
+        select_sql = self.HISTORY_SELECT_SQL.format(payments='all_payments' if archives else 'payments')
+        query, query_params, _, _ = self.build_page_query('history', select_sql, conditions, params)
+
+        # Cached results can be shown straight away
+        rows = self.query_cache.get(key + (None, None), self.data_version())
+        if rows is not None:
+            self.show_history_rows(self.finish_page('history', rows))
+            return
+
+        if self.history_worker is None:
+            self.history_worker = BackgroundQuery(self.DB_PATH, self.query_tracer)
+        self.history_worker.submit(self.history_generation, query, query_params, archives)
+        if not self.live_filter_polling:
+            self.live_filter_polling = True
+            self.root.after(self.LIVE_FILTER_POLL_MS, self.poll_live_filter)
+
+    def poll_live_filter(self):
+        """Render the background result for the latest filter state and drop stale ones"""
+        for token, version, rows, error in self.history_worker.results():
+            if token != self.history_generation:
+                continue  # Superseded by a newer filter or a synchronous reload
+            if error is not None:
+                messagebox.showerror("Database Error", f"Error applying filter: {error}")
+            else:
+                self.query_cache.put(self.history_filter[2] + (None, None), version, rows)
+                self.show_history_rows(self.finish_page('history', rows))
+        if self.history_worker.idle():
+            self.live_filter_polling = False
+        else:
+            self.root.after(self.LIVE_FILTER_POLL_MS, self.poll_live_filter)
+    
+    def open_receipt(self, event):
+        """Open receipt file when double-clicked"""
+        selection = self.history_tree.selection()
+        if selection:
+            item = self.history_tree.item(selection[0])
+            payment_id = item['values'][0]
+            
+            # Get receipt path from database
+            self.cursor.execute("SELECT receipt_path FROM payments WHERE id = ?", (payment_id,))
+            result = self.cursor.fetchone()
+            
+            if result and result[0]:
+                self.open_file(result[0])
+            else:
+                messagebox.showinfo("No Receipt", "No receipt found for this payment.")
+    
+    def open_receipts_folder(self):
+        """Open the receipts folder in file explorer"""
+        receipts_path = os.path.abspath("receipts")
+        self.open_file(receipts_path)
+    
+    def open_whatsapp_web(self):
+        """Open WhatsApp Web in browser"""
+        webbrowser.open("https://web.whatsapp.com")
+        messagebox.showinfo("WhatsApp Web", 
+                          "WhatsApp Web opened in your browser.\n" +
+                          "You can manually attach receipt files from the receipts folder.")
+    
+    def backup_database(self):
+        """Create a backup of the database"""
+        try:
+            backup_path = filedialog.asksaveasfilename(
+                defaultextension=".db",
+                filetypes=[("SQLite Database", "*.db"), ("All Files", "*.*")],
+                title="Save Database Backup"
+            )
+            
+            if backup_path:
+                self.start_job('backup', 'backup', {'path': backup_path}, 1)
+        except Exception as e:
+            messagebox.showerror("Error", f"Error creating backup: {e}")
+
+    def job_backup(self, params, checkpoint):
+        """Job step: start copying the database in the background, then report the pages copied until it is done.
+
+        The copy uses SQLite's online backup, so writes by other copies can't tear it. A backup
+        interrupted by a restart starts again from the first page.
+        """
+        if self.backup is not None and self.backup.path != params['path']:
+            # Left behind by a backup job that was cancelled
+            self.backup.cancel()
+            self.backup = None
+        if self.backup is None:
+            self.backup = DatabaseBackup(self.DB_PATH, params['path'])
+        try:
+            error = self.backup.finished.get_nowait()
+        except queue.Empty:
+            copied, total = self.backup.progress
+            return None, copied, total or None, False
+        copied, total = self.backup.progress
+        self.backup = None
+        if error is not None:
+            raise sqlite3.OperationalError(error)
+        return None, total, total, True
     
-    def load_recent_payments(self):
-        """Load recent payments into the treeview"""
-        # Clear existing items
-        for item in self.payment_tree.get_children():
-            self.payment_tree.delete(item)
-        
-        # Fetch recent payments
-        self.cursor.execute("""
-            SELECT p.id, s.name, s.class, p.due_date, p.paid_date, p.amount, p.status, p.payment_mode
-            FROM payments p
-            JOIN students s ON p.student_id = s.id
-            ORDER BY p.created_date DESC
-            LIMIT 20
-        """)
-        
-        payments = self.cursor.fetchall()
-        for i, payment in enumerate(payments):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            # Note: filter_payments_tree function also adds status tags, ensure compatibility
-            status_tag = 'cleared' if payment[6] == 'Cleared' else 'pending' # Assuming status is at index 6
-            # We are adding payment_mode to the end of the payment tuple, so it is at index 7.
-            # The treeview columns now expect 8 values, so we should pass all of them.
-            self.payment_tree.insert('', 'end', values=payment, tags=(tag, status_tag))
-        self.payment_tree.tag_configure('cleared', background='#d4f7d4')
-        self.payment_tree.tag_configure('pending', background='#ffd6d6')
+    def academic_year_label(self, day):
+        """Return the academic year (e.g. '2024-25') a date falls in"""
+        start_year = day.year if day.month >= self.ACADEMIC_YEAR_START_MONTH else day.year - 1
+        return f"{start_year}-{(start_year + 1) % 100:02d}"
 
-    def load_payment_history(self):
-        """Load complete payment history"""
-        # Clear existing items
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
-        
-        # Fetch all payments
-        self.cursor.execute("""
-            SELECT p.id, s.name, s.class, s.contact, p.due_date, p.paid_date, 
-                   p.amount, p.status, p.receipt_path, p.payment_mode
-            FROM payments p
-            JOIN students s ON p.student_id = s.id
-            ORDER BY p.created_date DESC
+    def academic_year_bounds(self, label):
+        """Return the first and last ISO dates of an academic year label"""
+        start_year = int(label[:4])
+        start = date(start_year, self.ACADEMIC_YEAR_START_MONTH, 1)
+        next_start = date(start_year + 1, self.ACADEMIC_YEAR_START_MONTH, 1)
+        return start.isoformat(), date.fromordinal(next_start.toordinal() - 1).isoformat()
+
+    def year_start_day(self):
+        """Return the paid_day (date ordinal) the current academic year starts on"""
+        start, _ = self.academic_year_bounds(self.academic_year_label(date.today()))
+        return date.fromisoformat(start).toordinal()
+
+    def archive_path(self, label):
+        return os.path.join(self.ARCHIVE_DIR, f"payments_{label}.db")
+
+    def archive_alias(self, label):
+        return "archive_" + label.replace('-', '_')
+
+    def list_archived_years(self):
+        """Return the academic years that have been moved to archive databases, oldest first"""
+        if not os.path.isdir(self.ARCHIVE_DIR):
+            return []
+        return sorted(name[len("payments_"):-len(".db")] for name in os.listdir(self.ARCHIVE_DIR)
+                      if name.startswith("payments_") and name.endswith(".db"))
+
+    def archives_for_range(self, start_date, end_date):
+        """Return {alias: path} of the archived years overlapping a paid-date range.
+
+        Without a date range only the current (hot) database is searched.
+        """
+        if not start_date and not end_date:
+            return {}
+        archives = {}
+        for label in self.list_archived_years():
+            year_start, year_end = self.academic_year_bounds(label)
+            if (not end_date or year_start <= end_date) and (not start_date or year_end >= start_date):
+                archives[self.archive_alias(label)] = self.archive_path(label)
+        return archives
+
+    def payments_source(self, archives):
+        """Return the table to read payments from, attaching archives and the union view if needed"""
+        if not archives:
+            return 'payments'
+        if archives.keys() - self.attached_archives.keys():
+            self.attached_archives.update(archives)
+            attach_archives(self.conn, self.attached_archives)
+        return 'all_payments'
+
+    def close_academic_year(self, label):
+        """Move a finished academic year's payments from the hot database into its archive file.
+
+        Rows are copied first and only then deleted from the hot database, each step in its
+        own transaction, so an interrupted run can simply be repeated. Collection rollups and
+        the ledger are left untouched because archived payments are still paid, so balances,
+        statuses and the summary bar are the same before and after.
+        """
+        start, end = self.academic_year_bounds(label)
+        if end >= date.today().isoformat():
+            raise ValueError(f"Academic year {label} has not ended yet.")
+        os.makedirs(self.ARCHIVE_DIR, exist_ok=True)
+        alias = self.archive_alias(label)
+        if self.conn.in_transaction:
+            self.conn.commit()
+        attached = {row[1] for row in self.cursor.execute("PRAGMA database_list").fetchall()}
+        if alias not in attached:
+            self.cursor.execute(f"ATTACH DATABASE ? AS {alias}", (self.archive_path(label),))
+
+        # Archive table mirrors the hot payments table, including columns added since it was created
+        self.cursor.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'payments'")
+        create_sql = re.sub(r'^CREATE TABLE\s+"?payments"?', f"CREATE TABLE IF NOT EXISTS {alias}.payments", self.cursor.fetchone()[0])
+        self.cursor.execute(create_sql)
+        self.cursor.execute(f"PRAGMA {alias}.table_xinfo(payments)")
+        archive_columns = {row[1] for row in self.cursor.fetchall()}
+        self.cursor.execute("PRAGMA main.table_info(payments)")
+        main_columns = self.cursor.fetchall()
+        for _, column, column_type, *_ in main_columns:
+            if column not in archive_columns:
+                self.cursor.execute(f"ALTER TABLE {alias}.payments ADD COLUMN {column} {column_type}")
+        for column, expression in PAYMENT_INTEGER_COLUMNS.items():
+            if column not in archive_columns:
+                self.cursor.execute(f"ALTER TABLE {alias}.payments ADD COLUMN {column} INTEGER GENERATED ALWAYS AS ({expression}) VIRTUAL")
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_payments_created ON payments (created_date, id)")
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_payments_student ON payments (student_id)")
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_payments_paid_day ON payments (paid_day)")
+        self.conn.commit()
+
+        columns = ", ".join(row[1] for row in main_columns)
+        days = (date.fromisoformat(start).toordinal(), date.fromisoformat(end).toordinal())
+        self.cursor.execute(f"""
+            INSERT OR IGNORE INTO {alias}.payments ({columns})
+            SELECT {columns} FROM main.payments WHERE paid_day BETWEEN ? AND ?
+        """, days)
+        self.conn.commit()
+
+        try:
+            self.cursor.execute("UPDATE app_meta SET value = 1 WHERE key = 'archiving'")
+            self.cursor.execute(f"""
+                DELETE FROM main.payments
+                WHERE paid_day BETWEEN ? AND ? AND id IN (SELECT id FROM {alias}.payments)
+            """, days)
+            moved = self.cursor.rowcount
+            self.cursor.execute("UPDATE app_meta SET value = 0 WHERE key = 'archiving'")
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+        if alias in self.attached_archives:
+            attach_archives(self.conn, self.attached_archives)
+        else:
+            self.cursor.execute(f"DETACH DATABASE {alias}")
+        self.query_cache.clear()
+        return moved
+
+    def show_archive_dialog(self):
+        """Let the user move finished academic years out of the hot database"""
+        archive_win = tk.Toplevel(self.root)
+        archive_win.title("Archive Closed Academic Years")
+        archive_win.geometry("420x360")
+
+        ttk.Label(archive_win, text="Finished academic years still in the main database:").pack(anchor='w', padx=10, pady=5)
+        year_list = tk.Listbox(archive_win, height=8)
+        year_list.pack(fill='both', expand=True, padx=10)
+        current_year = self.academic_year_label(date.today())
+        counts = {}
+        self.cursor.execute("SELECT substr(paid_date, 1, 7), COUNT(*) FROM payments WHERE paid_date IS NOT NULL GROUP BY 1")
+        for month, count in self.cursor.fetchall():
+            try:
+                label = self.academic_year_label(datetime.strptime(month, "%Y-%m").date())
+            except ValueError:
+                continue
+            if label < current_year:
+                counts[label] = counts.get(label, 0) + count
+        labels = sorted(counts)
+        for label in labels:
+            year_list.insert(tk.END, f"{label}  ({counts[label]} payments)")
+
+        archived = self.list_archived_years()
+        ttk.Label(archive_win, text="Archived years: " + (", ".join(archived) if archived else "none")).pack(anchor='w', padx=10, pady=5)
+
+        def archive_selected():
+            selection = year_list.curselection()
+            if not selection:
+                messagebox.showerror("Error", "Please select an academic year to archive.", parent=archive_win)
+                return
+            label = labels[selection[0]]
+            if not messagebox.askyesno("Confirm Archive",
+                                       f"Move all {label} payments into {self.archive_path(label)}?\n\n"
+                                       "They will still appear in history when the date range covers that year. "
+                                       "Balances are not affected: what each student owes stays the same.",
+                                       parent=archive_win):
+                return
+            try:
+                moved = self.close_academic_year(label)
+                messagebox.showinfo("Archived", f"Moved {moved} payments to the {label} archive.", parent=archive_win)
+                archive_win.destroy()
+                self.changes.publish('payments')
+            except (ValueError, sqlite3.Error, OSError) as e:
+                messagebox.showerror("Error", f"Could not archive {label}: {e}", parent=archive_win)
+
+        ttk.Button(archive_win, text="Archive Selected Year", command=archive_selected).pack(pady=10)
+
+    def init_rollover(self):
+        """Create the log of year rollovers and the per-student snapshots used to undo them"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollover_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                to_year TEXT NOT NULL,
+                total_fee REAL NOT NULL,
+                promoted INTEGER NOT NULL,
+                retired INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'applied' CHECK (status IN ('applied', 'undone')),
+                created_at TEXT NOT NULL,
+                undone_at TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollover_snapshots (
+                rollover_id INTEGER NOT NULL,
+                student_id INTEGER NOT NULL,
+                class TEXT,
+                left_date DATE,
+                charged INTEGER NOT NULL,
+                PRIMARY KEY (rollover_id, student_id)
+            )
+        ''')
+
+    def promotion_case(self):
+        """Return a CASE expression mapping each class to the next one in CLASS_OPTIONS, and its parameters"""
+        steps = list(zip(self.CLASS_OPTIONS, self.CLASS_OPTIONS[1:]))
+        return "CASE class " + " ".join("WHEN ? THEN ?" for _ in steps) + " END", [c for step in steps for c in step]
+
+    def rollover_candidates(self, to_year):
+        """Return the SQL condition (and parameters) for students taking part in a rollover into to_year.
+
+        Current students in a known class are rolled over; students admitted on or after the start
+        of the new year are already enrolled for it and are left alone.
+        """
+        year_start, _ = self.academic_year_bounds(to_year)
+        placeholders = ", ".join("?" * len(self.CLASS_OPTIONS))
+        return (f"left_date IS NULL AND class IN ({placeholders}) AND COALESCE(date(created_date), '') < ?",
+                list(self.CLASS_OPTIONS) + [year_start])
+
+    def preview_rollover(self, to_year):
+        """Dry run: return (id, name, class, new class or None for leavers) for every student a rollover would change"""
+        promote, promote_params = self.promotion_case()
+        condition, params = self.rollover_candidates(to_year)
+        self.cursor.execute(f"""
+            SELECT id, name, class, {promote} FROM students
+            WHERE {condition}
+            ORDER BY class, name
+        """, promote_params + params)
+        return self.cursor.fetchall()
+
+    def apply_rollover(self, to_year):
+        """Promote every current student one class, retire the last class and charge the new year's fee.
+
+        Runs as a handful of set-based statements in one transaction. The students' classes and
+        leaving dates are snapshotted first so undo_rollover can put them back. Balances come
+        from the ledger, so the new fee is owed at once, on top of any arrears, and payment
+        statuses are re-rated in the same transaction.
         """
+        year_start, _ = self.academic_year_bounds(to_year)
+        last_class = self.CLASS_OPTIONS[-1]
+        promote, promote_params = self.promotion_case()
+        condition, params = self.rollover_candidates(to_year)
+        if self.conn.in_transaction:
+            self.conn.commit()
+        try:
+            self.cursor.execute("SELECT 1 FROM rollover_runs WHERE to_year = ? AND status = 'applied'", (to_year,))
+            if self.cursor.fetchone():
+                raise ValueError(f"Students have already been rolled over into {to_year}.")
+            self.cursor.execute(
+                "INSERT INTO rollover_runs (to_year, total_fee, promoted, retired, created_at) VALUES (?, ?, 0, 0, ?)",
+                (to_year, self.TOTAL_FEE, datetime.now().isoformat(timespec='seconds'))
+            )
+            rollover_id = self.cursor.lastrowid
+            self.cursor.execute(f"""
+                INSERT INTO rollover_snapshots (rollover_id, student_id, class, left_date, charged)
+                SELECT ?, id, class, left_date, class IS NOT ? FROM students WHERE {condition}
+            """, [rollover_id, last_class] + params)
+            snapshot = "id IN (SELECT student_id FROM rollover_snapshots WHERE rollover_id = ?)"
+
+            self.cursor.execute(f"UPDATE students SET left_date = ? WHERE class = ? AND {snapshot}",
+                                (year_start, last_class, rollover_id))
+            retired = self.cursor.rowcount
+            # One statement, so a promoted student is never promoted again by a later WHEN
+            self.cursor.execute(f"UPDATE students SET class = {promote} WHERE left_date IS NULL AND {snapshot}",
+                                promote_params + [rollover_id])
+            promoted = self.cursor.rowcount
+            self.cursor.execute("""
+                INSERT INTO ledger (student_id, entry_type, amount_paise, entry_date, note)
+                SELECT student_id, 'adjustment', ?, ?, 'Annual fee'
+                FROM rollover_snapshots WHERE rollover_id = ? AND charged
+            """, (self.TOTAL_FEE * 100, year_start, rollover_id))
+            self.cursor.execute("SELECT student_id FROM rollover_snapshots WHERE rollover_id = ? AND charged", (rollover_id,))
+            self.refresh_payment_statuses(row[0] for row in self.cursor.fetchall())
+            self.cursor.execute("UPDATE rollover_runs SET promoted = ?, retired = ? WHERE id = ?",
+                                (promoted, retired, rollover_id))
+            self.conn.commit()
+        except (ValueError, sqlite3.Error):
+            self.conn.rollback()
+            raise
+        self.query_cache.clear()
+        self.student_cache.clear()
+        return promoted, retired
+
+    def undo_rollover(self, rollover_id):
+        """Put classes and leaving dates back from the snapshot of the latest rollover and reverse its fees"""
+        if self.conn.in_transaction:
+            self.conn.commit()
+        try:
+            self.cursor.execute("SELECT MAX(id) FROM rollover_runs WHERE status = 'applied'")
+            if self.cursor.fetchone()[0] != rollover_id:
+                raise ValueError("Only the most recent rollover can be undone.")
+            self.cursor.execute("SELECT to_year, total_fee FROM rollover_runs WHERE id = ?", (rollover_id,))
+            to_year, total_fee = self.cursor.fetchone()
+            self.cursor.execute("""
+                UPDATE students
+                SET class = (SELECT r.class FROM rollover_snapshots r WHERE r.rollover_id = :run AND r.student_id = students.id),
+                    left_date = (SELECT r.left_date FROM rollover_snapshots r WHERE r.rollover_id = :run AND r.student_id = students.id)
+                WHERE id IN (SELECT student_id FROM rollover_snapshots WHERE rollover_id = :run)
+            """, {'run': rollover_id})
+            restored = self.cursor.rowcount
+            # The ledger is append-only, so the fee is reversed rather than removed
+            self.cursor.execute("""
+                INSERT INTO ledger (student_id, entry_type, amount_paise, entry_date, note)
+                SELECT student_id, 'adjustment', ?, ?, 'Annual fee'
+                FROM rollover_snapshots WHERE rollover_id = ? AND charged
+            """, (-round(total_fee * 100), self.academic_year_bounds(to_year)[0], rollover_id))
+            self.cursor.execute("SELECT student_id FROM rollover_snapshots WHERE rollover_id = ? AND charged", (rollover_id,))
+            self.refresh_payment_statuses(row[0] for row in self.cursor.fetchall())
+            self.cursor.execute("UPDATE rollover_runs SET status = 'undone', undone_at = ? WHERE id = ?",
+                                (datetime.now().isoformat(timespec='seconds'), rollover_id))
+            self.conn.commit()
+        except (ValueError, sqlite3.Error):
+            self.conn.rollback()
+            raise
+        self.query_cache.clear()
+        self.student_cache.clear()
+        return restored
+
+    def show_rollover(self):
+        """Preview and apply the year-end class promotion, or undo the last one"""
+        rollover_win = tk.Toplevel(self.root)
+        rollover_win.title("Academic Year Rollover")
+        rollover_win.geometry("700x550")
+
+        top_frame = ttk.Frame(rollover_win, padding="10")
+        top_frame.pack(fill='x')
+        ttk.Label(top_frame, text="Roll over into:").pack(side='left')
+        today = date.today()
+        current_year = self.academic_year_label(today)
+        year_var = tk.StringVar(value=self.academic_year_label(date.fromordinal(today.toordinal() + 183)))
+        next_start = int(current_year[:4]) + 1
+        year_combo = ttk.Combobox(top_frame, textvariable=year_var, state='readonly', width=10,
+                                  values=[current_year, f"{next_start}-{(next_start + 1) % 100:02d}"])
+        year_combo.pack(side='left', padx=5)
+        summary = ttk.Label(top_frame, text="")
+        summary.pack(side='left', padx=10)
+
+        columns = ("Name", "Class", "New Class")
+        preview_tree = ttk.Treeview(rollover_win, columns=columns, show='headings')
+        for col in columns:
+            preview_tree.heading(col, text=col)
+            preview_tree.column(col, width=200)
+        preview_tree.pack(fill='both', expand=True, padx=10)
+
+        archive_var = tk.BooleanVar(value=True)
+        archive_check = ttk.Checkbutton(rollover_win, variable=archive_var)
+        archive_check.pack(anchor='w', padx=10, pady=5)
+        previous = {}
+
+        def refresh(event=None):
+            to_year = year_var.get()
+            preview_tree.delete(*preview_tree.get_children())
+            rows = self.preview_rollover(to_year)
+            for student_id, name, class_name, new_class in rows:
+                preview_tree.insert('', 'end', values=(name, class_name, new_class or "Leaves"))
+            leaving = sum(1 for row in rows if row[3] is None)
+            summary.config(text=f"{len(rows) - leaving} promoted, {leaving} leaving, "
+                                f"₹{self.TOTAL_FEE:,.0f} charged to each promoted student")
+
+            # Archiving the year being closed is optional housekeeping; balances come from the ledger
+            start_year = int(to_year[:4]) - 1
+            previous['label'] = f"{start_year}-{(start_year + 1) % 100:02d}"
+            prev_start, prev_end = self.academic_year_bounds(previous['label'])
+            self.cursor.execute("SELECT COUNT(*) FROM payments WHERE paid_day BETWEEN ? AND ?",
+                                (date.fromisoformat(prev_start).toordinal(), date.fromisoformat(prev_end).toordinal()))
+            previous['payments'] = self.cursor.fetchone()[0]
+            previous['ended'] = prev_end < today.isoformat()
+            if not previous['payments']:
+                archive_check.config(text=f"No {previous['label']} payments left in the main database", state='disabled')
+            elif previous['ended']:
+                archive_check.config(text=f"Archive the {previous['payments']} {previous['label']} payments first "
+                                          "to keep the main database small", state='normal')
+            else:
+                archive_check.config(text=f"{previous['label']} has not ended yet, so its payments cannot be "
+                                          "archived", state='disabled')
+
+        def apply():
+            to_year = year_var.get()
+            archive = previous['payments'] and previous['ended'] and archive_var.get()
+            if not messagebox.askyesno("Confirm Rollover",
+                                       f"Promote all current students into {to_year}?" +
+                                       (f"\n\n{previous['label']} payments will be archived first." if archive else ""),
+                                       parent=rollover_win):
+                return
+            try:
+                if archive:
+                    self.close_academic_year(previous['label'])
+                promoted, retired = self.apply_rollover(to_year)
+            except (ValueError, sqlite3.Error, OSError) as e:
+                messagebox.showerror("Error", f"Could not roll over into {to_year}: {e}", parent=rollover_win)
+                return
+            messagebox.showinfo("Rollover Complete", f"Promoted {promoted} students; {retired} have left.",
+                                parent=rollover_win)
+            reload()
+
+        def undo():
+            self.cursor.execute("SELECT id, to_year FROM rollover_runs WHERE status = 'applied' ORDER BY id DESC LIMIT 1")
+            last = self.cursor.fetchone()
+            if not last:
+                messagebox.showinfo("Undo Rollover", "There is no rollover to undo.", parent=rollover_win)
+                return
+            if not messagebox.askyesno("Confirm Undo",
+                                       f"Put every student back in their class from before the {last[1]} rollover "
+                                       "and reverse its fees?\n\nArchived payments stay archived.",
+                                       parent=rollover_win):
+                return
+            try:
+                restored = self.undo_rollover(last[0])
+            except (ValueError, sqlite3.Error) as e:
+                messagebox.showerror("Error", f"Could not undo the rollover: {e}", parent=rollover_win)
+                return
+            messagebox.showinfo("Rollover Undone", f"Restored {restored} students.", parent=rollover_win)
+            reload()
+
+        def reload():
+            self.changes.publish('students')
+            self.changes.publish('payments')
+            refresh()
+
+        year_combo.bind('<<ComboboxSelected>>', refresh)
+        button_frame = ttk.Frame(rollover_win, padding="10")
+        button_frame.pack(fill='x')
+        ttk.Button(button_frame, text="Apply Rollover", command=apply).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Undo Last Rollover", command=undo).pack(side='left', padx=5)
+        refresh()
+
+    def refresh_payment_statuses(self, student_ids):
+        """Set Cleared/Pending on all payments of the given students from their ledger balance, in one statement"""
+        student_ids = list(student_ids)
+        if not student_ids:
+            return
+        placeholders = ", ".join("?" * len(student_ids))
+        status = """CASE WHEN (SELECT SUM(l.amount_paise) FROM ledger l WHERE l.student_id = payments.student_id) <= 0
+                         THEN 'Cleared' ELSE 'Pending' END"""
+        self.cursor.execute(f"""
+            UPDATE payments
+            SET status = {status}
+            WHERE student_id IN ({placeholders}) AND status IS NOT {status}
+        """, student_ids)
+
+    def export_changeset(self):
+        """Write students, payments and deletions changed since the last export to a changeset file"""
+        self.cursor.execute("SELECT key, value FROM app_meta WHERE key IN ('branch_id', 'sync_export_hwm')")
+        meta = dict(self.cursor.fetchall())
+        branch_id, since = meta['branch_id'], meta.get('sync_export_hwm') or ''
+        path = filedialog.asksaveasfilename(
+            defaultextension=".gz",
+            initialfile=f"changeset_{branch_id}_{datetime.now().strftime('%Y%m%d_%H%M')}.jsonl.gz",
+            filetypes=[("Changeset Files", "*.jsonl.gz"), ("All Files", "*.*")],
+            title="Export Changes"
         )
-        
-        payments = self.cursor.fetchall()
-        for i, payment in enumerate(payments):
-            row_tag = 'evenrow' if i % 2 == 0 else 'oddrow' # For alternating row colors
-            receipt_status = "Yes" if payment[8] else "No"
-            display_payment = payment[:8] + (receipt_status, payment[9],) # Append receipt status and payment mode
-            status_tag = 'cleared' if payment[7] == 'Cleared' else 'pending' # Corrected index for status
-            self.history_tree.insert('', 'end', values=display_payment, tags=(row_tag, status_tag)) # Pass both tags
-        self.history_tree.tag_configure('cleared', background='#d4f7d4')
-        self.history_tree.tag_configure('pending', background='#ffd6d6')
-        self.history_tree.tag_configure('evenrow', background='lightblue') # Ensure these are configured
-        self.history_tree.tag_configure('oddrow', background='white')
-        self.update_summary_bar()
+        if not path:
+            return
+        try:
+            counts = self.write_changeset(path, branch_id, since)
+            messagebox.showinfo("Export Complete",
+                                f"Exported {counts['students']} students, {counts['payments']} payments and "
+                                f"{counts['tombstones']} deletions to:\n{path}")
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Export Error", f"Failed to export changes: {e}")
 
-    def load_class_filter(self):
-        """Load unique classes for filter dropdown"""
-        self.filter_class['values'] = ['All'] + self.CLASS_OPTIONS
-        self.filter_class.set('All')
-    
-    def apply_filter(self):
-        """Apply filters (class, status, date range, search) to payment history"""
-        print("[DEBUG] Applying history filter...") # Debug print
-        # Clear existing items
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
-
-        # Build query based on filters
-        query = """
-            SELECT p.id, s.name, s.class, s.contact, p.due_date, p.paid_date,
-                   p.amount, p.status, p.receipt_path, p.payment_mode
+    def write_changeset(self, path, branch_id, since):
+        """Stream changes with since < updated_at <= now to a gzipped JSON-lines file and advance the high-water mark"""
+        import gzip
+        if self.conn.in_transaction:
+            self.conn.commit()
+        counts = {'students': 0, 'payments': 0, 'tombstones': 0}
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN")  # One read snapshot for the whole changeset
+        try:
+            cursor.execute("SELECT strftime('%Y-%m-%dT%H:%M:%f', 'now')")
+            until = cursor.fetchone()[0]
+            with gzip.open(path, 'wt', encoding='utf-8') as changeset:
+                changeset.write(json.dumps({'format': 'fee-changeset', 'version': 1, 'branch': branch_id,
+                                            'since': since, 'until': until}) + "\n")
+                cursor.execute(f"""
+                    SELECT {', '.join(self.STUDENT_SYNC_COLUMNS)} FROM students
+                    WHERE updated_at > ? AND updated_at <= ?
+                """, (since, until))
+                for row in cursor:
+                    changeset.write(json.dumps({'table': 'students', 'row': dict(zip(self.STUDENT_SYNC_COLUMNS, row))}) + "\n")
+                    counts['students'] += 1
+                cursor.execute(f"""
+                    SELECT {', '.join('p.' + c for c in self.PAYMENT_SYNC_COLUMNS)}, s.global_id
+                    FROM payments p
+                    JOIN students s ON s.id = p.student_id
+                    WHERE p.updated_at > ? AND p.updated_at <= ?
+                """, (since, until))
+                for row in cursor:
+                    record = dict(zip(self.PAYMENT_SYNC_COLUMNS, row[:-1]))
+                    record['student_global_id'] = row[-1]
+                    changeset.write(json.dumps({'table': 'payments', 'row': record}) + "\n")
+                    counts['payments'] += 1
+                cursor.execute("""
+                    SELECT global_id, table_name, deleted_at FROM sync_tombstones
+                    WHERE deleted_at > ? AND deleted_at <= ?
+                """, (since, until))
+                for global_id, table_name, deleted_at in cursor:
+                    changeset.write(json.dumps({'table': 'tombstones', 'row': {
+                        'global_id': global_id, 'table_name': table_name, 'deleted_at': deleted_at}}) + "\n")
+                    counts['tombstones'] += 1
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('sync_export_hwm', ?)", (until,))
+        self.conn.commit()
+        return counts
+
+    def import_changeset(self):
+        """Merge a changeset file from another branch"""
+        path = filedialog.askopenfilename(
+            title="Import Changes",
+            filetypes=[("Changeset Files", "*.jsonl.gz"), ("All Files", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            counts = self.apply_changeset(path)
+        except ValueError as e:
+            messagebox.showerror("Import Error", str(e))
+            return
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Import Error", f"Failed to import changes: {e}")
+            return
+        self.query_cache.clear()
+        self.student_cache.clear()
+        self.changes.publish('students')
+        self.changes.publish('payments')
+        messagebox.showinfo("Import Complete",
+                            f"Processed {counts['students']} students, {counts['payments']} payments and "
+                            f"{counts['tombstones']} deletions.")
+
+    def apply_changeset(self, path):
+        """Apply a changeset in one transaction; rows are matched on global_id and the newer updated_at wins.
+
+        Applying the same file twice (or overlapping files) leaves the database unchanged.
+        """
+        import gzip
+        with gzip.open(path, 'rt', encoding='utf-8') as changeset:
+            header = json.loads(changeset.readline() or 'null')
+            if not header or header.get('format') != 'fee-changeset':
+                raise ValueError("This file is not a fee changeset.")
+            self.cursor.execute("SELECT value FROM app_meta WHERE key = 'branch_id'")
+            if header['branch'] == self.cursor.fetchone()[0]:
+                raise ValueError("This changeset was exported from this branch.")
+            batches = {'students': [], 'payments': [], 'tombstones': []}
+            for line in changeset:
+                record = json.loads(line)
+                batches[record['table']].append(record['row'])
+
+        student_columns = ', '.join(self.STUDENT_SYNC_COLUMNS)
+        student_updates = ', '.join(f"{c} = excluded.{c}" for c in self.STUDENT_SYNC_COLUMNS[1:])
+        payment_columns = ', '.join(self.PAYMENT_SYNC_COLUMNS)
+        payment_updates = ', '.join(f"{c} = excluded.{c}" for c in self.PAYMENT_SYNC_COLUMNS[1:])
+        try:
+            # Rows deleted here after the incoming version was written stay deleted
+            not_deleted = "NOT EXISTS (SELECT 1 FROM sync_tombstones t WHERE t.global_id = ? AND t.deleted_at >= ?)"
+            self.cursor.executemany(f"""
+                INSERT INTO students ({student_columns})
+                SELECT {', '.join('?' * len(self.STUDENT_SYNC_COLUMNS))}
+                WHERE {not_deleted}
+                ON CONFLICT (global_id) DO UPDATE SET {student_updates}
+                WHERE excluded.updated_at > students.updated_at
+            """, [tuple(row.get(c) for c in self.STUDENT_SYNC_COLUMNS) + (row['global_id'], row['updated_at'])
+                  for row in batches['students']])
+            self.cursor.executemany(f"""
+                INSERT INTO payments (student_id, {payment_columns})
+                SELECT s.id, {', '.join('?' * len(self.PAYMENT_SYNC_COLUMNS))}
+                FROM students s WHERE s.global_id = ? AND {not_deleted}
+                ON CONFLICT (global_id) DO UPDATE SET student_id = excluded.student_id, {payment_updates}
+                WHERE excluded.updated_at > payments.updated_at
+            """, [tuple(row.get(c) for c in self.PAYMENT_SYNC_COLUMNS) + (row['student_global_id'], row['global_id'], row['updated_at'])
+                  for row in batches['payments']])
+            for table in ('payments', 'students'):
+                tombstones = [(t['global_id'], t['deleted_at'], t['global_id'], t['table_name'], t['deleted_at'])
+                              for t in batches['tombstones'] if t['table_name'] == table]
+                # Only delete rows that weren't changed again after the deletion
+                self.cursor.executemany(f"""
+                    DELETE FROM {table} WHERE global_id = ? AND updated_at <= ?
+                """, [t[:2] for t in tombstones])
+                self.cursor.executemany("""
+                    INSERT INTO sync_tombstones (global_id, table_name, deleted_at) VALUES (?, ?, ?)
+                    ON CONFLICT (global_id) DO UPDATE SET deleted_at = MAX(deleted_at, excluded.deleted_at)
+                """, [t[2:] for t in tombstones])
+            # Recompute Cleared/Pending for the students whose payments arrived
+            payment_gids = [row['global_id'] for row in batches['payments']]
+            for start in range(0, len(payment_gids), 500):
+                chunk = payment_gids[start:start + 500]
+                self.cursor.execute(f"SELECT DISTINCT student_id FROM payments WHERE global_id IN ({', '.join('?' * len(chunk))})", chunk)
+                self.refresh_payment_statuses(row[0] for row in self.cursor.fetchall())
+            self.cursor.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, ?)",
+                                (f"sync_import_{header['branch']}", header['until']))
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return {name: len(rows) for name, rows in batches.items()}
+
+    def init_email(self):
+        """Create the outbound e-mail queue used to send receipts to parents"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payment_id INTEGER,
+                recipient TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                attachment_path TEXT,
+                status TEXT NOT NULL DEFAULT 'queued'
+                    CHECK (status IN ('waiting', 'queued', 'sending', 'sent', 'failed')),
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')),
+                last_error TEXT,
+                sent_at TEXT,
+                created_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_payment ON email_outbox (payment_id)')
+        # Messages that were being sent when the app last closed go back in the queue
+        self.cursor.execute("UPDATE email_outbox SET status = 'queued' WHERE status = 'sending'")
+        # Passwords saved by earlier versions move out of the database
+        self.cursor.execute("SELECT value FROM app_meta WHERE key = 'smtp_password'")
+        row = self.cursor.fetchone()
+        if row is not None:
+            if row[0]:
+                self.save_smtp_password(row[0])
+            self.cursor.execute("DELETE FROM app_meta WHERE key = 'smtp_password'")
+
+    def email_settings(self):
+        """Return the SMTP settings stored in app_meta as a dict, with the password from SMTP_PASSWORD_FILE"""
+        self.cursor.execute("SELECT key, value FROM app_meta WHERE key LIKE 'smtp\\_%' ESCAPE '\\'")
+        settings = dict(self.cursor.fetchall())
+        try:
+            with open(self.SMTP_PASSWORD_FILE, encoding='utf-8') as password_file:
+                settings['smtp_password'] = password_file.read()
+        except FileNotFoundError:
+            settings['smtp_password'] = ''
+        return settings
+
+    def save_smtp_password(self, password):
+        """Write the SMTP password to SMTP_PASSWORD_FILE, readable by the current user only"""
+        if not password:
+            if os.path.exists(self.SMTP_PASSWORD_FILE):
+                os.remove(self.SMTP_PASSWORD_FILE)
+            return
+        fd = os.open(self.SMTP_PASSWORD_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as password_file:
+            password_file.write(password)
+        os.chmod(self.SMTP_PASSWORD_FILE, 0o600)
+
+    def start_email_sender(self):
+        """(Re)start the background sender with the current settings and resume unfinished receipts"""
+        if self.email_sender is not None:
+            self.email_sender.stop()
+            self.email_sender = None
+        settings = self.email_settings()
+        if settings.get('smtp_host'):
+            self.email_sender = EmailSender(self.DB_PATH, settings, workers=self.EMAIL_WORKERS)
+        # Receipts still to be generated for queued e-mails
+        self.cursor.execute("SELECT DISTINCT payment_id FROM email_outbox WHERE status = 'waiting'")
+        self.queue_receipts(row[0] for row in self.cursor.fetchall())
+
+    def queue_receipt_emails(self, payment_ids):
+        """Queue receipt e-mails to parents for the given payments; return (queued, without e-mail)"""
+        payment_ids = list(payment_ids)
+        school = self.school_name.get()
+        rows, missing_receipts, without_email = [], [], 0
+        for start in range(0, len(payment_ids), 500):
+            chunk = payment_ids[start:start + 500]
+            # Payments that already have a message on the way are not queued twice
+            self.cursor.execute(f"""
+                SELECT p.id, p.paid_date, p.amount, p.receipt_path, s.name, s.parent_email
+                FROM payments p
+                JOIN students s ON p.student_id = s.id
+                WHERE p.id IN ({', '.join('?' * len(chunk))})
+                  AND NOT EXISTS (SELECT 1 FROM email_outbox o
+                                  WHERE o.payment_id = p.id AND o.status IN ('waiting', 'queued', 'sending'))
+            """, chunk)
+            for payment_id, paid_date, amount, receipt_path, name, parent_email in self.cursor.fetchall():
+                if not (parent_email or '').strip():
+                    without_email += 1
+                    continue
+                has_receipt = bool(receipt_path) and os.path.exists(receipt_path)
+                if not has_receipt:
+                    missing_receipts.append(payment_id)
+                body = (f"Dear Parent,\n\nPlease find attached the fee receipt for {name} "
+                        f"for ₹{amount:.2f} paid on {paid_date}.\n\nThank you,\n{school}")
+                rows.append((payment_id, parent_email.strip(), f"Fee Receipt - {name}", body,
+                             receipt_path if has_receipt else None, 'queued' if has_receipt else 'waiting'))
+        self.cursor.executemany("""
+            INSERT INTO email_outbox (payment_id, recipient, subject, body, attachment_path, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        self.conn.commit()
+        self.queue_receipts(missing_receipts)
+        if self.email_sender is not None:
+            self.email_sender.wake()
+        return len(rows), without_email
+
+    def email_selected_receipts(self):
+        """Queue receipt e-mails for the payments selected in the history view"""
+        selected = self.history_tree.selection()
+        if not selected:
+            messagebox.showerror("Error", "Please select one or more payments to e-mail.")
+            return
+        if self.email_sender is None:
+            messagebox.showerror("Error", "Set up e-mail first (Settings → E-mail Settings).")
+            return
+        payment_ids = [int(self.history_tree.item(item, 'values')[0]) for item in selected]
+        try:
+            queued, without_email = self.queue_receipt_emails(payment_ids)
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Error queueing e-mails: {e}")
+            return
+        note = f"\n{without_email} students have no parent e-mail." if without_email else ""
+        messagebox.showinfo("E-mail Queued", f"{queued} receipts queued for sending.{note}")
+
+    def show_email_settings(self):
+        """Edit the SMTP server used to e-mail receipts"""
+        settings_win = tk.Toplevel(self.root)
+        settings_win.title("E-mail Settings")
+        settings = self.email_settings()
+        fields = [("SMTP Server:", 'smtp_host'), ("Port:", 'smtp_port'), ("Security:", 'smtp_security'),
+                  ("Username:", 'smtp_user'), ("Password:", 'smtp_password'), ("From Address:", 'smtp_from')]
+        entries = {}
+        for row, (label, key) in enumerate(fields):
+            ttk.Label(settings_win, text=label).grid(row=row, column=0, sticky='w', padx=10, pady=5)
+            if key == 'smtp_security':
+                entry = ttk.Combobox(settings_win, width=28, state='readonly', values=['none', 'starttls', 'ssl'])
+                entry.set(settings.get(key) or 'starttls')
+            else:
+                entry = ttk.Entry(settings_win, width=30, show='*' if key == 'smtp_password' else '')
+                entry.insert(0, settings.get(key) or ('587' if key == 'smtp_port' else ''))
+            entry.grid(row=row, column=1, padx=10, pady=5)
+            entries[key] = entry
+
+        def save():
+            try:
+                int(entries['smtp_port'].get() or 0)
+            except ValueError:
+                messagebox.showerror("Error", "Port must be a number.", parent=settings_win)
+                return
+            try:
+                self.save_smtp_password(entries['smtp_password'].get())
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not save the password: {e}", parent=settings_win)
+                return
+            self.cursor.executemany("INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, ?)",
+                                    [(key, entry.get().strip()) for key, entry in entries.items()
+                                     if key != 'smtp_password'])
+            self.conn.commit()
+            self.start_email_sender()
+            settings_win.destroy()
+
+        ttk.Button(settings_win, text="Save", command=save).grid(row=len(fields), column=1, sticky='e', padx=10, pady=10)
+
+    def show_email_outbox(self):
+        """Show queued, sent and failed receipt e-mails, refreshing while open"""
+        outbox_win = tk.Toplevel(self.root)
+        outbox_win.title("E-mail Outbox")
+        outbox_win.geometry("950x450")
+        counts_var = tk.StringVar()
+        ttk.Label(outbox_win, textvariable=counts_var, font=("Helvetica", 10, "bold")).pack(fill='x', padx=10, pady=5)
+        columns = ('ID', 'Recipient', 'Subject', 'Status', 'Attempts', 'Next Attempt', 'Last Error')
+        tree = ttk.Treeview(outbox_win, columns=columns, show='headings')
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=110)
+        tree.column('Last Error', width=250)
+        tree.pack(fill='both', expand=True, padx=10, pady=5)
+
+        def refresh():
+            if not outbox_win.winfo_exists():
+                return
+            self.cursor.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status")
+            counts = dict(self.cursor.fetchall())
+            sender = "sending" if self.email_sender is not None else "not configured"
+            counts_var.set("   ".join(f"{status.title()}: {counts.get(status, 0)}"
+                                      for status in ('waiting', 'queued', 'sending', 'sent', 'failed')) + f"   (sender {sender})")
+            tree.delete(*tree.get_children())
+            self.cursor.execute("""
+                SELECT id, recipient, subject, status, attempts, next_attempt_at, last_error FROM email_outbox
+                ORDER BY status = 'sent', id DESC LIMIT 500
+            """)
+            for row in self.cursor.fetchall():
+                tree.insert('', 'end', values=tuple('' if value is None else value for value in row))
+            outbox_win.after(self.EMAIL_OUTBOX_REFRESH_MS, refresh)
+
+        def retry_failed():
+            self.cursor.execute("""
+                UPDATE email_outbox SET status = 'queued', attempts = 0,
+                       next_attempt_at = strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')
+                WHERE status = 'failed'
+            """)
+            self.conn.commit()
+            if self.email_sender is not None:
+                self.email_sender.wake()
+
+        def send_now():
+            self.cursor.execute("""
+                UPDATE email_outbox SET next_attempt_at = strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')
+                WHERE status = 'queued'
+            """)
+            self.conn.commit()
+            if self.email_sender is not None:
+                self.email_sender.wake()
+
+        button_frame = ttk.Frame(outbox_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Button(button_frame, text="Retry Failed", command=retry_failed).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Send Now", command=send_now).pack(side='left', padx=5)
+        refresh()
+
+    def init_jobs(self):
+        """Create the jobs table behind the background job queue"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                resource TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued'
+                    CHECK (status IN ('queued', 'running', 'done', 'failed', 'cancelled')),
+                checkpoint TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER,
+                owner TEXT,
+                heartbeat_at TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        ''')
+        # One queued or running job per resource
+        self.cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_resource ON jobs (resource)
+            WHERE status IN ('queued', 'running')
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+        import socket
+        import uuid
+        self.jobs = JobQueue(self.conn, f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}")
+
+    def start_job(self, kind, resource, params, total=None):
+        """Queue a background job and tell the user it has started; return its id or None"""
+        try:
+            job_id = self.jobs.enqueue(kind, resource, params, total)
+            self.conn.commit()
+        except ValueError as e:
+            self.conn.rollback()
+            messagebox.showerror("Busy", f"{e} Try again once it has finished (see Settings > Jobs).")
+            return None
+        self.schedule_jobs()
+        messagebox.showinfo("Started", f"{self.JOB_KINDS[kind]} is running in the background. "
+                                       "Progress is shown under Settings > Jobs; it carries on after a restart.")
+        return job_id
+
+    def schedule_jobs(self, delay_ms=None):
+        """Run the next job step after delay_ms (JOB_TICK_MS by default), replacing a later pending tick"""
+        if self.job_tick is not None:
+            self.root.after_cancel(self.job_tick)
+        self.job_tick = self.root.after(self.JOB_TICK_MS if delay_ms is None else delay_ms, self.run_jobs)
+
+    def run_jobs(self):
+        """Run one step of the oldest claimable job and reschedule; between steps the UI stays responsive.
+
+        Each kind has a job_<kind>(params, checkpoint) method that does one chunk of work without
+        committing and returns (checkpoint, done, total, finished). The chunk and the new checkpoint
+        are committed together, so after a crash the job resumes at the first unfinished chunk.
+        """
+        self.job_tick = None
+        try:
+            job = self.jobs.next_job()
+            # Commit the claim on its own, so other copies see this job is taken
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            job = None
+        if job is None:
+            self.schedule_jobs(self.JOB_IDLE_MS)
+            return
+        job_id, kind, params, checkpoint = job
+        try:
+            checkpoint, done, total, finished = getattr(self, f"job_{kind}")(params, checkpoint)
+            self.jobs.checkpoint(job_id, checkpoint, done, total, finished)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.jobs.fail(job_id, e)
+            self.conn.commit()
+            messagebox.showerror("Job Failed", f"{self.JOB_KINDS[kind]} failed: {e}\n\n"
+                                               "It can be retried from Settings > Jobs.")
+        else:
+            if finished:
+                self.finish_job(kind, params, checkpoint, done)
+            elif kind in self.THREADED_JOB_KINDS:
+                self.schedule_jobs(self.JOB_POLL_MS)
+                return
+        self.schedule_jobs()
+
+    def finish_job(self, kind, params, checkpoint, done):
+        """Refresh the views a finished job has changed and report it"""
+        if kind == 'receipts':
+            self.changes.publish('payments', params['payment_ids'])
+            if checkpoint['failed']:
+                messagebox.showwarning("Receipts", f"{checkpoint['failed']} of {done} receipts could not be generated; "
+                                                   f"e-mails waiting for them were marked failed.\n\n"
+                                                   f"Last error: {checkpoint['last_error']}")
+        elif kind == 'import_students':
+            self.student_cache.clear()
+            self.changes.publish('students')
+            skipped = f" Skipped {params['skipped']} possible duplicates." if params['skipped'] else ""
+            messagebox.showinfo("Import Complete", f"Imported {checkpoint[1]} students from CSV.{skipped}")
+        elif kind == 'export_csv':
+            messagebox.showinfo("Success", f"{done} payments exported to:\n{params['path']}")
+        elif kind == 'backup':
+            messagebox.showinfo("Success", f"Database backed up to:\n{params['path']}")
+        elif kind == 'statements' and params.get('notify'):
+            messagebox.showinfo("Statements Exported",
+                                f"{checkpoint['written']} of {done} statements were updated in:\n{params['folder']}")
+
+    def show_jobs(self):
+        """Show background jobs, newest first, with their progress; cancel or retry them"""
+        jobs_win = tk.Toplevel(self.root)
+        jobs_win.title("Background Jobs")
+        jobs_win.geometry("950x400")
+        columns = ("ID", "Job", "Status", "Progress", "Created", "Finished", "Error")
+        tree = ttk.Treeview(jobs_win, columns=columns, show='headings')
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=60 if col in ("ID", "Status") else 140)
+        tree.column('Error', width=260)
+        tree.pack(fill='both', expand=True, padx=10, pady=5)
+
+        def refresh():
+            if not jobs_win.winfo_exists():
+                return
+            selected = tree.selection()
+            tree.delete(*tree.get_children())
+            self.cursor.execute("""
+                SELECT id, kind, status, done, total, created_at, finished_at, error
+                FROM jobs ORDER BY id DESC LIMIT 200
+            """)
+            for job_id, kind, status, done, total, created_at, finished_at, error in self.cursor.fetchall():
+                progress = f"{done} / {total}" if total is not None else str(done)
+                tree.insert('', 'end', iid=str(job_id), values=(job_id, self.JOB_KINDS.get(kind, kind), status, progress,
+                                                                created_at, finished_at or '', error or ''))
+            tree.selection_set([item for item in selected if tree.exists(item)])
+            jobs_win.after(1000, refresh)
+
+        def change(action):
+            for item in tree.selection():
+                try:
+                    action(int(item))
+                    self.conn.commit()
+                except ValueError as e:
+                    self.conn.rollback()
+                    messagebox.showerror("Busy", str(e), parent=jobs_win)
+            self.schedule_jobs()
+
+        button_frame = ttk.Frame(jobs_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Button(button_frame, text="Cancel", command=lambda: change(self.jobs.cancel)).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Retry", command=lambda: change(self.jobs.retry)).pack(side='left', padx=5)
+        refresh()
+
+    def init_maintenance(self):
+        """Create the orphaned payments table and the log of storage maintenance runs"""
+        self.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'payments'")
+        create_sql = re.sub(r'^CREATE TABLE\s+"?payments"?', "CREATE TABLE IF NOT EXISTS orphaned_payments", self.cursor.fetchone()[0])
+        self.cursor.execute(create_sql)
+        # Mirror columns added to payments since the table was created
+        self.cursor.execute("PRAGMA table_info(orphaned_payments)")
+        orphan_columns = {row[1] for row in self.cursor.fetchall()}
+        self.cursor.execute("PRAGMA table_info(payments)")
+        for _, column, column_type, *_ in self.cursor.fetchall() + [(None, 'orphaned_at', 'TEXT')]:
+            if column not in orphan_columns:
+                self.cursor.execute(f"ALTER TABLE orphaned_payments ADD COLUMN {column} {column_type}")
+        for column, expression in PAYMENT_INTEGER_COLUMNS.items():
+            try:
+                self.cursor.execute(f'ALTER TABLE orphaned_payments ADD COLUMN {column} INTEGER GENERATED ALWAYS AS ({expression}) VIRTUAL')
+            except sqlite3.OperationalError:
+                pass
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_orphaned_payments_student ON orphaned_payments (student_id)')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT NOT NULL,
+                seconds REAL,
+                size_before INTEGER,
+                size_after INTEGER,
+                integrity TEXT,
+                steps TEXT
+            )
+        ''')
+
+    def run_maintenance_if_due(self):
+        """Start a maintenance run when the last one is older than MAINTENANCE_INTERVAL_DAYS"""
+        self.cursor.execute("SELECT value FROM app_meta WHERE key = 'maintenance_last_run'")
+        row = self.cursor.fetchone()
+        if row is None or (datetime.now() - datetime.fromisoformat(row[0])).days >= self.MAINTENANCE_INTERVAL_DAYS:
+            self.start_maintenance()
+
+    def start_maintenance(self, on_finish=None, convert=False):
+        """Run storage maintenance in the background; on_finish(report) is called on the UI thread.
+
+        convert allows the one-time full VACUUM that enables incremental vacuuming.
+        """
+        if self.maintenance is not None:
+            return False
+        # VACUUM needs the other connections out of their transactions
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.maintenance = StorageMaintenance(self.DB_PATH, convert)
+        self.root.after(self.MAINTENANCE_POLL_MS, self.poll_maintenance, on_finish)
+        return True
+
+    def poll_maintenance(self, on_finish):
+        try:
+            report = self.maintenance.finished.get_nowait()
+        except queue.Empty:
+            self.root.after(self.MAINTENANCE_POLL_MS, self.poll_maintenance, on_finish)
+            return
+        self.maintenance = None
+        if on_finish is not None:
+            on_finish(report)
+        elif 'error' in report:
+            messagebox.showwarning("Database Maintenance", f"Maintenance could not run: {report['error']}")
+        elif report['integrity'] != 'ok':
+            messagebox.showwarning("Database Maintenance",
+                                   f"The integrity check found problems:\n{report['integrity']}\n\n"
+                                   "Restore a backup or export your data as soon as possible.")
+
+    def reattach_orphaned_payments(self, old_student_id, student_id):
+        """Move a deleted student's orphaned payments back into payments under another student.
+
+        Rows go back in with the 'archiving' flag set, so the triggers treat them as still
+        belonging to the deleted student; changing their student_id then moves them in the
+        ledger and rollups exactly like any other reassignment. A row whose id (or global id)
+        has been taken by another payment meanwhile raises IntegrityError and nothing is moved.
+        """
+        columns = ", ".join(row[1] for row in self.cursor.execute("PRAGMA main.table_info(payments)").fetchall())
+        try:
+            self.cursor.execute("UPDATE app_meta SET value = 1 WHERE key = 'archiving'")
+            self.cursor.execute(f"""
+                INSERT INTO payments ({columns})
+                SELECT {columns} FROM orphaned_payments WHERE student_id IS ?
+            """, (old_student_id,))
+            self.cursor.execute("UPDATE app_meta SET value = 0 WHERE key = 'archiving'")
+            self.cursor.execute("""
+                UPDATE payments SET student_id = ?
+                WHERE id IN (SELECT id FROM orphaned_payments WHERE student_id IS ?)
+            """, (student_id, old_student_id))
+            moved = self.cursor.rowcount
+            self.cursor.execute("DELETE FROM orphaned_payments WHERE student_id IS ?", (old_student_id,))
+            self.refresh_payment_statuses([student_id])
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        self.student_cache.invalidate(student_id)
+        return moved
+
+    def show_maintenance(self):
+        """Show past maintenance runs, run maintenance now and reattach orphaned payments"""
+        maintenance_win = tk.Toplevel(self.root)
+        maintenance_win.title("Database Maintenance")
+        maintenance_win.geometry("900x600")
+
+        runs_frame = ttk.LabelFrame(maintenance_win, text="Maintenance Runs", padding="5")
+        runs_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        run_columns = ("Started", "Seconds", "Size Before (KB)", "Size After (KB)", "Reclaimed (KB)", "Integrity")
+        runs_tree = ttk.Treeview(runs_frame, columns=run_columns, show='headings', height=6)
+        for col in run_columns:
+            runs_tree.heading(col, text=col)
+            runs_tree.column(col, width=120, anchor='w' if col in ("Started", "Integrity") else 'e')
+        runs_tree.pack(fill='both', expand=True)
+        detail = tk.Text(runs_frame, height=5, wrap='word')
+        detail.pack(fill='x', pady=5)
+        run_steps = {}
+
+        orphan_frame = ttk.LabelFrame(maintenance_win, text="Orphaned Payments (student deleted)", padding="5")
+        orphan_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        orphan_columns = ("Old Student ID", "Payments", "Amount", "First Paid", "Last Paid")
+        orphan_tree = ttk.Treeview(orphan_frame, columns=orphan_columns, show='headings', height=5)
+        for col in orphan_columns:
+            orphan_tree.heading(col, text=col)
+            orphan_tree.column(col, width=120)
+        orphan_tree.pack(fill='both', expand=True)
+
+        def load():
+            runs_tree.delete(*runs_tree.get_children())
+            run_steps.clear()
+            self.cursor.execute("""
+                SELECT id, started_at, seconds, size_before, size_after, integrity, steps
+                FROM maintenance_runs ORDER BY id DESC LIMIT 50
+            """)
+            for run_id, started_at, seconds, size_before, size_after, integrity, steps in self.cursor.fetchall():
+                run_steps[str(run_id)] = json.loads(steps or '[]')
+                runs_tree.insert('', 'end', iid=str(run_id), values=(
+                    started_at, f"{seconds:.2f}", f"{size_before / 1024:,.0f}", f"{size_after / 1024:,.0f}",
+                    f"{(size_before - size_after) / 1024:,.0f}", integrity))
+            orphan_tree.delete(*orphan_tree.get_children())
+            self.cursor.execute("""
+                SELECT student_id, COUNT(*), SUM(amount_paise), MIN(paid_date), MAX(paid_date)
+                FROM orphaned_payments GROUP BY student_id ORDER BY student_id
+            """)
+            for old_id, count, paise, first_paid, last_paid in self.cursor.fetchall():
+                orphan_tree.insert('', 'end', values=('' if old_id is None else old_id, count, f"₹{paise / 100:.2f}",
+                                                      first_paid or '', last_paid or ''))
+
+        def show_steps(event=None):
+            detail.delete('1.0', tk.END)
+            for step in run_steps.get(runs_tree.focus(), []):
+                detail.insert(tk.END, f"{step['step']}: {step['detail']} ({step['ms']} ms)\n")
+
+        def finished(report):
+            if not maintenance_win.winfo_exists():
+                return
+            run_button.config(state='normal')
+            if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != StorageMaintenance.INCREMENTAL:
+                convert_button.config(state='normal')
+            if 'error' in report:
+                messagebox.showerror("Error", f"Maintenance could not run: {report['error']}", parent=maintenance_win)
+            load()
+
+        def run_now(convert=False):
+            if self.start_maintenance(finished, convert):
+                run_button.config(state='disabled')
+                convert_button.config(state='disabled')
+            else:
+                messagebox.showinfo("Database Maintenance", "Maintenance is already running.", parent=maintenance_win)
+
+        def enable_reclaiming():
+            if messagebox.askyesno("Enable Space Reclaiming",
+                                   "This rewrites the whole database once. While it runs, nobody can save payments "
+                                   "or students on this or any other computer, and saving may fail with "
+                                   "\"database is locked\".\n\nRun it only when no one else is using the app. "
+                                   "Continue?", icon='warning', parent=maintenance_win):
+                run_now(convert=True)
+
+        self.cursor.execute("SELECT id, name, class FROM students ORDER BY class, name")
+        students = [f"{name} ({class_name}) - ID:{student_id}" for student_id, name, class_name in self.cursor.fetchall()]
+
+        def reattach():
+            selected = orphan_tree.focus()
+            target = student_var.get()
+            if not selected or not target:
+                messagebox.showerror("Error", "Select an orphaned student and the student to attach the payments to.",
+                                     parent=maintenance_win)
+                return
+            old_id = orphan_tree.item(selected, 'values')[0]
+            old_id = int(old_id) if old_id != '' else None
+            student_id = int(target.split("ID:")[1])
+            try:
+                moved = self.reattach_orphaned_payments(old_id, student_id)
+            except sqlite3.Error as e:
+                messagebox.showerror("Database Error", f"Could not reattach payments: {e}", parent=maintenance_win)
+                return
+            load()
+            self.changes.publish('payments')
+            messagebox.showinfo("Reattached", f"{moved} payments attached to {target}.", parent=maintenance_win)
+
+        reattach_frame = ttk.Frame(orphan_frame)
+        reattach_frame.pack(fill='x', pady=5)
+        ttk.Label(reattach_frame, text="Attach to:").pack(side='left', padx=5)
+        student_var = tk.StringVar()
+        ttk.Combobox(reattach_frame, textvariable=student_var, values=students, width=40, state='readonly').pack(side='left', padx=5)
+        ttk.Button(reattach_frame, text="Reattach", command=reattach).pack(side='left', padx=5)
+
+        button_frame = ttk.Frame(maintenance_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        run_button = ttk.Button(button_frame, text="Run Maintenance Now", command=run_now)
+        run_button.pack(side='left', padx=5)
+        convert_button = ttk.Button(button_frame, text="Enable Space Reclaiming...", command=enable_reclaiming)
+        convert_button.pack(side='left', padx=5)
+        if self.maintenance is not None:
+            run_button.config(state='disabled')
+        if self.maintenance is not None or self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == StorageMaintenance.INCREMENTAL:
+            convert_button.config(state='disabled')
+        runs_tree.bind('<<TreeviewSelect>>', show_steps)
+        load()
+
+    def show_slow_queries(self):
+        """Show logged slow statements and this session's statement timings, with query plans"""
+        slow_win = tk.Toplevel(self.root)
+        slow_win.title("Slow Queries")
+        slow_win.geometry("1000x600")
+        notebook = ttk.Notebook(slow_win)
+        notebook.pack(fill='both', expand=True, padx=10, pady=5)
+        detail = tk.Text(slow_win, height=10, wrap='word')
+        detail.pack(fill='x', padx=10, pady=5)
+        plans = {}
+
+        def make_tree(title, view, columns, numeric):
+            frame = ttk.Frame(notebook)
+            notebook.add(frame, text=title)
+            tree = ttk.Treeview(frame, columns=columns, show='headings')
+            for col in columns:
+                tree.heading(col, text=col)
+                tree.column(col, width=80, anchor='e' if col in numeric else 'w')
+            tree.column('Caller', width=200)
+            tree.column('SQL', width=400)
+            tree.tag_configure('evenrow', background='lightblue')
+            tree.tag_configure('oddrow', background='white')
+            tree.pack(fill='both', expand=True)
+            tree.bind('<<TreeviewSelect>>', lambda event: show_detail(tree))
+            self.make_sortable(view, tree, numeric)
+            return tree
+
+        def show_detail(tree):
+            selected = tree.selection()
+            if not selected:
+                return
+            sql = tree.item(selected[0], 'values')[-1]
+            detail.delete('1.0', tk.END)
+            detail.insert('1.0', sql + "\n\n" + ("\n".join(plans.get(sql, [])) or "(no plan logged)"))
+
+        def load():
+            # Group logged slow statements by SQL, keeping the plan of the latest entry
+            offenders = {}
+            for path in reversed(self.query_tracer.log_files()):
+                try:
+                    with open(path, encoding='utf-8') as log:
+                        for line in log:
+                            try:
+                                entry = json.loads(line)
+                            except ValueError:
+                                continue
+                            row = offenders.setdefault(entry['sql'], [entry['caller'], 0, 0.0, 0.0, 0, ''])
+                            row[0] = entry['caller']
+                            row[1] += 1
+                            row[2] += entry['ms']
+                            row[3] = max(row[3], entry['ms'])
+                            row[4] = max(row[4], entry['rows'])
+                            row[5] = entry['at']
+                            plans[entry['sql']] = entry['plan']
+                except OSError:
+                    continue
+            self.show_rows('slow_log', [
+                (caller, count, round(total / count, 1), worst, rows,
+                 "Yes" if any(step.strip().startswith('SCAN') for step in plans[sql]) else "No", last, sql)
+                for sql, (caller, count, total, worst, rows, last) in offenders.items()])
+            with self.query_tracer.lock:
+                stats = [(caller, count, round(total * 1000, 1), round(total * 1000 / count, 2),
+                          round(worst * 1000, 1), rows, sql)
+                         for sql, (count, total, worst, rows, caller) in self.query_tracer.stats.items()]
+            self.show_rows('query_stats', stats)
+
+        make_tree("Slow Log", 'slow_log', ('Caller', 'Count', 'Avg ms', 'Max ms', 'Rows', 'Scan', 'Last Seen', 'SQL'),
+                  {'Count': 'q', 'Avg ms': 'd', 'Max ms': 'd', 'Rows': 'q'})
+        make_tree("This Session", 'query_stats', ('Caller', 'Count', 'Total ms', 'Avg ms', 'Max ms', 'Rows', 'SQL'),
+                  {'Count': 'q', 'Total ms': 'd', 'Avg ms': 'd', 'Max ms': 'd', 'Rows': 'q'})
+        # Worst offenders first
+        self.tree_views['slow_log'].update(sort='Max ms', reverse=True)
+        self.tree_views['query_stats'].update(sort='Total ms', reverse=True)
+        button_frame = ttk.Frame(slow_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(button_frame, text=f"Statements over {self.SLOW_QUERY_MS} ms are logged to "
+                                     f"{self.SLOW_QUERY_LOG}").pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Refresh", command=load).pack(side='right', padx=5)
+        load()
+
+    def show_reconciliation(self):
+        """Match a bank/UPI statement CSV against recorded payments and confirm the matches"""
+        file_path = filedialog.askopenfilename(
+            title="Select Bank Statement",
+            filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            lines = list(read_bank_statement(file_path))
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("Import Error", f"Could not read statement: {e}")
+            return
+        if not lines:
+            messagebox.showerror("Import Error", "No credit lines found. The statement needs a date column and a credit or amount column.")
+            return
+        # Only payments not yet reconciled, paid around the statement period
+        window = self.RECONCILE_WINDOW_DAYS
+        first_day = min(line['date'] for line in lines)
+        last_day = max(line['date'] for line in lines)
+        self.cursor.execute("""
+            SELECT p.id, p.paid_date, p.amount, p.payment_mode, p.reference, s.name
             FROM payments p
             JOIN students s ON p.student_id = s.id
-            WHERE 1=1
-        """
-        params = []
+            WHERE p.paid_day BETWEEN ? AND ?
+              AND NOT EXISTS (SELECT 1 FROM bank_reconciliation r WHERE r.payment_id = p.id)
+        """, (date.fromisoformat(first_day).toordinal() - window, date.fromisoformat(last_day).toordinal() + window))
+        matched, ambiguous, unmatched = reconcile_statement(lines, self.cursor.fetchall(), window)
 
-        if self.filter_class.get() and self.filter_class.get() != 'All':
-            query += " AND s.class = ?"
-            params.append(self.filter_class.get())
+        recon_win = tk.Toplevel(self.root)
+        recon_win.title(f"Reconciliation - {os.path.basename(file_path)}")
+        recon_win.geometry("1000x550")
+        summary_var = tk.StringVar()
+        ttk.Label(recon_win, textvariable=summary_var, font=("Helvetica", 10, "bold")).pack(fill='x', padx=10, pady=5)
+        notebook = ttk.Notebook(recon_win)
+        notebook.pack(fill='both', expand=True, padx=10, pady=5)
 
-        if self.filter_status.get() != 'All':
-            query += " AND p.status = ?"
-            params.append(self.filter_status.get())
+        def make_tree(title, columns):
+            frame = ttk.Frame(notebook)
+            notebook.add(frame, text=title)
+            tree = ttk.Treeview(frame, columns=columns, show='headings')
+            for col in columns:
+                tree.heading(col, text=col)
+                tree.column(col, width=100)
+            scrollbar = ttk.Scrollbar(frame, orient='vertical', command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            tree.pack(side='left', fill='both', expand=True)
+            scrollbar.pack(side='right', fill='y')
+            return tree
 
-        # Add date range filter
-        start_date = self.filter_start_date_entry.get().strip()
-        end_date = self.filter_end_date_entry.get().strip()
+        line_columns = ('Line', 'Statement Date', 'Amount', 'Reference', 'Description')
+        matched_tree = make_tree("Matched", line_columns + ('Payment ID', 'Student', 'Paid Date', 'Mode', 'Matched By'))
+        ambiguous_tree = make_tree("Ambiguous", line_columns + ('Candidates',))
+        unmatched_tree = make_tree("Unmatched", line_columns)
+        ambiguous_tree.column('Candidates', width=350)
+        lines_by_item = {}
 
-        if start_date and end_date:
-            query += " AND p.paid_date BETWEEN ? AND ?"
-            params.append(start_date)
-            params.append(end_date)
-        elif start_date:
-            query += " AND p.paid_date >= ?"
-            params.append(start_date)
-        elif end_date:
-            query += " AND p.paid_date <= ?"
-            params.append(end_date)
-            
-        # Add search filter
-        search_query = self.history_search_entry.get().strip()
-        if search_query:
-            query += " AND (s.name LIKE ? OR s.class LIKE ? OR s.contact LIKE ?)"
-            search_term = f"%{search_query}%"
-            params.extend([search_term] * 3)
+        def line_values(line):
+            return (line['line_no'], line['date'], f"{line['amount']:.2f}", line['reference'], line['description'])
 
-        query += " ORDER BY p.created_date DESC"
+        def add_match(line, payment, how):
+            item = matched_tree.insert('', 'end', values=line_values(line) + (payment[0], payment[5], payment[1], payment[3] or '', how))
+            lines_by_item[item] = line
 
-        try:
-            self.cursor.execute(query, params)
-            payments = self.cursor.fetchall()
+        for line, payment, how in matched:
+            add_match(line, payment, how)
+        for line, candidates in ambiguous:
+            item = ambiguous_tree.insert('', 'end', values=line_values(line) + (
+                "; ".join(f"#{payment[0]} {payment[5]} ({payment[1]})" for payment in candidates),))
+            lines_by_item[item] = (line, candidates)
+        for line in unmatched:
+            unmatched_tree.insert('', 'end', values=line_values(line))
 
-            for payment in payments:
-                receipt_status = "Yes" if payment[8] else "No"
-                display_payment = payment[:8] + (receipt_status, payment[9],) # Append receipt status and payment mode
-                tag = 'cleared' if payment[6] == 'Cleared' else 'pending'
-                self.history_tree.insert('', 'end', values=display_payment, tags=(tag,))
+        def update_summary():
+            summary_var.set(f"{len(lines)} credit lines: {len(matched_tree.get_children())} matched, "
+                            f"{len(ambiguous_tree.get_children())} ambiguous, {len(unmatched_tree.get_children())} unmatched")
 
-            self.history_tree.tag_configure('cleared', background='#d4f7d4')
-            self.history_tree.tag_configure('pending', background='#ffd6d6')
+        def resolve_ambiguous(event=None):
+            # Pick which candidate an ambiguous line belongs to
+            from tkinter import simpledialog
+            selected = ambiguous_tree.selection()
+            if not selected:
+                return
+            line, candidates = lines_by_item[selected[0]]
+            taken = {int(matched_tree.set(item, 'Payment ID')) for item in matched_tree.get_children()}
+            choices = [payment for payment in candidates if payment[0] not in taken]
+            if not choices:
+                messagebox.showerror("Error", "Every candidate is already matched to another line.", parent=recon_win)
+                return
+            payment_id = simpledialog.askinteger("Choose Payment", "Payment ID for this line:\n\n" + "\n".join(
+                f"#{payment[0]} {payment[5]}, paid {payment[1]}, {payment[3] or '-'}" for payment in choices), parent=recon_win)
+            payment = next((payment for payment in choices if payment[0] == payment_id), None)
+            if payment is None:
+                return
+            ambiguous_tree.delete(selected[0])
+            add_match(line, payment, "Chosen")
+            update_summary()
 
-            self.update_summary_bar()
+        def confirm(items):
+            rows = [(int(matched_tree.set(item, 'Payment ID')), lines_by_item[item]['date'], lines_by_item[item]['amount'],
+                     lines_by_item[item]['reference'], lines_by_item[item]['description']) for item in items]
+            if not rows:
+                messagebox.showerror("Error", "No matched lines selected.", parent=recon_win)
+                return
+            try:
+                self.cursor.executemany("""
+                    INSERT OR IGNORE INTO bank_reconciliation (payment_id, statement_date, amount, reference, description)
+                    VALUES (?, ?, ?, ?, ?)
+                """, rows)
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                messagebox.showerror("Database Error", f"Error saving reconciliation: {e}", parent=recon_win)
+                return
+            for item in items:
+                matched_tree.delete(item)
+            update_summary()
+            messagebox.showinfo("Reconciled", f"{len(rows)} payments marked as received in the bank.", parent=recon_win)
+
+        def export_unmatched():
+            import csv
+            path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")],
+                                                title="Save Unmatched Lines", parent=recon_win)
+            if not path:
+                return
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(line_columns)
+                for item in unmatched_tree.get_children():
+                    writer.writerow(unmatched_tree.item(item, 'values'))
+            self.open_file(path)
+
+        ambiguous_tree.bind('<Double-1>', resolve_ambiguous)
+        button_frame = ttk.Frame(recon_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Button(button_frame, text="Confirm Selected", command=lambda: confirm(matched_tree.selection())).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Confirm All Matched", command=lambda: confirm(matched_tree.get_children())).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Resolve Ambiguous", command=resolve_ambiguous).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Export Unmatched", command=export_unmatched).pack(side='right', padx=5)
+        update_summary()
 
-        except Exception as e:
-            messagebox.showerror("Database Error", f"Error applying filter: {e}")
-    
-    def open_receipt(self, event):
-        """Open receipt file when double-clicked"""
-        selection = self.history_tree.selection()
-        if selection:
-            item = self.history_tree.item(selection[0])
-            payment_id = item['values'][0]
-            
-            # Get receipt path from database
-            self.cursor.execute("SELECT receipt_path FROM payments WHERE id = ?", (payment_id,))
-            result = self.cursor.fetchone()
-            
-            if result and result[0]:
-                self.open_file(result[0])
-            else:
-                messagebox.showinfo("No Receipt", "No receipt found for this payment.")
-    
-    def open_receipts_folder(self):
-        """Open the receipts folder in file explorer"""
-        receipts_path = os.path.abspath("receipts")
-        self.open_file(receipts_path)
-    
-    def open_whatsapp_web(self):
-        """Open WhatsApp Web in browser"""
-        webbrowser.open("https://web.whatsapp.com")
-        messagebox.showinfo("WhatsApp Web", 
-                          "WhatsApp Web opened in your browser.\n" +
-                          "You can manually attach receipt files from the receipts folder.")
-    
-    def backup_database(self):
-        """Create a backup of the database"""
-        try:
-            backup_path = filedialog.asksaveasfilename(
-                defaultextension=".db",
-                filetypes=[("SQLite Database", "*.db"), ("All Files", "*.*")],
-                title="Save Database Backup"
-            )
-            
-            if backup_path:
-                # Copy database file
-                import shutil
-                shutil.copy2("db/students.db", backup_path)
-                messagebox.showinfo("Success", f"Database backed up to:\n{backup_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error creating backup: {e}")
-    
     def export_to_csv(self):
-        """Export payment history to CSV"""
+        """Export payment history to CSV in a background job"""
         try:
-            import csv
-            
             csv_path = filedialog.asksaveasfilename(
                 defaultextension=".csv",
                 filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")],
@@ -1069,26 +5399,246 @@ class FeeReceiptApp:
             )
             
             if csv_path:
-                self.cursor.execute("""
-                    SELECT s.name, s.class, s.contact, p.due_date, p.paid_date, 
-                           p.amount, p.status, p.created_date, p.payment_mode
-                    FROM payments p
-                    JOIN students s ON p.student_id = s.id
-                    ORDER BY p.created_date DESC
-                """)
-                
-                payments = self.cursor.fetchall()
-                
-                with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    writer.writerow(['Student Name', 'Class', 'Contact', 'Due Date', 
-                                   'Paid Date', 'Amount', 'Status', 'Created Date', 'Payment Mode'])
-                    writer.writerows(payments)
-                
-                messagebox.showinfo("Success", f"Payment history exported to:\n{csv_path}")
+                # Include archived years when the history date range reaches into them
+                archives = self.history_filter[3]
+                self.cursor.execute(f"SELECT COUNT(*) FROM {self.payments_source(archives)} p JOIN students s ON p.student_id = s.id")
+                self.start_job('export_csv', f"file:{os.path.abspath(csv_path)}",
+                               {'path': csv_path, 'archives': archives}, self.cursor.fetchone()[0])
         except Exception as e:
             messagebox.showerror("Error", f"Error exporting to CSV: {e}")
-    
+
+    def job_export_csv(self, params, checkpoint):
+        """Job step: append the next chunk of payments, newest first, to the CSV file.
+
+        A chunk ends after EXPORT_JOB_CHUNK rows or JOB_STEP_MS, whichever comes first. The checkpoint holds the last (created_date, id) written and the file length after it;
+        a resumed export cuts the file back to that length before appending, so rows written
+        after the last checkpoint are not duplicated.
+        """
+        import csv
+        import io
+        source = self.payments_source(params['archives'])
+        query = f"""
+            SELECT s.name, s.class, s.contact, p.due_date, p.paid_date,
+                   p.amount, p.status, p.created_date, p.payment_mode, p.id
+            FROM {source} p
+            JOIN students s ON p.student_id = s.id
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if checkpoint is None:
+            checkpoint = {'after': None, 'offset': 0, 'rows': 0}
+            writer.writerow(['Student Name', 'Class', 'Contact', 'Due Date',
+                             'Paid Date', 'Amount', 'Status', 'Created Date', 'Payment Mode'])
+            query_params = []
+        else:
+            query += " WHERE (p.created_date, p.id) < (?, ?)"
+            query_params = list(checkpoint['after'])
+        query += " ORDER BY p.created_date DESC, p.id DESC"
+        deadline = time.perf_counter() + self.JOB_STEP_MS / 1000
+        rows = []
+        cursor = self.conn.execute(query, query_params)
+        for row in cursor:
+            rows.append(row)
+            if len(rows) == self.EXPORT_JOB_CHUNK or time.perf_counter() > deadline:
+                finished = cursor.fetchone() is None
+                break
+        else:
+            finished = True
+        cursor.close()
+        writer.writerows(row[:-1] for row in rows)
+        with open(params['path'], 'r+b' if checkpoint['offset'] else 'wb') as csvfile:
+            csvfile.truncate(checkpoint['offset'])
+            csvfile.seek(checkpoint['offset'])
+            csvfile.write(buffer.getvalue().encode('utf-8'))
+            offset = csvfile.tell()
+        done = checkpoint['rows'] + len(rows)
+        if rows:
+            checkpoint = {'after': [rows[-1][7], rows[-1][9]], 'offset': offset, 'rows': done}
+        return checkpoint, done, None, finished
+
+    def export_to_xlsx(self):
+        """Export the payment history matching the current filters to an Excel workbook"""
+        xlsx_path = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel Workbook", "*.xlsx"), ("All Files", "*.*")],
+            title="Export Payment History"
+        )
+        if not xlsx_path:
+            return
+        conditions, params, _, archives = self.history_filter
+        query = f"""
+            SELECT p.id, s.name, s.class, s.contact, p.due_date, p.paid_date, p.amount,
+                   p.status, p.payment_mode, p.reference, p.created_date
+            FROM {self.payments_source(archives)} p
+            JOIN students s ON p.student_id = s.id
+        """
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY p.created_date DESC, p.id DESC"
+        columns = [('Receipt No.', 'number', 11), ('Student Name', 'text', 28), ('Class', 'text', 10),
+                   ('Contact', 'text', 14), ('Due Date', 'date', 12), ('Paid Date', 'date', 12),
+                   ('Amount', 'amount', 12), ('Status', 'text', 10), ('Payment Mode', 'text', 14),
+                   ('Reference', 'text', 18), ('Recorded At', 'datetime', 17)]
+        try:
+            # Rows stream from a cursor of their own straight into the workbook
+            written = write_xlsx(xlsx_path, "Payments", columns, self.conn.execute(query, params))
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Error exporting to Excel: {e}")
+            return
+        messagebox.showinfo("Success", f"{written} payments exported to:\n{xlsx_path}")
+
+    def init_statements(self):
+        """Create the table of exported statement pages and the hash of what each one shows"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statement_pages (
+                folder TEXT NOT NULL,
+                student_id INTEGER NOT NULL,
+                file_name TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                exported_at TEXT NOT NULL,
+                PRIMARY KEY (folder, student_id)
+            )
+        ''')
+
+    def export_statements(self):
+        """Choose a folder and export a fee statement page per student, plus an index, in the background"""
+        self.cursor.execute("SELECT value FROM app_meta WHERE key = 'statements_folder'")
+        row = self.cursor.fetchone()
+        folder = filedialog.askdirectory(title="Folder for Parent Statements", initialdir=row[0] if row else None)
+        if not folder:
+            return
+        folder = os.path.abspath(folder)
+        # Remembered, so the statements are brought up to date there every day
+        self.cursor.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('statements_folder', ?)", (folder,))
+        self.conn.commit()
+        self.cursor.execute("SELECT COUNT(*) FROM students")
+        self.start_job('statements', f"dir:{folder}", {'folder': folder, 'notify': True}, self.cursor.fetchone()[0])
+
+    def run_statements_if_due(self):
+        """Queue a statement export to the remembered folder when the last one is older than STATEMENT_INTERVAL_HOURS"""
+        self.cursor.execute("SELECT key, value FROM app_meta WHERE key IN ('statements_folder', 'statements_last_run')")
+        meta = dict(self.cursor.fetchall())
+        last_run = meta.get('statements_last_run')
+        if 'statements_folder' in meta and (
+                last_run is None
+                or (datetime.now() - datetime.fromisoformat(last_run)).total_seconds() >= self.STATEMENT_INTERVAL_HOURS * 3600):
+            folder = meta['statements_folder']
+            try:
+                self.jobs.enqueue('statements', f"dir:{folder}", {'folder': folder, 'notify': False})
+                self.conn.commit()
+                self.schedule_jobs()
+            except ValueError:
+                self.conn.rollback()  # An export is already queued or running
+        self.root.after(self.STATEMENT_CHECK_MS, self.run_statements_if_due)
+
+    def job_statements(self, params, checkpoint):
+        """Job step: bring the next chunk of students' statement pages up to date, for up to JOB_STEP_MS.
+
+        Each page's inputs (student details, fee, payments and receipt names) are hashed; a
+        page is only rendered and written when its hash differs from the one recorded for that
+        folder, or its file has gone. The last step removes pages of deleted students and
+        rewrites the index.
+        """
+        import hashlib
+        import shutil
+        folder = params['folder']
+        pages_dir = os.path.join(folder, "students")
+        receipts_dir = os.path.join(folder, "receipts")
+        os.makedirs(pages_dir, exist_ok=True)
+        os.makedirs(receipts_dir, exist_ok=True)
+        checkpoint = checkpoint or {'after': 0, 'seen': 0, 'written': 0}
+        school = self.school_name.get()
+        now = datetime.now().isoformat(sep=' ', timespec='minutes')
+        deadline = time.perf_counter() + self.JOB_STEP_MS / 1000
+
+        self.cursor.execute("""
+            SELECT id, COALESCE(global_id, id), name, class FROM students
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (checkpoint['after'], self.STATEMENT_JOB_CHUNK))
+        students = self.cursor.fetchall()
+        if students:
+            first_id, last_id = students[0][0], students[-1][0]
+            self.cursor.execute("""
+                SELECT student_id, paid_date, amount_paise, payment_mode, receipt_path FROM payments
+                WHERE student_id BETWEEN ? AND ?
+                ORDER BY student_id, paid_day, id
+            """, (first_id, last_id))
+            payments = {}
+            for student_id, paid_date, paise, mode, receipt_path in self.cursor.fetchall():
+                payments.setdefault(student_id, []).append((paid_date, paise, mode, receipt_path))
+            self.cursor.execute("""
+                SELECT student_id, SUM(amount_paise) FROM ledger
+                WHERE student_id BETWEEN ? AND ?
+                GROUP BY student_id
+            """, (first_id, last_id))
+            balances = dict(self.cursor.fetchall())
+            self.cursor.execute("""
+                SELECT student_id, content_hash FROM statement_pages
+                WHERE folder = ? AND student_id BETWEEN ? AND ?
+            """, (folder, first_id, last_id))
+            hashes = dict(self.cursor.fetchall())
+
+            processed = 0
+            for student_id, global_id, name, class_name in students:
+                if processed and time.perf_counter() > deadline:
+                    break
+                processed += 1
+                checkpoint['after'] = student_id
+                rows = payments.get(student_id, [])
+                balance = balances.get(student_id, 0)
+                receipts = [os.path.basename(receipt_path) if receipt_path and os.path.exists(receipt_path) else None
+                            for _, _, _, receipt_path in rows]
+                content = json.dumps([school, self.TOTAL_FEE, name, class_name, balance,
+                                      [(paid_date, paise, mode, receipt) for (paid_date, paise, mode, _), receipt
+                                       in zip(rows, receipts)]])
+                content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+                file_name = f"{global_id}.html"
+                page_path = os.path.join(pages_dir, file_name)
+                if hashes.get(student_id) == content_hash and os.path.exists(page_path):
+                    continue
+                for (_, _, _, receipt_path), receipt in zip(rows, receipts):
+                    if receipt and not os.path.exists(os.path.join(receipts_dir, receipt)):
+                        shutil.copy2(receipt_path, os.path.join(receipts_dir, receipt))
+                paid = sum(paise for _, paise, _, _ in rows)
+                fields = {'school': school, 'name': name, 'class_name': class_name, 'total_fee': self.TOTAL_FEE,
+                          'paid': paid / 100, 'balance': max(balance, 0) / 100, 'updated': now}
+                page = student_statement_page(fields, [(paid_date, paise / 100, mode, receipt)
+                                                       for (paid_date, paise, mode, _), receipt in zip(rows, receipts)])
+                with open(page_path + ".partial", 'w', encoding='utf-8') as page_file:
+                    page_file.write(page)
+                os.replace(page_path + ".partial", page_path)
+                self.cursor.execute("""
+                    INSERT OR REPLACE INTO statement_pages (folder, student_id, file_name, content_hash, exported_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (folder, student_id, file_name, content_hash, now))
+                checkpoint['written'] += 1
+            checkpoint['seen'] += processed
+            if processed < len(students) or len(students) == self.STATEMENT_JOB_CHUNK:
+                return checkpoint, checkpoint['seen'], None, False
+
+        # Last step: drop pages of students deleted since the last export, then rewrite the index
+        self.cursor.execute("""
+            SELECT student_id, file_name FROM statement_pages
+            WHERE folder = ? AND student_id NOT IN (SELECT id FROM students)
+        """, (folder,))
+        for student_id, file_name in self.cursor.fetchall():
+            if os.path.exists(os.path.join(pages_dir, file_name)):
+                os.remove(os.path.join(pages_dir, file_name))
+            self.cursor.execute("DELETE FROM statement_pages WHERE folder = ? AND student_id = ?", (folder, student_id))
+        self.cursor.execute(f"""
+            SELECT s.name, s.class, MAX({self.STUDENT_BALANCE_SQL}, 0) / 100.0, sp.file_name
+            FROM students s
+            JOIN statement_pages sp ON sp.student_id = s.id AND sp.folder = ?
+            ORDER BY s.class, s.name
+        """, (folder,))
+        index_path = os.path.join(folder, "index.html")
+        with open(index_path + ".partial", 'w', encoding='utf-8') as index_file:
+            index_file.write(statement_index_page(school, self.cursor.fetchall(), now))
+        os.replace(index_path + ".partial", index_path)
+        self.cursor.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('statements_last_run', ?)",
+                            (datetime.now().isoformat(timespec='seconds'),))
+        return checkpoint, checkpoint['seen'], checkpoint['seen'], True
+
     def open_file(self, filepath):
         """Open file with default system application"""
         try:
@@ -1115,16 +5665,14 @@ class FeeReceiptApp:
             return
         try:
             student_id = int(student_info.split("ID:")[1])
-            self.cursor.execute("SELECT class, contact, mother_name, father_name, parent_number, parent_email FROM students WHERE id = ?", (student_id,))
-            row = self.cursor.fetchone()
-            class_name, contact, mother_name, father_name, parent_number, parent_email = row if row else ("", "", "", "", "", "")
+            record = self.student_record(student_id)
+            class_name, contact = (record.class_name, record.contact or "") if record else ("", "")
             self.selected_class.config(state='normal'); self.selected_class.delete(0, tk.END); self.selected_class.insert(0, class_name); self.selected_class.config(state='readonly')
             self.selected_contact.config(state='normal'); self.selected_contact.delete(0, tk.END); self.selected_contact.insert(0, contact); self.selected_contact.config(state='readonly')
-            self.cursor.execute("SELECT SUM(amount) FROM payments WHERE student_id = ?", (student_id,))
-            paid = self.cursor.fetchone()[0] or 0.0
+            paid = record.paid if record else 0.0
             total = self.TOTAL_FEE
-            remaining = max(total - paid, 0.0)
-            self.fee_summary_var.set(f"Total Fee: ₹{total:.2f} | Paid: ₹{paid:.2f} | Remaining: ₹{remaining:.2f}")
+            remaining = max(record.balance, 0.0) if record else 0.0
+            self.fee_summary_var.set(f"Total Fee: ₹{total:.2f} | Paid this year: ₹{paid:.2f} | Remaining: ₹{remaining:.2f}")
         except Exception:
             self.fee_summary_var.set("")
 
@@ -1151,21 +5699,380 @@ class FeeReceiptApp:
             tree.heading(col, text=col)
         tree.pack(fill='both', expand=True)
 
-        # Select students and calculate total paid amount
+        # One query for every student's balance, which also refreshes the student cache
+        for record in self.load_student_records():
+            if record.balance > 0:
+                tree.insert('', 'end', values=(record.name, record.class_name, record.contact, f"₹{record.balance:.2f}"))
+        ttk.Button(pending_win, text="Generate Reminders", command=self.start_reminders).pack(pady=5)
+
+    def init_reminders(self):
+        """Create the tables behind resumable fee reminder runs"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                total_fee REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'done', 'abandoned')),
+                written INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                finished_at TEXT
+            )
+        ''')
+        # One row per student with a balance, copied when the run is created
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER NOT NULL REFERENCES reminder_runs (id),
+                student_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                class TEXT,
+                parent_number TEXT,
+                parent_email TEXT,
+                balance REAL NOT NULL,
+                last_paid_date DATE,
+                last_amount REAL,
+                message TEXT,
+                pdf_path TEXT,
+                status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'written', 'failed')),
+                error TEXT,
+                emailed INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_run ON reminders (run_id, status, id)')
+
+    def create_reminder_run(self):
+        """Start a reminder run for every student who still owes part of the fee; return (run id, students)"""
+        created_at = datetime.now().isoformat(timespec='seconds')
+        try:
+            self.cursor.execute("INSERT INTO reminder_runs (created_at, folder, total_fee) VALUES (?, '', ?)",
+                                (created_at, self.TOTAL_FEE))
+            run_id = self.cursor.lastrowid
+            folder = os.path.join(self.REMINDER_DIR, f"{run_id}_{created_at[:10]}")
+            self.cursor.execute("UPDATE reminder_runs SET folder = ? WHERE id = ?", (folder, run_id))
+            # Parents are reached on their own number, falling back to the student's contact
+            balance_query, balance_params = self.ledger_balance_query()
+            self.cursor.execute(f"""
+                INSERT INTO reminders (run_id, student_id, name, class, parent_number, parent_email,
+                                       balance, last_paid_date, last_amount)
+                SELECT ?, s.id, s.name, s.class, COALESCE(NULLIF(s.parent_number, ''), s.contact), s.parent_email,
+                       b.balance_paise / 100.0, t.last_paid_date,
+                       (SELECT p.amount FROM payments p WHERE p.student_id = s.id
+                        ORDER BY p.paid_date DESC, p.id DESC LIMIT 1)
+                FROM students s
+                JOIN ({balance_query}) b ON b.student_id = s.id
+                LEFT JOIN (SELECT student_id, MAX(paid_date) AS last_paid_date
+                           FROM payments GROUP BY student_id) t ON t.student_id = s.id
+                WHERE b.balance_paise > 0 AND s.left_date IS NULL
+                ORDER BY s.class, s.name
+            """, [run_id] + balance_params)
+            count = self.cursor.rowcount
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return run_id, count
+
+    def start_reminders(self):
+        """Write reminders for every student with a balance, resuming an unfinished run if there is one"""
+        if self.reminder_job is not None:
+            messagebox.showinfo("Fee Reminders", "Reminders are already being written.")
+            return
         self.cursor.execute("""
-            SELECT s.name, s.class, s.contact, SUM(p.amount) as total_paid
-            FROM students s
-            LEFT JOIN payments p ON s.id = p.student_id
-            GROUP BY s.id, s.name, s.class, s.contact
-            HAVING SUM(p.amount) < ? OR SUM(p.amount) IS NULL
-            ORDER BY s.class, s.name
-        """, (self.TOTAL_FEE,))
+            SELECT r.id, r.created_at, COUNT(m.id), COALESCE(SUM(m.status != 'pending'), 0)
+            FROM reminder_runs r LEFT JOIN reminders m ON m.run_id = r.id
+            WHERE r.status = 'open' GROUP BY r.id ORDER BY r.id DESC LIMIT 1
+        """)
+        unfinished = self.cursor.fetchone()
+        try:
+            if unfinished and messagebox.askyesno(
+                    "Fee Reminders", f"The reminder run started {unfinished[1]} stopped after {unfinished[3]} of "
+                                     f"{unfinished[2]} reminders.\n\nResume it? (No starts a new run.)"):
+                run_id = unfinished[0]
+            else:
+                if unfinished:
+                    self.cursor.execute("UPDATE reminder_runs SET status = 'abandoned' WHERE id = ?", (unfinished[0],))
+                    self.conn.commit()
+                run_id, count = self.create_reminder_run()
+                if not count:
+                    self.cursor.execute("UPDATE reminder_runs SET status = 'done' WHERE id = ?", (run_id,))
+                    self.conn.commit()
+                    messagebox.showinfo("Fee Reminders", "No student has a balance outstanding.")
+                    return
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Could not start the reminder run: {e}")
+            return
+        school = {'school': self.school_name.get(), 'school_address': self.school_address.get(),
+                  'school_contact': self.school_contact.get()}
+        self.reminder_job = ReminderJob(self.DB_PATH, run_id, school, self.rupee_font, self.REMINDER_WORKERS)
+        self.show_reminder_progress(run_id)
+
+    def show_reminder_progress(self, run_id):
+        """Follow the running reminder job; it keeps going if the window is closed"""
+        job = self.reminder_job
+        progress_win = tk.Toplevel(self.root)
+        progress_win.title("Fee Reminders")
+        progress_win.geometry("460x170")
+        status_var = tk.StringVar(value="Starting...")
+        ttk.Label(progress_win, textvariable=status_var, wraplength=420).pack(padx=10, pady=10)
+        bar = ttk.Progressbar(progress_win, length=420, mode='determinate')
+        bar.pack(padx=10)
+        button_frame = ttk.Frame(progress_win)
+        button_frame.pack(pady=10)
+        cancel_button = ttk.Button(button_frame, text="Stop", command=job.cancel)
+        cancel_button.pack(side='left', padx=5)
+
+        def email_reminders():
+            queued, without_email = self.queue_reminder_emails(run_id)
+            missing = f"\n{without_email} parents have no e-mail address." if without_email else ""
+            messagebox.showinfo("Fee Reminders", f"{queued} reminder e-mails queued.{missing}", parent=progress_win)
+
+        def finish(report):
+            self.reminder_job = None
+            if not progress_win.winfo_exists():
+                return
+            cancel_button.destroy()
+            if 'error' in report:
+                status_var.set(f"Reminders stopped: {report['error']}. Generate Reminders again to resume.")
+                return
+            if not report['finished']:
+                status_var.set(f"Stopped after {report['written'] + report['failed']} of {report['total']} reminders. "
+                               "Generate Reminders again to resume.")
+                return
+            failed = f", {report['failed']} failed" if report['failed'] else ""
+            status_var.set(f"{report['written']} reminders written in {report['seconds']}s{failed}.\n"
+                           f"Messages for SMS/WhatsApp are in {os.path.join(report['folder'], 'messages.csv')}.")
+            ttk.Button(button_frame, text="Open Folder",
+                       command=lambda: self.open_file(os.path.abspath(report['folder']))).pack(side='left', padx=5)
+            ttk.Button(button_frame, text="E-mail Reminders", command=email_reminders).pack(side='left', padx=5)
+
+        def poll():
+            report = None
+            while True:
+                try:
+                    message = job.progress.get_nowait()
+                except queue.Empty:
+                    break
+                if message[0] == 'finished':
+                    report = message[1]
+                elif progress_win.winfo_exists():
+                    done, total = message
+                    bar.config(maximum=max(total, 1), value=done)
+                    status_var.set(f"Writing reminders: {done} of {total}")
+            if report is None:
+                self.root.after(self.REMINDER_POLL_MS, poll)
+            else:
+                finish(report)
+
+        poll()
+
+    def queue_reminder_emails(self, run_id):
+        """Queue e-mails for a run's written reminders, each once; return (queued, without e-mail)"""
+        self.cursor.execute("""
+            INSERT INTO email_outbox (recipient, subject, body, attachment_path, status)
+            SELECT trim(parent_email), 'Fee Reminder - ' || name, message, pdf_path, 'queued'
+            FROM reminders
+            WHERE run_id = ? AND status = 'written' AND emailed = 0 AND trim(COALESCE(parent_email, '')) != ''
+        """, (run_id,))
+        queued = self.cursor.rowcount
+        self.cursor.execute("""
+            UPDATE reminders SET emailed = 1
+            WHERE run_id = ? AND status = 'written' AND trim(COALESCE(parent_email, '')) != ''
+        """, (run_id,))
+        self.cursor.execute("""
+            SELECT COUNT(*) FROM reminders
+            WHERE run_id = ? AND status = 'written' AND trim(COALESCE(parent_email, '')) = ''
+        """, (run_id,))
+        without_email = self.cursor.fetchone()[0]
+        self.conn.commit()
+        if self.email_sender is not None:
+            self.email_sender.wake()
+        return queued, without_email
+
+    def aging_cte(self):
+        """Return the WITH clause and parameters shared by the aging report queries.
+
+        Outstanding is the student's ledger balance. Days outstanding are counted from the
+        student's earliest due date (or their admission date if nothing has been recorded
+        yet) to today. Students are grouped under the payment mode of their most recent payment.
+        """
+        bucket_case = "CASE WHEN days < 0 THEN 'Not Due'"
+        for label, upper in self.AGING_BUCKETS:
+            if upper is None:
+                bucket_case += f" ELSE '{label}' END"
+            else:
+                bucket_case += f" WHEN days <= {upper} THEN '{label}'"
+        balance_query, balance_params = self.ledger_balance_query()
+        cte = f"""
+            WITH paid AS (
+                SELECT student_id, MIN(due_date) AS first_due
+                FROM payments
+                GROUP BY student_id
+            ),
+            balance AS ({balance_query}),
+            last_payment AS (
+                SELECT student_id, payment_mode,
+                       ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY created_date DESC, id DESC) AS rn
+                FROM payments
+            ),
+            outstanding AS (
+                SELECT s.id, s.name, s.class, s.contact,
+                       COALESCE(lp.payment_mode, 'No Payment') AS payment_mode,
+                       b.balance_paise / 100.0 AS outstanding,
+                       CAST(julianday(?) - julianday(COALESCE(pd.first_due, s.created_date)) AS INTEGER) AS days
+                FROM students s
+                JOIN balance b ON b.student_id = s.id
+                LEFT JOIN paid pd ON pd.student_id = s.id
+                LEFT JOIN last_payment lp ON lp.student_id = s.id AND lp.rn = 1
+                WHERE b.balance_paise > 0 AND s.left_date IS NULL
+            ),
+            bucketed AS (
+                SELECT *, {bucket_case} AS bucket FROM outstanding
+            )
+        """
+        params = balance_params + [date.today().isoformat()]
+        return cte, params
+
+    def aging_detail_query(self, after=None, limit=None):
+        """Per-student aging rows, oldest dues first, with class and bucket totals via window functions.
+
+        With a limit, only that many rows are returned, each followed by its sort key
+        (-days, class, name, id); passing the last key back as after seeks to the next page.
+        The window totals are computed before the seek, so they still cover every student.
+        """
+        cte, params = self.aging_cte()
+        key_columns = ", seek_days, class, name, id" if limit is not None else ""
+        query = cte + f"""
+            SELECT name, class, contact, payment_mode, days_outstanding, bucket, outstanding,
+                   class_bucket_total, class_rank{key_columns}
+            FROM (
+                SELECT *, MAX(days, 0) AS days_outstanding, -COALESCE(days, 0) AS seek_days,
+                       SUM(outstanding) OVER (PARTITION BY class, bucket) AS class_bucket_total,
+                       RANK() OVER (PARTITION BY class ORDER BY days DESC) AS class_rank
+                FROM bucketed
+            )
+        """
+        if after is not None:
+            query += " WHERE (seek_days, class, name, id) > (?, ?, ?, ?)"
+            params.extend(after)
+        query += " ORDER BY seek_days, class, name, id"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return query, params
+
+    def aging_summary_query(self):
+        """Outstanding amounts pivoted by aging bucket, per class, per payment mode and overall"""
+        cte, params = self.aging_cte()
+        labels = ["Not Due"] + [label for label, _ in self.AGING_BUCKETS]
+        pivot = ", ".join(f"SUM(CASE WHEN bucket = '{label}' THEN outstanding ELSE 0 END)" for label in labels)
+        query = cte + f"""
+            SELECT 'Class', class, {pivot}, SUM(outstanding), COUNT(*) FROM bucketed GROUP BY class
+            UNION ALL
+            SELECT 'Payment Mode', payment_mode, {pivot}, SUM(outstanding), COUNT(*) FROM bucketed GROUP BY payment_mode
+            UNION ALL
+            SELECT 'Total', 'All', {pivot}, SUM(outstanding), COUNT(*) FROM bucketed
+        """
+        return query, params, labels
+
+    def show_aging_report(self):
+        """Show the aging of outstanding fees in a popup, rendering detail rows page by page"""
+        aging_win = tk.Toplevel(self.root)
+        aging_win.title("Fee Aging Report")
+        aging_win.geometry("950x600")
+
+        # Summary pivot (class / payment mode x bucket)
+        summary_query, summary_params, labels = self.aging_summary_query()
+        summary_columns = ("Group", "Name") + tuple(labels) + ("Total", "Students")
+        summary_frame = ttk.LabelFrame(aging_win, text="Outstanding by Bucket", padding="5")
+        summary_frame.pack(fill='x', padx=10, pady=5)
+        summary_tree = ttk.Treeview(summary_frame, columns=summary_columns, show='headings', height=8)
+        for col in summary_columns:
+            summary_tree.heading(col, text=col)
+            summary_tree.column(col, width=85)
+        summary_tree.pack(fill='x')
+        student_count = 0
+        try:
+            self.cursor.execute(summary_query, summary_params)
+            for row in self.cursor.fetchall():
+                if row[0] == 'Total':
+                    student_count = row[-1]
+                if row[-1] == 0:
+                    continue  # Nothing outstanding (e.g. empty totals row)
+                values = row[:2] + tuple(f"₹{amount or 0:.2f}" for amount in row[2:-1]) + (row[-1],)
+                summary_tree.insert('', 'end', values=values)
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Error building aging summary: {e}", parent=aging_win)
+            return
+
+        # Detail list
+        detail_frame = ttk.LabelFrame(aging_win, text="Outstanding Students", padding="5")
+        detail_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        detail_columns = ("Name", "Class", "Contact", "Last Mode", "Days", "Bucket", "Outstanding", "Class Bucket Total")
+        tree = ttk.Treeview(detail_frame, columns=detail_columns, show='headings')
+        for col in detail_columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=100)
+        paging = {'after': None, 'more': True, 'shown': 0}
+
+        def render_next_page():
+            # Fetch the next page, seeking past the last row shown, as the user scrolls towards the end
+            query, params = self.aging_detail_query(paging['after'], self.AGING_PAGE_SIZE + 1)
+            self.cursor.execute(query, params)
+            rows = self.cursor.fetchall()
+            paging['more'] = len(rows) > self.AGING_PAGE_SIZE
+            rows = rows[:self.AGING_PAGE_SIZE]
+            for i, row in enumerate(rows, paging['shown']):
+                name, class_name, contact, mode, days, bucket, outstanding, class_bucket_total = row[:8]
+                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
+                tree.insert('', 'end', values=(name, class_name, contact, mode, days, bucket,
+                                               f"₹{outstanding:.2f}", f"₹{class_bucket_total:.2f}"), tags=(tag,))
+            if rows:
+                paging['after'] = rows[-1][9:]
+            paging['shown'] += len(rows)
+
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) >= 0.9 and paging['more']:
+                render_next_page()
 
-        for row in self.cursor.fetchall():
-            name, class_name, contact, total_paid = row
-            total_paid = total_paid or 0.0 # Handle students with no payments
-            pending_amount = self.TOTAL_FEE - total_paid
-            tree.insert('', 'end', values=(name, class_name, contact, f"₹{pending_amount:.2f}"))
+        scrollbar = ttk.Scrollbar(detail_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=on_scroll)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        tree.tag_configure('evenrow', background='lightblue')
+        tree.tag_configure('oddrow', background='white')
+        render_next_page()
+
+        button_frame = ttk.Frame(aging_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(button_frame, text=f"{student_count} students with outstanding fees").pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Export to CSV", command=lambda: self.export_aging_csv(aging_win)).pack(side='right', padx=5)
+
+    def export_aging_csv(self, parent=None):
+        """Export the per-student aging report to CSV, streaming rows from the query"""
+        import csv
+        csv_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")],
+            title="Export Aging Report",
+            parent=parent
+        )
+        if not csv_path:
+            return
+        try:
+            detail_query, detail_params = self.aging_detail_query()
+            cursor = self.conn.cursor()
+            cursor.execute(detail_query, detail_params)
+            with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['Student Name', 'Class', 'Contact', 'Last Payment Mode', 'Days Outstanding',
+                                 'Bucket', 'Outstanding', 'Class Bucket Total', 'Rank in Class'])
+                writer.writerows(cursor)
+            cursor.close()
+            messagebox.showinfo("Success", f"Aging report exported to:\n{csv_path}", parent=parent)
+        except Exception as e:
+            messagebox.showerror("Error", f"Error exporting aging report: {e}", parent=parent)
 
     def delete_selected_payment(self):
         """Delete the selected payment from the recent payments treeview"""
@@ -1177,11 +6084,13 @@ class FeeReceiptApp:
         payment_id = item['values'][0]
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this payment record?"):
             try:
+                self.cursor.execute("SELECT student_id FROM payments WHERE id = ?", (payment_id,))
+                row = self.cursor.fetchone()
                 self.cursor.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
                 self.conn.commit()
-                self.load_recent_payments()
-                self.load_payment_history()
-                self.update_fee_info()
+                if row:
+                    self.student_cache.invalidate(row[0])
+                self.changes.publish('payments', [payment_id])
                 messagebox.showinfo("Deleted", "Payment record deleted successfully.")
             except Exception as e:
                 messagebox.showerror("Error", f"Could not delete payment: {e}")
@@ -1195,12 +6104,7 @@ class FeeReceiptApp:
         item = self.history_tree.item(selected[0])
         payment_id = item['values'][0]
         # Fetch payment and student info for this payment_id
-        self.cursor.execute("""
-            SELECT p.*, s.name, s.class, s.contact, s.mother_name, s.father_name, s.parent_number, s.parent_email
-            FROM payments p 
-            JOIN students s ON p.student_id = s.id 
-            WHERE p.id = ?
-        """, (payment_id,))
+        self.cursor.execute(self.RECEIPT_SELECT_SQL + " WHERE p.id = ?", (payment_id,))
         payment_data = self.cursor.fetchone()
         if not payment_data:
             messagebox.showerror("Error", "Payment record not found.")
@@ -1213,6 +6117,7 @@ class FeeReceiptApp:
             (receipt_path, payment_id)
         )
         self.conn.commit()
+        self.changes.publish('payments', [payment_id])
         # Ask if user wants to open the receipt
         if messagebox.askyesno("Receipt Generated", 
                              f"Receipt saved as:\n{receipt_path}\n\nWould you like to open the Receipts folder to send it via WhatsApp?"): # Modified message
@@ -1220,85 +6125,55 @@ class FeeReceiptApp:
             # Add prompt to open WhatsApp Web
             if messagebox.askyesno("Send via WhatsApp", "Would you like to open WhatsApp Web now to send the receipt?"):
                 self.open_whatsapp_web()
-        # Refresh displays
-        self.load_recent_payments()
-        self.load_payment_history()
 
     def filter_payments_tree(self, status):
-        # Filter recent payments by status
-        for item in self.payment_tree.get_children():
-            self.payment_tree.delete(item)
-        query = '''SELECT p.id, s.name, s.class, p.due_date, p.paid_date, p.amount, p.status, p.payment_mode FROM payments p JOIN students s ON p.student_id = s.id'''
-        params = []
-        if status != 'All':
-            query += ' WHERE p.status = ?'
-            params.append(status)
-        query += ' ORDER BY p.created_date DESC LIMIT 20'
-        self.cursor.execute(query, params)
-        payments = self.cursor.fetchall()
-        for payment in payments:
-            tag = 'cleared' if payment[6] == 'Cleared' else 'pending'
-            # We are adding payment_mode to the end of the payment tuple, so it is at index 7.
-            # The treeview columns now expect 8 values, so we should pass all of them.
-            self.payment_tree.insert('', 'end', values=payment, tags=(tag,))
-        self.payment_tree.tag_configure('cleared', background='#d4f7d4')
-        self.payment_tree.tag_configure('pending', background='#ffd6d6')
+        # Filter recent payments by status; a page holding every payment is narrowed in memory
+        if self.recent_status == 'All' and self.page_is_complete('recent'):
+            self.quick_filter('recent', 'Status', status)
+            return
+        self.tree_views['recent']['filters'].pop('Status', None)
+        self.recent_status = status
+        self.load_recent_page()
 
     def filter_history_tree(self, status):
-        # Filter payment history by status
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
-        query = '''SELECT p.id, s.name, s.class, s.contact, p.due_date, p.paid_date, p.amount, p.status, p.receipt_path, p.payment_mode FROM payments p JOIN students s ON p.student_id = s.id'''
-        params = []
+        # Filter payment history by status; a page holding every payment is narrowed in memory
+        if self.history_filter[2][2] is None and self.page_is_complete('history'):
+            self.quick_filter('history', 'Status', status)
+            return
+        self.tree_views['history']['filters'].pop('Status', None)
+        conditions, params = [], []
         if status != 'All':
-            query += ' WHERE p.status = ?'
+            conditions.append("p.status = ?")
             params.append(status)
-        query += ' ORDER BY p.created_date DESC'
-        self.cursor.execute(query, params)
-        payments = self.cursor.fetchall()
-        for i, payment in enumerate(payments):
-            row_tag = 'evenrow' if i % 2 == 0 else 'oddrow' # For alternating row colors
-            status_tag = 'cleared' if payment[7] == 'Cleared' else 'pending' # Corrected index for status
-            receipt_status = 'Yes' if payment[8] else 'No' # Corrected index for receipt_path
-            display_payment = payment[:8] + (receipt_status, payment[9],) # Append receipt status and payment mode
-            self.history_tree.insert('', 'end', values=display_payment, tags=(row_tag, status_tag))
-        self.history_tree.tag_configure('cleared', background='#d4f7d4')
-        self.history_tree.tag_configure('pending', background='#ffd6d6')
-        self.history_tree.tag_configure('evenrow', background='lightblue') # Ensure these are configured
-        self.history_tree.tag_configure('oddrow', background='white')
+        self.history_filter = (conditions, params, self.history_filter_key(status=status), {})
+        self.load_history_page()
 
     def update_summary_bar(self):
-        # Show total due and total cleared amounts based on overall student payment status
-        # Calculate total paid per student
-        self.cursor.execute("""
-            SELECT student_id, SUM(amount) as total_paid
-            FROM payments
-            GROUP BY student_id
-        """)
-        student_totals = dict(self.cursor.fetchall())
-
-        total_pending_amount = 0.0
-        total_cleared_value = 0.0 # Represents the sum of TOTAL_FEE for cleared students
-
-        self.cursor.execute("SELECT id FROM students") # Get all student IDs
-        all_student_ids = [row[0] for row in self.cursor.fetchall()]
+        # Show total due and total cleared amounts based on overall student payment status.
+        # Pending is the sum of the students' ledger balances still owed; cleared is what was
+        # paid this academic year by students who owe nothing. Aggregated in one query.
+        balance_query, balance_params = self.ledger_balance_query()
+        self.cursor.execute(f"""
+            SELECT COALESCE(SUM(CASE WHEN b.balance_paise > 0 THEN b.balance_paise ELSE 0 END), 0),
+                   COALESCE(SUM(CASE WHEN b.balance_paise <= 0 THEN y.paid ELSE 0 END), 0)
+            FROM ({balance_query}) b
+            JOIN students s ON s.id = b.student_id
+            LEFT JOIN (
+                SELECT student_id, SUM(amount_paise) AS paid FROM payments
+                WHERE paid_day >= ? GROUP BY student_id
+            ) y ON y.student_id = b.student_id
+        """, balance_params + [self.year_start_day()])
+        total_pending_amount, total_cleared_value = (paise / 100 for paise in self.cursor.fetchone())
 
-        for student_id in all_student_ids:
-            paid = student_totals.get(student_id, 0.0)
-            if paid < self.TOTAL_FEE:
-                total_pending_amount += (self.TOTAL_FEE - paid)
-            else:
-                total_cleared_value += paid # Student has paid full fee or more, sum the actual paid amount
-
-        self.summary_var.set(f'Total Pending: ₹{total_pending_amount:.2f}    |    Total Cleared: ₹{total_cleared_value:.2f}')
+        self.summary_var.set(f'Total Pending: ₹{total_pending_amount:.2f}    |    Total Cleared (this year): ₹{total_cleared_value:.2f}')
 
     def update_payment_student_list(self, event=None):
         # Update student list in combo and auto-complete based on class filter
         selected_class = self.payment_class_filter.get()
         if selected_class == 'All':
-            self.cursor.execute("SELECT id, name, class FROM students ORDER BY class, name")
+            self.cursor.execute("SELECT id, name, class FROM students WHERE left_date IS NULL ORDER BY class, name")
         else:
-            self.cursor.execute("SELECT id, name, class FROM students WHERE class = ? ORDER BY name", (selected_class,))
+            self.cursor.execute("SELECT id, name, class FROM students WHERE class = ? AND left_date IS NULL ORDER BY name", (selected_class,))
         students = self.cursor.fetchall()
         student_list = [f"{s[1]} ({s[2]}) - ID:{s[0]}" for s in students]
         self.student_combo['values'] = student_list
@@ -1345,8 +6220,8 @@ class FeeReceiptApp:
         )
         if not file_path:
             return
-        count = 0
         try:
+            rows = []
             with open(file_path, newline='', encoding='utf-8') as csvfile:
                 reader = csv.DictReader(csvfile)
                 for row in reader:
@@ -1359,21 +6234,47 @@ class FeeReceiptApp:
                     parent_email = row.get('parent_email', '').strip()
                     if not name or not class_name:
                         continue  # skip incomplete rows
-                    try:
-                        self.cursor.execute(
-                            "INSERT INTO students (name, class, contact, mother_name, father_name, parent_number, parent_email) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                            (name, class_name, contact, mother_name, father_name, parent_number, parent_email)
-                        )
-                        count += 1
-                    except Exception:
-                        continue
-                self.conn.commit()
-            self.load_students()
-            self.load_student_combo()
-            messagebox.showinfo("Import Complete", f"Imported {count} students from CSV.")
+                    rows.append((name, class_name, contact, mother_name, father_name, parent_number, parent_email))
+
+            # Check each row against students on file and earlier rows of the same file
+            index = self.duplicate_index()
+            duplicates = set()
+            for i, row in enumerate(rows):
+                student = (None,) + row[:6]
+                if index.matches(student):
+                    duplicates.add(i)
+                index.add(student)
+            skip = set()
+            if duplicates:
+                names = ", ".join(rows[i][0] for i in sorted(duplicates)[:10])
+                if not messagebox.askyesno("Possible Duplicates",
+                                           f"{len(duplicates)} rows look like students already on file "
+                                           f"or earlier in this file ({names}{', ...' if len(duplicates) > 10 else ''}).\n\n"
+                                           "Import them anyway?"):
+                    skip = duplicates
+
+            rows = [row for i, row in enumerate(rows) if i not in skip]
+            # The rows travel with the job, so it can finish even if the file is moved meanwhile
+            self.start_job('import_students', 'students', {'rows': rows, 'skipped': len(skip)}, len(rows))
         except Exception as e:
             messagebox.showerror("Import Error", f"Failed to import: {e}")
 
+    def job_import_students(self, params, checkpoint):
+        """Job step: insert the next chunk of imported students"""
+        rows = params['rows']
+        start, count = checkpoint or (0, 0)
+        for row in rows[start:start + self.IMPORT_JOB_CHUNK]:
+            try:
+                self.cursor.execute(
+                    "INSERT INTO students (name, class, contact, mother_name, father_name, parent_number, parent_email) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    row
+                )
+                count += 1
+            except sqlite3.Error:
+                continue
+        end = min(start + self.IMPORT_JOB_CHUNK, len(rows))
+        return (end, count), end, len(rows), end == len(rows)
+
     def save_student_changes(self):
         """Save changes to an existing student or add a new one"""
         name = self.student_name.get().strip()
@@ -1387,6 +6288,9 @@ class FeeReceiptApp:
         if not name or not class_name:
             messagebox.showerror("Error", "Name and Class are required fields!")
             return
+        student_id = int(self.selected_student_id) if self.selected_student_id is not None else None
+        if not self.confirm_not_duplicate((student_id, name, class_name, contact, mother_name, father_name, parent_number)):
+            return
 
         try:
             if self.selected_student_id is None:
@@ -1395,6 +6299,7 @@ class FeeReceiptApp:
                     "INSERT INTO students (name, class, contact, mother_name, father_name, parent_number, parent_email) VALUES (?, ?, ?, ?, ?, ?, ?)",
                     (name, class_name, contact, mother_name, father_name, parent_number, parent_email)
                 )
+                student_id = self.cursor.lastrowid
                 self.conn.commit()
                 messagebox.showinfo("Success", f"Student '{name}' added successfully!")
             else:
@@ -1404,11 +6309,10 @@ class FeeReceiptApp:
                     (name, class_name, contact, mother_name, father_name, parent_number, parent_email, self.selected_student_id)
                 )
                 self.conn.commit()
+                self.student_cache.invalidate(student_id)
                 messagebox.showinfo("Success", f"Student '{name}' updated successfully!")
 
-            # Refresh displays and clear form
-            self.load_students()
-            self.load_student_combo()
+            self.changes.publish('students', [student_id])
             self.clear_student_form()
 
         except sqlite3.Error as e:
@@ -1435,13 +6339,11 @@ class FeeReceiptApp:
         values = self.student_tree.item(selected_item, 'values')
         # Values are: ID, Name, Class, Contact, Mother Name, Father Name, Parent Number, Parent Email, Created Date
         student_id = values[0]
-        name = values[1]
-        class_name = values[2]
-        contact = values[3]
-        mother_name = values[4]
-        father_name = values[5]
-        parent_number = values[6]
-        parent_email = values[7]
+        record = self.student_record(int(student_id))
+        if record is None:
+            return # Deleted by another copy since the list was loaded
+        name, class_name, contact, mother_name, father_name, parent_number, parent_email = (
+            value or '' for value in record[1:8])
 
         # Populate form fields
         self.clear_student_form() # Clear first
@@ -1468,20 +6370,142 @@ class FeeReceiptApp:
         student_id = values[0]
         student_name = values[1]
 
-        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete student '{student_name}'\n\nNote: This will NOT delete associated payment records."):
+        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete student '{student_name}'\n\nNote: This will NOT delete associated payment records. They can be reattached to another student from Settings > Database Maintenance."):
             try:
-                # Note: This only deletes the student record. Associated payments will remain
-                # linked to a non-existent student ID. For a robust application, you might
-                # want to also delete related payments or handle them differently.
+                # Only the student record is deleted. The next maintenance run moves their payments
+                # to orphaned_payments, from where they can be reattached to another student.
                 self.cursor.execute("DELETE FROM students WHERE id = ?", (student_id,))
                 self.conn.commit()
-                self.load_students()
-                self.load_student_combo()
+                self.student_cache.invalidate(int(student_id))
+                self.changes.publish('students', [int(student_id)])
                 self.clear_student_form() # Clear form if the deleted student was being edited
                 messagebox.showinfo("Deleted", f"Student '{student_name}' deleted successfully.")
             except Exception as e:
                 messagebox.showerror("Error", f"Could not delete student: {e}")
 
+    def duplicate_index(self):
+        """Build a DuplicateIndex over every student currently on file"""
+        self.cursor.execute("SELECT id, name, class, contact, mother_name, father_name, parent_number FROM students")
+        return DuplicateIndex(self.cursor.fetchall())
+
+    def confirm_not_duplicate(self, student):
+        """Warn if a student row looks like someone already on file; return True to go ahead and save"""
+        matches = self.duplicate_index().matches(student)
+        if not matches:
+            return True
+        lines = "\n".join(f"  • {other[1]} ({other[2]}), ID {other[0]}, parent no. {other[6] or '-'}"
+                          for _, other in matches[:5])
+        return messagebox.askyesno("Possible Duplicate",
+                                   f"'{student[1]}' looks like a student already on file:\n\n{lines}\n\n"
+                                   "Save anyway? (Use 'Find Duplicates' to merge records.)")
+
+    def merge_students(self, keep_id, drop_id):
+        """Merge a duplicate student into the surviving one in a single transaction.
+
+        Payments (including archived years) move to keep_id, blank details on the survivor
+        are filled from the duplicate, the duplicate's ledger is closed with its non-fee
+        balance carried across, and the duplicate record is deleted.
+        """
+        # Archived payments move too, so attach every archive before the transaction starts
+        archives = {self.archive_alias(label): self.archive_path(label) for label in self.list_archived_years()}
+        self.payments_source(archives)
+        try:
+            self.cursor.execute("UPDATE payments SET student_id = ? WHERE student_id = ?", (keep_id, drop_id))
+            moved = self.cursor.rowcount
+            for alias in archives:
+                self.cursor.execute(f"UPDATE {alias}.payments SET student_id = ? WHERE student_id = ?", (keep_id, drop_id))
+                moved += self.cursor.rowcount
+            fill = ", ".join(f"{column} = COALESCE(NULLIF({column}, ''), (SELECT {column} FROM students WHERE id = :drop))"
+                             for column in ("contact", "mother_name", "father_name", "parent_number", "parent_email"))
+            self.cursor.execute(f"UPDATE students SET {fill} WHERE id = :keep", {'keep': keep_id, 'drop': drop_id})
+
+            # Hot payments were re-posted by the ledger triggers; what is left on the duplicate is its
+            # annual fee, manual adjustments and archived payments. Carry all but the fee across.
+            self.cursor.execute("""
+                SELECT COALESCE(SUM(amount_paise), 0),
+                       COALESCE(SUM(CASE WHEN entry_type = 'adjustment' AND payment_id IS NULL AND note = 'Annual fee'
+                                         THEN amount_paise END), 0)
+                FROM ledger WHERE student_id = ?
+            """, (drop_id,))
+            balance, annual_fee = self.cursor.fetchone()
+            today = date.today().isoformat()
+            if balance - annual_fee:
+                self.cursor.execute(
+                    "INSERT INTO ledger (student_id, entry_type, amount_paise, entry_date, note) VALUES (?, 'adjustment', ?, ?, ?)",
+                    (keep_id, balance - annual_fee, today, f"Merged from student #{drop_id}")
+                )
+            if balance:
+                self.cursor.execute(
+                    "INSERT INTO ledger (student_id, entry_type, amount_paise, entry_date, note) VALUES (?, 'adjustment', ?, ?, ?)",
+                    (drop_id, -balance, today, f"Merged into student #{keep_id}")
+                )
+            self.cursor.execute("DELETE FROM students WHERE id = ?", (drop_id,))
+            self.refresh_payment_statuses([keep_id])
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        self.student_cache.invalidate(keep_id, drop_id)
+        return moved
+
+    def show_duplicates(self):
+        """List likely duplicate students and merge a chosen pair"""
+        dup_win = tk.Toplevel(self.root)
+        dup_win.title("Possible Duplicate Students")
+        dup_win.geometry("1000x450")
+
+        columns = ('Match', 'ID A', 'Name A', 'Class A', 'Parent No. A', 'Payments A',
+                   'ID B', 'Name B', 'Class B', 'Parent No. B', 'Payments B')
+        tree = ttk.Treeview(dup_win, columns=columns, show='headings')
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=85)
+        tree.pack(fill='both', expand=True, padx=10, pady=5)
+        status_var = tk.StringVar()
+
+        def load():
+            tree.delete(*tree.get_children())
+            pairs = self.duplicate_index().pairs()
+            self.cursor.execute("SELECT student_id, COUNT(*) FROM payments GROUP BY student_id")
+            payment_counts = dict(self.cursor.fetchall())
+            for i, (score, a, b) in enumerate(pairs):
+                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
+                tree.insert('', 'end', values=(f"{min(score, 1.0) * 100:.0f}%",
+                                               a[0], a[1], a[2], a[6], payment_counts.get(a[0], 0),
+                                               b[0], b[1], b[2], b[6], payment_counts.get(b[0], 0)), tags=(tag,))
+            status_var.set(f"{len(pairs)} possible duplicate pairs")
+
+        def merge(keep_side):
+            selected = tree.selection()
+            if not selected:
+                messagebox.showerror("Error", "Please select a pair to merge.", parent=dup_win)
+                return
+            values = tree.item(selected[0], 'values')
+            a, b = (int(values[1]), values[2]), (int(values[6]), values[7])
+            keep, drop = (a, b) if keep_side == 'A' else (b, a)
+            if not messagebox.askyesno("Confirm Merge",
+                                       f"Move all payments of '{drop[1]}' (ID {drop[0]}) to '{keep[1]}' (ID {keep[0]}) "
+                                       f"and delete ID {drop[0]}?", parent=dup_win):
+                return
+            try:
+                moved = self.merge_students(keep[0], drop[0])
+            except sqlite3.Error as e:
+                messagebox.showerror("Database Error", f"Error merging students: {e}", parent=dup_win)
+                return
+            self.changes.publish('students', [keep[0], drop[0]])
+            self.changes.publish('payments')
+            load()
+            messagebox.showinfo("Merged", f"Merged into ID {keep[0]}; {moved} payments moved.", parent=dup_win)
+
+        tree.tag_configure('evenrow', background='lightblue')
+        tree.tag_configure('oddrow', background='white')
+        button_frame = ttk.Frame(dup_win)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(button_frame, textvariable=status_var).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Keep B, Merge A Into It", command=lambda: merge('B')).pack(side='right', padx=5)
+        ttk.Button(button_frame, text="Keep A, Merge B Into It", command=lambda: merge('A')).pack(side='right', padx=5)
+        load()
+
     def open_calendar(self, date_entry):
         """Opens a calendar popup to select a date for the given entry widget."""
         top = tk.Toplevel(self.root)
@@ -1525,4 +6549,7 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # Reminder PDFs are drawn in worker processes, which a frozen Windows build must support
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
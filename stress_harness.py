@@ -0,0 +1,238 @@
+"""Load harness for several counters sharing one fee database.
+
+Simulates N clerks recording payments, searching history, generating receipts
+and exporting, all against the same SQLite file, and reports throughput,
+lock-wait latency and "database is locked" failures. Clerks run as threads,
+spread over one or more processes, so both in-process and multi-instance
+contention can be measured.
+
+    python stress_harness.py --clerks 8 --processes 2 --seconds 20
+    python stress_harness.py --journal-mode wal --busy-timeout 2000 --batch 10
+
+Without --db a seeded scratch database is created in a temporary folder.
+Pass --db only with a copy of a real database: the harness writes to it.
+"""
+import argparse
+import csv
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import BUSY_TIMEOUT_MS, FeeReceiptApp, connect_database
+
+# Relative frequency of each clerk operation
+OPERATION_WEIGHTS = {'record': 40, 'search': 30, 'receipt': 20, 'export': 10}
+SEARCH_PAGE_SIZE = FeeReceiptApp.HISTORY_PAGE_SIZE
+
+
+class Clerk:
+    """One simulated counter clerk with its own connection, running the app's SQL"""
+
+    TOTAL_FEE = FeeReceiptApp.TOTAL_FEE
+    # Borrow the app's status update so contention matches the real write path
+    refresh_payment_statuses = FeeReceiptApp.refresh_payment_statuses
+
+    def __init__(self, db_path, options, seed):
+        self.conn = connect_database(db_path, options.busy_timeout, options.journal_mode)
+        # Transactions are opened explicitly so the write-lock wait can be timed
+        self.conn.isolation_level = None
+        self.cursor = self.conn.cursor()
+        self.options = options
+        self.random = random.Random(seed)
+        self.student_ids = [row[0] for row in self.cursor.execute("SELECT id FROM students")]
+        self.names = [row[0] for row in self.cursor.execute("SELECT name FROM students LIMIT 500")]
+        self.latencies = {name: [] for name in OPERATION_WEIGHTS}
+        self.lock_waits = []
+        self.locked = 0
+        self.errors = 0
+
+    def begin_write(self):
+        """Take the write lock up front and record how long it took"""
+        started = time.perf_counter()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        self.lock_waits.append(time.perf_counter() - started)
+
+    def record(self):
+        today = time.strftime("%Y-%m-%d")
+        payments = [(self.random.choice(self.student_ids), today, today, self.random.choice([500, 1000, 2500]),
+                     'Pending', self.random.choice(FeeReceiptApp.PAYMENT_MODES), None)
+                    for _ in range(self.options.batch)]
+        self.begin_write()
+        self.cursor.executemany(
+            """INSERT INTO payments (student_id, due_date, paid_date, amount, status, payment_mode, reference)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""", payments)
+        self.refresh_payment_statuses({payment[0] for payment in payments})
+        self.cursor.execute("COMMIT")
+
+    def search(self):
+        name = self.random.choice(self.names)[:4]
+        self.cursor.execute(
+            FeeReceiptApp.HISTORY_SELECT_SQL.format(payments='payments')
+            + " WHERE s.name LIKE ? ORDER BY p.created_date DESC, p.id DESC LIMIT ?",
+            (f"%{name}%", SEARCH_PAGE_SIZE))
+        self.cursor.fetchall()
+
+    def receipt(self):
+        # The PDF itself is drawn outside the database; only its reads and write contend
+        self.cursor.execute("SELECT MAX(id) FROM payments")
+        payment_id = self.random.randint(1, self.cursor.fetchone()[0] or 1)
+        self.cursor.execute(FeeReceiptApp.RECEIPT_SELECT_SQL + " WHERE p.id = ?", (payment_id,))
+        if self.cursor.fetchone() is None:
+            return
+        self.begin_write()
+        self.cursor.execute("UPDATE payments SET receipt_path = ? WHERE id = ?",
+                            (os.path.join("receipts", f"receipt_{payment_id}.pdf"), payment_id))
+        self.cursor.execute("COMMIT")
+
+    def export(self):
+        self.cursor.execute("""
+            SELECT s.name, s.class, s.contact, p.due_date, p.paid_date,
+                   p.amount, p.status, p.created_date, p.payment_mode
+            FROM payments p
+            JOIN students s ON p.student_id = s.id
+            ORDER BY p.created_date DESC
+        """)
+        with open(os.devnull, 'w', newline='') as sink:
+            csv.writer(sink).writerows(self.cursor)
+
+    def run(self, start_at, stop_at):
+        operations, weights = zip(*OPERATION_WEIGHTS.items())
+        time.sleep(max(0, start_at - time.time()))
+        while time.time() < stop_at:
+            operation = self.random.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                getattr(self, operation)()
+            except sqlite3.OperationalError as e:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                if 'locked' in str(e) or 'busy' in str(e):
+                    self.locked += 1
+                else:
+                    self.errors += 1
+                continue
+            self.latencies[operation].append(time.perf_counter() - started)
+            if self.options.think_ms:
+                time.sleep(self.random.uniform(0, 2 * self.options.think_ms) / 1000)
+        self.conn.close()
+        return {'latencies': self.latencies, 'lock_waits': self.lock_waits,
+                'locked': self.locked, 'errors': self.errors}
+
+
+def run_clerks(db_path, options, clerk_numbers, start_at, stop_at):
+    """Run a group of clerks as threads and return their combined results"""
+    results = []
+
+    def work(number):
+        results.append(Clerk(db_path, options, number).run(start_at, stop_at))
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in clerk_numbers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def create_database(folder, students, payments):
+    """Build a scratch database with the app's schema and some seeded rows"""
+    app = FeeReceiptApp.__new__(FeeReceiptApp)
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        app.DB_PATH = os.path.join(folder, "db", "students.db")
+        app.init_database()
+    finally:
+        os.chdir(cwd)
+    rnd = random.Random(0)
+    app.cursor.executemany(
+        "INSERT INTO students (name, class, contact, parent_number, created_date) VALUES (?, ?, ?, ?, ?)",
+        [(f"Student {i}", rnd.choice(FeeReceiptApp.CLASS_OPTIONS), f"98{i:08d}", f"97{i:08d}", "2024-06-01")
+         for i in range(students)])
+    app.cursor.executemany(
+        """INSERT INTO payments (student_id, due_date, paid_date, amount, status, payment_mode, created_date)
+           VALUES (?, ?, ?, ?, 'Pending', 'Cash', ?)""",
+        [(rnd.randint(1, students), day, day, rnd.choice([1000, 2500, 5000]), day + " 10:00:00")
+         for day in (f"2024-{rnd.randint(6, 12):02d}-{rnd.randint(1, 28):02d}" for _ in range(payments))])
+    app.refresh_payment_statuses(range(1, students + 1))
+    app.conn.commit()
+    app.conn.close()
+    return app.DB_PATH
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(results, options, elapsed):
+    print(f"journal_mode={options.journal_mode or 'unchanged'} busy_timeout={options.busy_timeout}ms "
+          f"batch={options.batch} clerks={options.clerks} processes={options.processes} seconds={elapsed:.1f}")
+    print(f"{'operation':<10}{'count':>8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    total = 0
+    for operation in OPERATION_WEIGHTS:
+        latencies = [value for result in results for value in result['latencies'][operation]]
+        total += len(latencies)
+        print(f"{operation:<10}{len(latencies):>8}{len(latencies) / elapsed:>9.1f}"
+              f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+              f"{max(latencies, default=0) * 1000:>9.1f}")
+    waits = [value for result in results for value in result['lock_waits']]
+    locked = sum(result['locked'] for result in results)
+    errors = sum(result['errors'] for result in results)
+    print(f"{'total':<10}{total:>8}{total / elapsed:>9.1f}")
+    print(f"write lock wait: p50 {percentile(waits, 0.5) * 1000:.1f} ms, p95 {percentile(waits, 0.95) * 1000:.1f} ms, "
+          f"max {max(waits, default=0) * 1000:.1f} ms over {len(waits)} writes")
+    print(f"'database is locked' failures: {locked} ({locked / max(1, total + locked):.2%}), other errors: {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate several clerks sharing one fee database")
+    parser.add_argument("--db", help="database to use (default: a seeded scratch database)")
+    parser.add_argument("--clerks", type=int, default=4, help="total number of simulated clerks")
+    parser.add_argument("--processes", type=int, default=2, help="processes the clerks are spread over")
+    parser.add_argument("--seconds", type=float, default=10, help="how long to run")
+    parser.add_argument("--journal-mode", choices=["delete", "truncate", "persist", "wal"],
+                        help="journal mode to set on the database (default: leave as is)")
+    parser.add_argument("--busy-timeout", type=int, default=BUSY_TIMEOUT_MS,
+                        help="busy timeout in milliseconds")
+    parser.add_argument("--batch", type=int, default=1, help="payments recorded per write transaction")
+    parser.add_argument("--think-ms", type=int, default=0, help="average pause between a clerk's operations")
+    parser.add_argument("--students", type=int, default=2000, help="students in the scratch database")
+    parser.add_argument("--payments", type=int, default=20000, help="payments in the scratch database")
+    options = parser.parse_args()
+
+    scratch = None
+    db_path = options.db
+    if not db_path:
+        scratch = tempfile.mkdtemp(prefix="fee_stress_")
+        db_path = create_database(scratch, options.students, options.payments)
+    if options.journal_mode:
+        # The journal mode is a property of the file, so set it once before the clerks start
+        connect_database(db_path, options.busy_timeout, options.journal_mode).close()
+
+    processes = max(1, min(options.processes, options.clerks))
+    groups = [range(start, options.clerks, processes) for start in range(processes)]
+    start_at = time.time() + 1 + processes * 0.5
+    stop_at = start_at + options.seconds
+    try:
+        if processes == 1:
+            results = run_clerks(db_path, options, groups[0], start_at, stop_at)
+        else:
+            with ProcessPoolExecutor(processes) as pool:
+                futures = [pool.submit(run_clerks, db_path, options, group, start_at, stop_at) for group in groups]
+                results = [result for future in futures for result in future.result()]
+        report(results, options, stop_at - start_at)
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()